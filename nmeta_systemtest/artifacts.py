@@ -0,0 +1,180 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Bulk collection and archiving of nmeta system test artifacts.
+
+Test playbooks leave the results of each host in the results
+directory on that host. Rather than fetching them file by file,
+the collection playbook packs the results directory of every host
+into one compressed bundle and fetches them all in a single play,
+so hosts transfer concurrently, and the bundles are unpacked into
+the local results directory for analysis.
+
+Runs older than a set age are each packed into a single ZIP
+archive beside where the run directory was. The archive's central
+directory indexes its members, so the result parsers open a result
+file straight from the archive, without extracting, through
+open_result, and list a result directory through list_results.
+"""
+
+import datetime
+import errno
+import io
+import os
+import re
+import shutil
+import tarfile
+import zipfile
+
+#*** Bundles fetched from each host, in the local results directory:
+BUNDLE_DIR = '.collect'
+BUNDLE_SUFFIX = '.tgz'
+
+#*** Archive of a packed run, named after its run directory:
+ARCHIVE_SUFFIX = '.zip'
+RUN_DIR_RE = re.compile(r"^\d{14}$")
+RUN_TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
+
+def extract_bundles(logger, results_dir):
+    """
+    Unpack the bundles fetched from each host into a results
+    directory and remove them. Returns the number of files unpacked
+    """
+    bundle_dir = os.path.join(results_dir, BUNDLE_DIR)
+    if not os.path.isdir(bundle_dir):
+        return 0
+    count = 0
+    for filename in sorted(os.listdir(bundle_dir)):
+        if not filename.endswith(BUNDLE_SUFFIX):
+            continue
+        with tarfile.open(os.path.join(bundle_dir, filename)) as bundle:
+            #*** Only plain files and directories within the results:
+            members = [member for member in bundle.getmembers()
+                        if (member.isfile() or member.isdir()) and
+                        not os.path.isabs(member.name) and
+                        not os.path.normpath(member.name).startswith('..')]
+            if hasattr(tarfile, 'data_filter'):
+                bundle.extractall(results_dir, members, filter='data')
+            else:
+                bundle.extractall(results_dir, members)
+        files = sum(1 for member in members if member.isfile())
+        logger.debug("unpacked %s files from bundle %s", files, filename)
+        count += files
+    shutil.rmtree(bundle_dir)
+    return count
+
+def open_result(filename, binary=False):
+    """
+    Open a result file for reading, from the archive of its run if
+    the run has been packed. Raises IOError if it is in neither
+    """
+    try:
+        return open(filename, 'rb' if binary else 'r')
+    except IOError as exception:
+        if exception.errno != errno.ENOENT:
+            raise
+        archive, member = find_archive(filename)
+        if archive is None:
+            raise
+    with zipfile.ZipFile(archive) as packed:
+        try:
+            filehandle = packed.open(member)
+        except KeyError:
+            raise IOError(errno.ENOENT, "No such file in %s" % archive,
+                                                                filename)
+    return filehandle if binary else io.TextIOWrapper(filehandle)
+
+def list_results(directory):
+    """
+    Return the names of the entries of a result directory, from the
+    archive of its run if the run has been packed. Raises OSError if
+    it is in neither
+    """
+    try:
+        return os.listdir(directory)
+    except OSError as exception:
+        if exception.errno != errno.ENOENT:
+            raise
+        #*** Members of the directory share the prefix of any file in it:
+        archive, member = find_archive(os.path.join(directory, '_'))
+        if archive is None:
+            raise
+    prefix = member[:-1]
+    with zipfile.ZipFile(archive) as packed:
+        #*** Members further down give the names of subdirectories:
+        names = set(name[len(prefix):].split('/')[0]
+                        for name in packed.namelist()
+                        if name.startswith(prefix)) - set([''])
+    if not names:
+        raise OSError(errno.ENOENT, "No such directory in %s" % archive,
+                                                                directory)
+    return sorted(names)
+
+def find_archive(filename):
+    """
+    Return (archive, member) of the packed run archive that holds a
+    result file, or (None, None) if no directory above it is packed
+    """
+    path = os.path.abspath(filename)
+    directory = os.path.dirname(path)
+    while True:
+        archive = directory + ARCHIVE_SUFFIX
+        if os.path.isfile(archive):
+            return archive, os.path.relpath(path, directory).replace(
+                                                                os.sep, '/')
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None, None
+        directory = parent
+
+def pack_run(logger, basedir):
+    """
+    Pack a run directory into a compressed archive beside it and
+    remove the directory. Returns the filename of the archive
+    """
+    basedir = os.path.normpath(basedir)
+    archive = basedir + ARCHIVE_SUFFIX
+    temp_archive = archive + '.tmp'
+    size = 0
+    with zipfile.ZipFile(temp_archive, 'w', zipfile.ZIP_DEFLATED,
+                                                    True) as packed:
+        for dirpath, dirnames, filenames in os.walk(basedir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                size += os.path.getsize(path)
+                packed.write(path, os.path.relpath(path, basedir))
+    os.rename(temp_archive, archive)
+    shutil.rmtree(basedir)
+    logger.info("packed run=%s files=%.1fMB archive=%.1fMB",
+                    os.path.basename(basedir), size / 1e6,
+                    os.path.getsize(archive) / 1e6)
+    return archive
+
+def pack_runs(logger, root, days, now=None):
+    """
+    Pack every run directory under a results root that started more
+    than a number of days ago. Returns the list of archives written
+    """
+    cutoff = (now or datetime.datetime.now()) - \
+                                        datetime.timedelta(days=days)
+    archives = []
+    for name in sorted(os.listdir(root)):
+        basedir = os.path.join(root, name)
+        if not RUN_DIR_RE.match(name) or not os.path.isdir(basedir) or \
+                        datetime.datetime.strptime(name,
+                        RUN_TIMESTAMP_FORMAT) >= cutoff:
+            continue
+        archives.append(pack_run(logger, basedir))
+    return archives
@@ -0,0 +1,91 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Ansible callback plugin that times each task of a playbook on each
+host for the nmeta system test trace.
+
+Enabled by the nmeta system test execution backends, which set
+NMETA_TRACE_TASKS to the file to append a JSON line per task
+result to. Does nothing if it is not set.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import os
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+DOCUMENTATION = '''
+    callback: nmeta_trace
+    type: aggregate
+    short_description: times tasks for the nmeta system test trace
+    description:
+      - Appends the start and end time of each task on each host to
+        the file named by the NMETA_TRACE_TASKS environment variable
+    requirements:
+      - enable in configuration
+'''
+
+#*** Environment variable naming the file to write task timings to:
+TRACE_TASKS_ENV = 'NMETA_TRACE_TASKS'
+
+class CallbackModule(CallbackBase):
+    """
+    Write the timing of each task result as a JSON line
+    """
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'nmeta_trace'
+    CALLBACK_NEEDS_WHITELIST = True
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        self.filename = os.environ.get(TRACE_TASKS_ENV)
+        self.task = None
+        self.task_start = None
+
+    def _task_start(self, task):
+        self.task = task.get_name()
+        self.task_start = time.time()
+
+    def _result(self, result, status):
+        if not self.filename or self.task_start is None:
+            return
+        with open(self.filename, 'a') as filehandle:
+            filehandle.write(json.dumps({'task': self.task,
+                            'host': result._host.get_name(),
+                            'start': self.task_start, 'end': time.time(),
+                            'status': status}) + "\n")
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._task_start(task)
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self._task_start(task)
+
+    def v2_runner_on_ok(self, result):
+        self._result(result, 'ok')
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._result(result, 'failed')
+
+    def v2_runner_on_skipped(self, result):
+        self._result(result, 'skipped')
+
+    def v2_runner_on_unreachable(self, result):
+        self._result(result, 'unreachable')
@@ -0,0 +1,105 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+nmeta controller lifecycle management for the system tests.
+
+nmeta reads its main policy at startup, so a controller can be
+reused by consecutive test cases that use the same policy. The
+ControllerManager starts nmeta once per policy and only restarts
+it when the policy actually changes. Test playbooks are then run
+with manage_controller=false so they leave the controller alone.
+"""
+
+import collections
+
+import tracing
+
+class ControllerManager(object):
+    """
+    Tracks the policy that nmeta is running with on one testbed and
+    restarts it only when a different policy is needed
+    """
+    def __init__(self, testbed, start_playbook, stop_playbook):
+        self.testbed = testbed
+        self.start_playbook = start_playbook
+        self.stop_playbook = stop_playbook
+        #*** Policy that nmeta is currently running with, if any:
+        self.policy_name = None
+        self.restarts = 0
+        self.reuses = 0
+        self.restart_seconds = 0.0
+
+    def ensure(self, logger, policy_name, pause1):
+        """
+        Make sure nmeta is running with the passed policy,
+        restarting it if needed. pause1 is the longest time to wait
+        for the switch to connect. Returns True if it restarted
+        """
+        if policy_name == self.policy_name:
+            self.reuses += 1
+            logger.info("testbed=%s reusing nmeta with policy=%s",
+                                        self.testbed.name, policy_name)
+            return False
+        logger.info("testbed=%s starting nmeta with policy=%s",
+                                        self.testbed.name, policy_name)
+        with tracing.span('controller restart', 'controller',
+                                                    policy=policy_name):
+            step = self.testbed.run_playbook(logger, self.start_playbook,
+                                        {'policy_name': policy_name,
+                                        'pause1': str(pause1)})
+        self.policy_name = policy_name
+        self.restarts += 1
+        self.restart_seconds += step.seconds
+        return True
+
+    def stop(self, logger):
+        """
+        Stop nmeta if it was started by this manager
+        """
+        if self.policy_name is None:
+            return
+        logger.info("testbed=%s stopping nmeta", self.testbed.name)
+        self.policy_name = None
+        self.testbed.run_playbook(logger, self.stop_playbook, {})
+
+    def saved(self):
+        """
+        Return an estimate of the seconds saved by reusing the
+        controller, based on the mean measured restart time
+        """
+        if not self.restarts:
+            return 0.0
+        return self.reuses * self.restart_seconds / self.restarts
+
+def order_by_policy(cases):
+    """
+    Passed a list of test cases, return them reordered so that cases
+    sharing a policy_name are adjacent, minimising the number of
+    controller restarts. Policies keep the order they first appear
+    in and cases keep their order within a policy
+    """
+    groups = collections.OrderedDict()
+    for case in cases:
+        groups.setdefault(case.policy_name, []).append(case)
+    return [case for group in groups.values() for case in group]
+
+def log_summary(logger, managers):
+    """
+    Log controller restart counts and time saved across testbeds
+    """
+    restarts = sum(manager.restarts for manager in managers)
+    reuses = sum(manager.reuses for manager in managers)
+    saved = sum(manager.saved() for manager in managers)
+    logger.info("controller restarts=%s reuses=%s saved=%.1fs",
+                                                restarts, reuses, saved)
@@ -0,0 +1,216 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Analysis of switch flow table dumps (ovs-ofctl dump-flows).
+
+The test playbooks dump the switch flow table after the traffic
+tests, either once (<switch>-flows.txt) or after each of the pc1
+and lg1 tests (<switch>-pc1-flows.txt, <switch>-lg1-flows.txt).
+
+Flows are counted per table, and two snapshots of the same switch
+are compared to get packet and byte counter deltas of the flows
+present in both, the flows added and removed, and an estimate of
+the flow install rate. Flow table size is tracked so that nmeta
+changes that blow up the switch flow table footprint are caught.
+"""
+
+import collections
+import os
+import re
+
+import artifacts
+
+#*** Flow dump files, with an optional snapshot label before the
+#***  suffix, e.g. sw1.example.com-pc1-flows.txt:
+FLOWS_SUFFIX = '-flows.txt'
+SNAPSHOT_LABELS = ('pc1', 'lg1')
+#*** Label of a dump that was not taken after a particular test:
+FINAL_LABEL = 'final'
+
+#*** Actions that apply QoS to a flow (OpenFlow 1.3):
+QOS_ACTION_RE = re.compile(r"(?:^|[,(])(set_queue|meter):")
+
+#*** Flow statistics fields that precede the match:
+STAT_FIELDS = ('cookie', 'duration', 'table', 'n_packets', 'n_bytes',
+                'idle_timeout', 'hard_timeout', 'idle_age', 'hard_age',
+                'importance')
+
+#*** Priority within a match, e.g. priority=1,tcp,tp_dst=5555:
+PRIORITY_RE = re.compile(r"(?:^|,)priority=(\d+)")
+#*** OpenFlow default flow priority, omitted by ovs-ofctl:
+DEFAULT_PRIORITY = 32768
+
+#*** One flow entry. The match excludes the priority:
+Flow = collections.namedtuple('Flow', ('table', 'priority', 'match',
+                    'actions', 'duration', 'n_packets', 'n_bytes'))
+
+def parse_flow(line):
+    """
+    Passed a line of ovs-ofctl dump-flows output, return a Flow, or
+    None if the line is not a flow entry
+    """
+    head, separator, actions = line.strip().partition(" actions=")
+    if not separator:
+        return None
+    fields = head.split(", ")
+    stats = {}
+    for field in fields[:-1]:
+        key, _, value = field.partition("=")
+        stats[key] = value
+    #*** Last field is the match, possibly after flag words such as
+    #***  send_flow_rem:
+    match = fields[-1].rsplit(" ", 1)[-1]
+    key, _, value = match.partition("=")
+    if key in STAT_FIELDS:
+        #*** Flow with an empty match:
+        stats[key] = value
+        match = ""
+    try:
+        table = int(stats.get('table', 0))
+        duration = float(stats.get('duration', '0s').rstrip('s'))
+        n_packets = int(stats.get('n_packets', 0))
+        n_bytes = int(stats.get('n_bytes', 0))
+    except ValueError:
+        return None
+    priority = DEFAULT_PRIORITY
+    priority_match = PRIORITY_RE.search(match)
+    if priority_match:
+        priority = int(priority_match.group(1))
+        match = PRIORITY_RE.sub("", match, count=1).lstrip(",")
+    return Flow(table, priority, match, actions, duration, n_packets,
+                                                            n_bytes)
+
+class FlowTable(object):
+    """
+    One snapshot of a switch flow table
+    """
+    def __init__(self, flows=None):
+        self.flows = collections.OrderedDict()
+        for flow in flows or []:
+            self.add(flow)
+
+    def add(self, flow):
+        """
+        Add a Flow, keyed by table, priority and match
+        """
+        self.flows[(flow.table, flow.priority, flow.match)] = flow
+
+    def __len__(self):
+        return len(self.flows)
+
+    def per_table(self):
+        """
+        Return an ordered dictionary of table number to flow count
+        """
+        counts = collections.Counter(key[0] for key in self.flows)
+        return collections.OrderedDict(sorted(counts.items()))
+
+    def qos_flows(self):
+        """
+        Return the flows that have a set_queue or meter action
+        """
+        return [flow for flow in self.flows.values()
+                                    if QOS_ACTION_RE.search(flow.actions)]
+
+    def n_packets(self):
+        """
+        Return the total packets matched by all flows
+        """
+        return sum(flow.n_packets for flow in self.flows.values())
+
+    def n_bytes(self):
+        """
+        Return the total bytes matched by all flows
+        """
+        return sum(flow.n_bytes for flow in self.flows.values())
+
+class FlowDelta(object):
+    """
+    Comparison of an earlier and a later snapshot of a flow table
+    """
+    def __init__(self, before, after):
+        common = [key for key in after.flows if key in before.flows]
+        self.added = [after.flows[key] for key in after.flows
+                                                if key not in before.flows]
+        self.removed = [before.flows[key] for key in before.flows
+                                                if key not in after.flows]
+        self.n_packets = sum(after.flows[key].n_packets -
+                                before.flows[key].n_packets for key in common)
+        self.n_bytes = sum(after.flows[key].n_bytes -
+                                before.flows[key].n_bytes for key in common)
+        self.growth = len(after) - len(before)
+        #*** Time between the snapshots, from the age of the flows
+        #***  present in both:
+        ages = [after.flows[key].duration - before.flows[key].duration
+                                                        for key in common]
+        self.elapsed = max(ages) if ages else None
+
+    def install_rate(self):
+        """
+        Return the flows added per second between the snapshots, or
+        None if the time between them is not known
+        """
+        if not self.elapsed or self.elapsed <= 0:
+            return None
+        return len(self.added) / self.elapsed
+
+def read_flows(filename):
+    """
+    Passed a full path filename of ovs-ofctl dump-flows output,
+    parse it and return a FlowTable. A packed run is read from its
+    archive
+    """
+    table = FlowTable()
+    with artifacts.open_result(filename) as filehandle:
+        for line in filehandle:
+            flow = parse_flow(line)
+            if flow:
+                table.add(flow)
+    return table
+
+def snapshot_label(filename):
+    """
+    Return the snapshot label of a flow dump filename, or None if
+    it is not a flow dump
+    """
+    if not filename.endswith(FLOWS_SUFFIX):
+        return None
+    stem = filename[:-len(FLOWS_SUFFIX)]
+    for label in SNAPSHOT_LABELS:
+        if stem.endswith('-' + label):
+            return label
+    return FINAL_LABEL
+
+def read_snapshots(test_dir):
+    """
+    Passed a test result directory, return an ordered dictionary of
+    snapshot label to FlowTable, in the order the dumps were taken
+    """
+    found = {}
+    for filename in sorted(artifacts.list_results(test_dir)):
+        label = snapshot_label(filename)
+        if label:
+            found[label] = read_flows(os.path.join(test_dir, filename))
+    order = SNAPSHOT_LABELS + (FINAL_LABEL,)
+    return collections.OrderedDict((label, found[label])
+                                        for label in order if label in found)
+
+def snapshot_deltas(snapshots):
+    """
+    Passed ordered snapshots, return a list of (before label, after
+    label, FlowDelta) for each consecutive pair
+    """
+    labels = list(snapshots)
+    return [(before, after, FlowDelta(snapshots[before], snapshots[after]))
+                            for before, after in zip(labels, labels[1:])]
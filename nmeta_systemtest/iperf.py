@@ -0,0 +1,209 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Parse iperf (version 2) CSV results (iperf -y c) into per-interval
+throughput time series.
+
+Each CSV line has the fields:
+    timestamp, source address, source port, destination address,
+    destination port, transfer ID, interval (start-end seconds),
+    transferred bytes, bits per second
+
+With -i, each stream reports every interval and then a summary line
+covering the whole test. With -P, iperf also reports the sum of the
+streams using transfer ID -1. Client and server (-s -i 1) reports
+have the same format.
+
+Interval series are held in compact typed arrays. From the aggregate
+series the steady-state throughput and the ramp time (how long the
+throughput took to settle, e.g. for nmeta to install a constraining
+flow) are calculated.
+"""
+
+import array
+import collections
+
+import artifacts
+
+#*** Fields of an iperf CSV line:
+FIELD_ID = 5
+FIELD_INTERVAL = 6
+FIELD_BYTES = 7
+FIELD_BPS = 8
+NUM_FIELDS = 9
+
+#*** Transfer ID iperf uses for the sum of parallel streams:
+SUM_ID = -1
+
+#*** Throughput within this fraction of steady state is settled:
+SETTLE_TOLERANCE = 0.2
+
+class IperfStream(object):
+    """
+    Interval time series and summary of one iperf transfer ID
+    """
+    def __init__(self, transfer_id):
+        self.transfer_id = transfer_id
+        self.starts = array.array('d')
+        self.ends = array.array('d')
+        self.transferred = array.array('d')
+        self.bps = array.array('d')
+        #*** Summary (start, end, bytes, bps) over the whole test:
+        self.summary = None
+
+    def add(self, start, end, transferred, bps):
+        """
+        Add a report line. Intervals follow on from each other, so a
+        later line starting at zero that ends at or after the last
+        interval is the whole-test summary, even when the test was
+        one interval long:
+
+        >>> stream = IperfStream(3)
+        >>> stream.add(0.0, 1.0, 1000, 8000)
+        >>> stream.add(0.0, 1.0, 1000, 8000)
+        >>> stream.bandwidth(), len(stream.bps)
+        (8000, 1)
+        """
+        if self.ends and start == 0.0 and end >= self.ends[-1]:
+            self.summary = (start, end, transferred, bps)
+            return
+        self.starts.append(start)
+        self.ends.append(end)
+        self.transferred.append(transferred)
+        self.bps.append(bps)
+
+    def bandwidth(self):
+        """
+        Return the whole-test bandwidth in bits per second
+        """
+        if self.summary:
+            return self.summary[3]
+        if not self.bps:
+            return None
+        if len(self.bps) == 1:
+            return self.bps[0]
+        duration = self.ends[-1] - self.starts[0]
+        if duration <= 0:
+            return None
+        return sum(self.transferred) * 8 / duration
+
+class IperfResult(object):
+    """
+    All streams of one iperf result file
+    """
+    def __init__(self):
+        self.streams = collections.OrderedDict()
+
+    def add_line(self, line):
+        """
+        Parse one CSV line and add it. Returns False if the line is
+        not an iperf CSV report
+        """
+        fields = line.strip().split(",")
+        if len(fields) < NUM_FIELDS:
+            return False
+        try:
+            transfer_id = int(fields[FIELD_ID])
+            start, end = [float(value) for value in
+                                    fields[FIELD_INTERVAL].split("-")]
+            transferred = float(fields[FIELD_BYTES])
+            bps = float(fields[FIELD_BPS])
+        except ValueError:
+            return False
+        if transfer_id not in self.streams:
+            self.streams[transfer_id] = IperfStream(transfer_id)
+        self.streams[transfer_id].add(start, end, transferred, bps)
+        return True
+
+    def aggregate(self):
+        """
+        Return the stream that represents the whole transfer: the
+        sum of streams if iperf reported one, otherwise the only
+        stream, otherwise a sum built from the individual streams
+        """
+        if SUM_ID in self.streams:
+            return self.streams[SUM_ID]
+        if len(self.streams) == 1:
+            return list(self.streams.values())[0]
+        total = IperfStream(SUM_ID)
+        by_interval = collections.OrderedDict()
+        for stream in self.streams.values():
+            for index in range(len(stream.bps)):
+                key = (stream.starts[index], stream.ends[index])
+                transferred, bps = by_interval.get(key, (0.0, 0.0))
+                by_interval[key] = (transferred +
+                            stream.transferred[index],
+                            bps + stream.bps[index])
+        for (start, end), (transferred, bps) in sorted(
+                                                by_interval.items()):
+            total.add(start, end, transferred, bps)
+        summaries = [stream.summary for stream in self.streams.values()
+                                                    if stream.summary]
+        if summaries:
+            total.summary = (0.0, max(summary[1] for summary in summaries),
+                        sum(summary[2] for summary in summaries),
+                        sum(summary[3] for summary in summaries))
+        return total
+
+    def bandwidth(self):
+        """
+        Return the whole-test bandwidth in bits per second, or None
+        if there were no reports
+        """
+        return self.aggregate().bandwidth()
+
+    def steady_state(self):
+        """
+        Return the steady-state throughput in bits per second, the
+        median of the second half of the intervals
+        """
+        bps = self.aggregate().bps
+        if not bps:
+            return self.bandwidth()
+        tail = sorted(bps[len(bps) // 2:])
+        middle = len(tail) // 2
+        if len(tail) % 2:
+            return tail[middle]
+        return (tail[middle - 1] + tail[middle]) / 2.0
+
+    def ramp_time(self, tolerance=SETTLE_TOLERANCE):
+        """
+        Return the seconds from the start of the test until the
+        throughput settles, i.e. the start of the first interval
+        after which every interval is within tolerance of the
+        steady state. None if there are no intervals
+        """
+        stream = self.aggregate()
+        if not stream.bps:
+            return None
+        steady = self.steady_state()
+        settled_from = len(stream.bps)
+        for index in range(len(stream.bps) - 1, -1, -1):
+            if abs(stream.bps[index] - steady) > tolerance * steady:
+                break
+            settled_from = index
+        if settled_from == len(stream.bps):
+            return stream.ends[-1]
+        return stream.starts[settled_from]
+
+def read_iperf(filename):
+    """
+    Passed a full path filename of iperf CSV output, parse it and
+    return an IperfResult. The file may be in a packed run archive
+    """
+    result = IperfResult()
+    with artifacts.open_result(filename) as filehandle:
+        for line in filehandle:
+            result.add_line(line)
+    return result
@@ -0,0 +1,223 @@
+#!/usr/bin/python
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Incremental checking of the nmeta log for the nmeta system tests.
+
+Rather than rotating the log (and restarting rsyslog) before each
+test, the log position (inode and byte offset) is recorded before
+a test and only the bytes written after it are read afterwards.
+If the log was rotated or truncated in between, it is read from
+the start.
+
+New log lines are streamed through a rule engine: the patterns of
+all rules are compiled into one regular expression so that each
+line is matched once, and a line counts towards the first rule it
+matches. Each rule allows a rate of matches per minute, zero for
+severities such as CRITICAL that must never be logged, above which
+the test fails.
+
+The same tailer works on a local log file, e.g. to check a log
+copied from the controller:
+    logwatch.py [--offset BYTES] [--elapsed SECONDS] LOGFILE
+"""
+
+import argparse
+import collections
+import os
+import re
+import sys
+import time
+
+#*** Position in a log file, and the time it was taken:
+Position = collections.namedtuple('Position', ('inode', 'offset', 'time'))
+
+#*** Most example lines kept per rule:
+MAX_EXAMPLES = 5
+
+class Rule(object):
+    """
+    A named pattern of log lines and the most matches per minute
+    allowed before the rule is violated
+    """
+    def __init__(self, name, pattern, max_per_minute=0):
+        self.name = name
+        self.pattern = pattern
+        self.max_per_minute = max_per_minute
+
+#*** Default rules, nmeta logs sev=<level> in each syslog line:
+RULES = (Rule('critical', r"sev=CRITICAL"),
+         Rule('error', r"sev=ERROR"),
+         Rule('warning', r"sev=WARNING", max_per_minute=30))
+
+class RuleSet(object):
+    """
+    Rules compiled into a single matcher of log lines
+    """
+    def __init__(self, rules=RULES):
+        self.rules = list(rules)
+        #*** One named group per rule, as rule names may not be
+        #***  valid group names:
+        self._matcher = re.compile(b"|".join(
+                        b"(?P<r" + str(index).encode('ascii') + b">" +
+                        rule.pattern.encode('ascii') + b")"
+                        for index, rule in enumerate(self.rules)))
+
+    def scan(self, lines):
+        """
+        Passed an iterable of log lines as bytes, return a LogReport
+        of the lines matching each rule
+        """
+        report = LogReport(self.rules)
+        search = self._matcher.search
+        for line in lines:
+            report.lines += 1
+            match = search(line)
+            if match:
+                report.add(self.rules[int(match.lastgroup[1:])], line)
+        return report
+
+    def scan_file(self, filename):
+        """
+        Passed a full path filename of log lines, stream it through
+        the rules and return a LogReport
+        """
+        with open(filename, 'rb') as filehandle:
+            return self.scan(filehandle)
+
+class LogReport(object):
+    """
+    Matches of each rule in a run of log lines
+    """
+    def __init__(self, rules):
+        self.rules = rules
+        self.lines = 0
+        self.counts = collections.OrderedDict((rule.name, 0)
+                                                    for rule in rules)
+        self.examples = dict((rule.name, []) for rule in rules)
+
+    def add(self, rule, line):
+        """
+        Record a line matching a rule
+        """
+        self.counts[rule.name] += 1
+        if len(self.examples[rule.name]) < MAX_EXAMPLES:
+            self.examples[rule.name].append(line.rstrip(b"\n"))
+
+    def violations(self, elapsed):
+        """
+        Passed the seconds the lines were logged over, return a list
+        of (rule, count, per_minute) of rules that matched more than
+        they allow
+        """
+        result = []
+        for rule in self.rules:
+            count = self.counts[rule.name]
+            if not count:
+                continue
+            per_minute = count * 60.0 / elapsed if elapsed > 0 \
+                                                    else float(count)
+            if not rule.max_per_minute or per_minute > rule.max_per_minute:
+                result.append((rule, count, per_minute))
+        return result
+
+class LogTailer(object):
+    """
+    Reads the bytes appended to a local log file since a position
+    """
+    def __init__(self, filename, position=None):
+        self.filename = filename
+        self.position = position
+        #*** True if the last read found the log rotated or truncated:
+        self.rotated = False
+
+    def mark(self):
+        """
+        Record the current end of the log as the position to read
+        from, and return it
+        """
+        stat = os.stat(self.filename)
+        self.position = Position(stat.st_ino, stat.st_size, time.time())
+        return self.position
+
+    def read_new(self):
+        """
+        Return the bytes appended since the position (the whole log
+        if not marked, or if it was rotated or truncated) and move
+        the position to the end of them
+        """
+        with open(self.filename, 'rb') as filehandle:
+            stat = os.fstat(filehandle.fileno())
+            start = start_offset(self.position, stat.st_ino, stat.st_size)
+            self.rotated = self.position is not None and \
+                                            start != self.position.offset
+            filehandle.seek(start)
+            #*** Only up to the size seen, lines may be being written:
+            data = filehandle.read(stat.st_size - start)
+        self.position = Position(stat.st_ino, start + len(data),
+                                                            time.time())
+        return data
+
+def start_offset(position, inode, size):
+    """
+    Return the offset to read new log bytes from, given the last
+    position and the current inode and size of the log
+    """
+    if position is None or position.inode != inode or \
+                                                size < position.offset:
+        return 0
+    return position.offset
+
+def read_position(filename):
+    """
+    Passed a full path filename written by the log tail playbook,
+    holding the inode, size and read start offset of the log, return
+    (Position, start)
+    """
+    with open(filename) as filehandle:
+        inode, size, start = [int(field) for field in
+                                            filehandle.read().split()]
+    return Position(inode, size, time.time()), start
+
+def main():
+    """
+    Check the lines of a local log file against the default rules
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--offset', type=int, default=0,
+                        help="byte offset to read from")
+    parser.add_argument('--elapsed', type=float, default=60,
+                        help="seconds the lines were logged over")
+    parser.add_argument('logfile')
+    args = parser.parse_args()
+
+    stat = os.stat(args.logfile)
+    tailer = LogTailer(args.logfile, Position(stat.st_ino, args.offset,
+                                                            time.time()))
+    data = tailer.read_new()
+    report = RuleSet().scan(data.splitlines(True))
+    violations = report.violations(args.elapsed)
+    for name, count in report.counts.items():
+        print("%s=%s" % (name, count))
+    for rule, count, per_minute in violations:
+        print("violated rule=%s count=%s per_minute=%.1f" % (rule.name,
+                                                        count, per_minute))
+        for line in report.examples[rule.name]:
+            print("  " + line.decode('utf-8', 'replace'))
+    sys.exit(1 if violations else 0)
+
+if __name__ == "__main__":
+    #*** Run the main function
+    main()
@@ -0,0 +1,278 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Run manifest and structured case results for the nmeta system tests.
+
+Each finished case is appended as a JSON line to a manifest in
+the run's timestamped results directory. The line is a structured
+record of the case: its inputs, time spent in each phase,
+measurements, thresholds and verdict. The manifest can be
+converted to JUnit XML for CI, and a failed or interrupted run can
+be resumed by running only the cases that have not passed. Cases
+are identified by suite, test and iteration.
+
+Cases can also be selected by suite or suite/test, so that a
+single case can be rerun after a fix.
+"""
+
+import collections
+import contextlib
+import datetime
+import json
+import os
+import threading
+import time
+from xml.sax.saxutils import escape, quoteattr
+
+import tracing
+
+#*** Verdicts of a finished case, failed being a failed expectation
+#***  and error anything else that stopped the case:
+PASSED = 'passed'
+FAILED = 'failed'
+ERROR = 'error'
+
+class CaseRecord(object):
+    """
+    Structured record of a case as it runs, added to from the
+    testbed worker and from background analysis
+    """
+    def __init__(self, case, testbed_name):
+        self.case = case
+        self.testbed_name = testbed_name
+        self.started = time.time()
+        self.inputs = collections.OrderedDict()
+        #*** Seconds spent in each phase, summed over samples:
+        self.phases = collections.OrderedDict()
+        #*** Values of each measurement, one per sample or step:
+        self.measurements = collections.OrderedDict()
+        self.thresholds = []
+        #*** Verdict once recorded in the manifest, and (verdict,
+        #***  detail) of a failed background analysis:
+        self.verdict = None
+        self.failure = None
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Context manager that adds the time spent in it to a phase,
+        and to the run trace
+        """
+        start = time.time()
+        try:
+            with tracing.span(name, 'phase', test=self.case.test):
+                yield
+        finally:
+            with self._lock:
+                self.phases[name] = round(self.phases.get(name, 0.0) +
+                                                    time.time() - start, 3)
+
+    def measure(self, name, value):
+        """
+        Add a value of a measurement
+        """
+        with self._lock:
+            self.measurements.setdefault(name, []).append(value)
+
+    def checked(self, func, *args):
+        """
+        Run a background analysis of the case, func(*args), timed as
+        the analysis phase and keeping why it failed, if it does
+        """
+        with self.phase('analysis'):
+            try:
+                func(*args)
+            except BaseException as exception:
+                self.failure = verdict_of(exception)
+                raise
+
+    def entry(self, verdict, detail=None):
+        """
+        Return the manifest entry of the finished case
+        """
+        entry = collections.OrderedDict()
+        entry['suite'] = self.case.suite
+        entry['test'] = self.case.test
+        entry['iteration'] = self.case.iteration
+        entry['policy'] = self.case.policy_name
+        entry['testbed'] = self.testbed_name
+        entry['verdict'] = verdict
+        entry['seconds'] = round(time.time() - self.started, 3)
+        entry['finished'] = datetime.datetime.now().strftime(
+                                                    "%Y-%m-%dT%H:%M:%S")
+        if detail:
+            entry['detail'] = detail
+        with self._lock:
+            entry['inputs'] = collections.OrderedDict(self.inputs)
+            entry['phases'] = collections.OrderedDict(self.phases)
+            entry['measurements'] = collections.OrderedDict(
+                                (name, list(values)) for name, values
+                                in self.measurements.items())
+            entry['thresholds'] = list(self.thresholds)
+        return entry
+
+def verdict_of(exception):
+    """
+    Return (verdict, detail) of an exception that stopped a case
+    """
+    detail = str(exception) or type(exception).__name__
+    if isinstance(exception, AssertionError):
+        return FAILED, detail
+    return ERROR, detail
+
+class Manifest(object):
+    """
+    Finished cases of a run, appended to a file as they finish.
+    Passed in_memory=False, entries are read back from the file when
+    needed rather than kept, so a long run stays in constant memory
+    """
+    def __init__(self, filename, in_memory=True):
+        self.filename = filename
+        self.in_memory = in_memory
+        self.entries = read_manifest(filename) \
+                        if in_memory and os.path.isfile(filename) else []
+        self._lock = threading.Lock()
+
+    def record(self, record, verdict, detail=None):
+        """
+        Append the record of a finished case, with its verdict and
+        any detail of why it did not pass, to the manifest
+        """
+        entry = record.entry(verdict, detail)
+        record.verdict = verdict
+        with self._lock:
+            with open(self.filename, 'a') as filehandle:
+                filehandle.write(json.dumps(entry) + "\n")
+            if self.in_memory:
+                self.entries.append(entry)
+
+    def all_entries(self):
+        """
+        Return every entry of the manifest, in the order written
+        """
+        if self.in_memory:
+            return self.entries
+        with self._lock:
+            return read_manifest(self.filename) \
+                            if os.path.isfile(self.filename) else []
+
+    def passed(self):
+        """
+        Return the set of (suite, test, iteration) of cases whose
+        latest verdict is a pass
+        """
+        latest = {}
+        for entry in self.all_entries():
+            latest[(entry['suite'], entry['test'],
+                                    entry['iteration'])] = entry['verdict']
+        return set(key for key, verdict in latest.items()
+                                                    if verdict == PASSED)
+
+    def latest(self):
+        """
+        Return the latest entry of each case, in the order they
+        first finished
+        """
+        latest = collections.OrderedDict()
+        for entry in self.all_entries():
+            latest[(entry['suite'], entry['test'],
+                                            entry['iteration'])] = entry
+        return list(latest.values())
+
+    def write_junit(self, filename):
+        """
+        Write the latest entry of each case as JUnit XML, a test
+        suite per suite
+        """
+        suites = collections.OrderedDict()
+        for entry in self.latest():
+            suites.setdefault(entry['suite'], []).append(entry)
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>', "<testsuites>"]
+        for suite, entries in suites.items():
+            lines.append('<testsuite name=%s tests="%s" failures="%s" '
+                    'errors="%s" time="%.1f">' % (quoteattr(suite),
+                    len(entries), sum(1 for entry in entries
+                                        if entry['verdict'] == FAILED),
+                    sum(1 for entry in entries
+                                        if entry['verdict'] == ERROR),
+                    sum(entry['seconds'] for entry in entries)))
+            for entry in entries:
+                lines += junit_testcase(entry)
+            lines.append("</testsuite>")
+        lines.append("</testsuites>")
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'w') as filehandle:
+            filehandle.write("\n".join(lines) + "\n")
+        os.rename(temp_filename, filename)
+
+def junit_testcase(entry):
+    """
+    Return the JUnit XML lines of a manifest entry, with its phase
+    times as properties and its measurements as output
+    """
+    name = entry['test'] if not entry['iteration'] else \
+                "%s (iteration %s)" % (entry['test'], entry['iteration'] + 1)
+    lines = ['<testcase classname=%s name=%s time="%.1f">' % (
+                quoteattr(entry['suite']), quoteattr(name),
+                entry['seconds'])]
+    phases = entry.get('phases') or {}
+    if phases:
+        lines.append("<properties>")
+        for phase, seconds in phases.items():
+            lines.append('<property name=%s value="%s"/>' % (
+                                    quoteattr("phase." + phase), seconds))
+        lines.append("</properties>")
+    if entry['verdict'] in (FAILED, ERROR):
+        lines.append('<%s message=%s/>' % (
+                        'failure' if entry['verdict'] == FAILED else 'error',
+                        quoteattr(entry.get('detail') or entry['verdict'])))
+    measurements = entry.get('measurements') or {}
+    if measurements:
+        lines.append("<system-out>%s</system-out>" % escape("\n".join(
+                    "%s=%s" % (name, " ".join(str(value) for value in values))
+                    for name, values in measurements.items())))
+    lines.append("</testcase>")
+    return lines
+
+def read_manifest(filename):
+    """
+    Passed a full path filename of a manifest, return its entries.
+    A partly written last line (from a crash) is ignored
+    """
+    entries = []
+    with open(filename) as filehandle:
+        for line in filehandle:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+    return entries
+
+def matches(case, selector):
+    """
+    Return True if a case is selected by a suite or suite/test
+    """
+    suite, _, test = selector.partition('/')
+    return case.suite == suite and (not test or case.test == test)
+
+def select(cases, only=None, skip=()):
+    """
+    Return the cases selected by any of the only selectors (all if
+    None) other than those whose (suite, test, iteration) is in skip
+    """
+    return [case for case in cases
+                if (not only or any(matches(case, selector)
+                                                for selector in only))
+                and (case.suite, case.test, case.iteration) not in skip]
@@ -0,0 +1,255 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Declarative test matrix for the nmeta system tests.
+
+The matrix (YAML) lists suites, each with a playbook, extra vars,
+result files and tests, where each test has an nmeta policy and
+expectations of its measurements. It is flattened into one spec
+(dictionary) per test, from which schedulable cases are built, so
+new cases are added by editing the matrix rather than code.
+
+Run profiles (YAML) adjust the matrix for a kind of run, such as
+a quick smoke run or a long soak, by selecting suites and
+overriding repeats, samples, settle times and playbook extra vars
+of every test, and further overrides can be passed per run.
+
+The execution plan summarises the cases by policy, since cases that
+share a policy share controller state. Which testbed runs each case
+is left to the scheduler, which keeps a policy group on one testbed
+where it can.
+"""
+
+import collections
+
+import yaml
+
+import sampling
+import scheduler
+
+#*** Keys of a suite, keys a test may set or override and defaults:
+SUITE_KEYS = ('suite', 'runner', 'playbook', 'repeats', 'max_samples',
+                'settle', 'extra_vars', 'result_files', 'ramp', 'tests')
+TEST_KEYS = ('test', 'policy', 'playbook', 'repeats', 'max_samples',
+                'settle', 'extra_vars', 'result_files', 'expect',
+                'qos_snapshot', 'ramp')
+DEFAULTS = {'repeats': 1, 'max_samples': 1, 'settle': 30,
+                'qos_snapshot': None, 'ramp': []}
+REQUIRED_KEYS = ('suite', 'runner', 'playbook', 'test', 'policy')
+#*** Keys of a run profile and test keys a profile may override:
+PROFILE_KEYS = ('description', 'suites', 'overrides')
+OVERRIDE_KEYS = ('repeats', 'max_samples', 'settle', 'ramp', 'extra_vars')
+#*** Overrides that are numbers, other KEY=VALUE overrides are vars:
+NUMBER_KEYS = ('repeats', 'max_samples', 'settle')
+
+def load_matrix(filename):
+    """
+    Passed a full path filename of a test matrix, return a list of
+    test specs in matrix order. Raises ValueError if it is invalid
+    """
+    with open(filename) as filehandle:
+        matrix = yaml.safe_load(filehandle)
+    if not isinstance(matrix, dict) or 'suites' not in matrix:
+        raise ValueError("%s has no suites" % filename)
+    specs = []
+    for suite in matrix['suites']:
+        unknown = set(suite) - set(SUITE_KEYS)
+        if unknown:
+            raise ValueError("suite=%s unknown keys %s" % (
+                            suite.get('suite'), ", ".join(sorted(unknown))))
+        for test in suite.get('tests') or []:
+            specs.append(make_spec(suite, test))
+    return specs
+
+def make_spec(suite, test):
+    """
+    Passed suite and test entries of a matrix, return the flattened
+    and validated spec of the test
+    """
+    unknown = set(test) - set(TEST_KEYS)
+    if unknown:
+        raise ValueError("suite=%s test=%s unknown keys %s" % (
+                            suite.get('suite'), test.get('test'),
+                            ", ".join(sorted(unknown))))
+    spec = dict(DEFAULTS)
+    spec.update((key, value) for key, value in suite.items()
+                                                    if key != 'tests')
+    spec.update(test)
+    #*** Dictionaries merge, with the test taking precedence:
+    for key in ('extra_vars', 'result_files'):
+        spec[key] = dict(suite.get(key) or {}, **(test.get(key) or {}))
+    spec['extra_vars'] = dict((key, str(value))
+                                for key, value in spec['extra_vars'].items())
+    spec['expect'] = list(spec.get('expect') or [])
+    for key in REQUIRED_KEYS:
+        if not spec.get(key):
+            raise ValueError("suite=%s test=%s has no %s" % (
+                            spec.get('suite'), spec.get('test'), key))
+    for expect in spec['expect']:
+        if expect.get('file') not in spec['result_files']:
+            raise ValueError("suite=%s test=%s expects unknown result "
+                        "file %s" % (spec['suite'], spec['test'],
+                        expect.get('file')))
+        if not expect.get('name') or \
+                        ('below' in expect) == ('above' in expect):
+            raise ValueError("suite=%s test=%s expectations need a name "
+                        "and one of below or above" % (spec['suite'],
+                        spec['test']))
+    return spec
+
+def thresholds(spec):
+    """
+    Return the sampling thresholds of the expectations of a spec
+    """
+    result = []
+    for expect in spec['expect']:
+        if 'below' in expect:
+            result.append(sampling.Threshold(expect['name'], '<',
+                                                        expect['below']))
+        else:
+            result.append(sampling.Threshold(expect['name'], '>',
+                                                        expect['above']))
+    return result
+
+def load_profiles(filename):
+    """
+    Passed a full path filename of run profiles, return a dictionary
+    of profile name to profile. Raises ValueError if it is invalid
+    """
+    with open(filename) as filehandle:
+        profiles = yaml.safe_load(filehandle)
+    if not isinstance(profiles, dict) or 'profiles' not in profiles:
+        raise ValueError("%s has no profiles" % filename)
+    for name, profile in profiles['profiles'].items():
+        profile = profile or {}
+        unknown = set(profile) - set(PROFILE_KEYS)
+        if unknown:
+            raise ValueError("profile=%s unknown keys %s" % (name,
+                                            ", ".join(sorted(unknown))))
+        check_overrides(profile.get('overrides') or {})
+        profiles['profiles'][name] = profile
+    return profiles['profiles']
+
+def check_overrides(overrides):
+    """
+    Raise ValueError if overrides has keys that can not be overridden
+    """
+    unknown = set(overrides) - set(OVERRIDE_KEYS)
+    if unknown:
+        raise ValueError("can not override %s" % ", ".join(
+                                                        sorted(unknown)))
+
+def parse_overrides(assignments):
+    """
+    Passed a list of KEY=VALUE strings, return the overrides they
+    set. Keys other than repeats, max_samples and settle are extra
+    vars. Raises ValueError if one is malformed
+    """
+    overrides = {'extra_vars': {}}
+    for assignment in assignments:
+        key, equals, value = assignment.partition('=')
+        if not key or not equals:
+            raise ValueError("%s is not KEY=VALUE" % assignment)
+        if key in NUMBER_KEYS:
+            try:
+                overrides[key] = int(value)
+            except ValueError:
+                raise ValueError("%s must be a whole number" % key)
+        else:
+            overrides['extra_vars'][key] = value
+    return overrides
+
+def apply_profile(specs, profile, overrides=None):
+    """
+    Passed test specs, a run profile and optionally further
+    overrides, return the specs of the suites the profile selects
+    with the overrides applied. Raises ValueError if the profile
+    selects a suite that is not in the matrix, or if no selected
+    test takes an extra var of the further overrides
+    """
+    suites = profile.get('suites')
+    unknown = set(suites or []) - set(spec['suite'] for spec in specs)
+    if unknown:
+        raise ValueError("profile selects unknown suites %s" % ", ".join(
+                                                        sorted(unknown)))
+    result = []
+    used = set()
+    for spec in specs:
+        if suites and spec['suite'] not in suites:
+            continue
+        spec = dict(spec, extra_vars=dict(spec['extra_vars']))
+        for source in (profile.get('overrides') or {}, overrides or {}):
+            for key, value in source.items():
+                if key != 'extra_vars':
+                    spec[key] = value
+                    continue
+                #*** Only vars the test's playbook already takes:
+                for var, var_value in value.items():
+                    if var in spec['extra_vars']:
+                        spec['extra_vars'][var] = str(var_value)
+                        used.add(var)
+        result.append(spec)
+    unused = set((overrides or {}).get('extra_vars') or {}) - used
+    if unused:
+        raise ValueError("no selected test takes %s" % ", ".join(
+                                                        sorted(unused)))
+    return result
+
+def build_cases(specs, runners):
+    """
+    Passed test specs and a dictionary of runner name to case
+    function, return the list of cases. Each suite's tests are run
+    in turn, repeats times. Raises ValueError on an unknown runner
+    """
+    suites = collections.OrderedDict()
+    for spec in specs:
+        if spec['runner'] not in runners:
+            raise ValueError("suite=%s test=%s unknown runner %s" % (
+                            spec['suite'], spec['test'], spec['runner']))
+        suites.setdefault(spec['suite'], []).append(spec)
+    cases = []
+    for suite_specs in suites.values():
+        for iteration in range(max(spec['repeats']
+                                            for spec in suite_specs)):
+            for spec in suite_specs:
+                if iteration < spec['repeats']:
+                    cases.append(scheduler.Case(spec['suite'],
+                            spec['test'], spec['policy'], iteration,
+                            runners[spec['runner']], spec))
+    return cases
+
+class ExecutionPlan(object):
+    """
+    Summary of the cases to run, grouped by policy (the controller
+    state they need), in the order the cases are listed. The
+    scheduler assigns cases to testbeds as they come free
+    """
+    def __init__(self, cases, testbeds=1):
+        self.testbeds = max(1, testbeds)
+        self.groups = collections.OrderedDict()
+        for case in cases:
+            self.groups.setdefault(case.policy_name, []).append(case)
+
+    def describe(self):
+        """
+        Return lines describing the plan
+        """
+        lines = ["cases=%s policies=%s testbeds=%s" % (
+                        sum(len(group) for group in self.groups.values()),
+                        len(self.groups), self.testbeds)]
+        for policy_name, group in self.groups.items():
+            lines.append("policy=%s cases=%s" % (policy_name,
+                        ", ".join("%s/%s" % (case.suite, case.test)
+                        for case in group)))
+        return lines
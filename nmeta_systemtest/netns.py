@@ -0,0 +1,195 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Local testbed for the nmeta system tests on one Linux machine.
+
+Builds the pc1, lg1 and sv1 hosts of the lab topology as network
+namespaces, each with a veth pair into a local Open vSwitch bridge
+(br0, as the playbooks dump its flow table), which is controlled by
+nmeta on localhost. The kernel datapath is used by default, or the
+userspace one where the openvswitch kernel module is unavailable.
+
+The existing playbooks run unchanged against a generated Ansible
+inventory. The controller and switch are local hosts, and each
+namespace host is a local host whose Python interpreter runs in
+its namespace, as the user running the tests, so every task of the
+host (iperf, hping3, ping, arp) runs there. Each namespace resolves
+the hosts by name through its own /etc/netns hosts file, and has
+pkill limited to its own processes, as the playbooks kill iperf on
+each host.
+
+Setting up and tearing down the topology takes a single sudo shell
+and a fraction of a second. Requires passwordless sudo, iproute2,
+Open vSwitch and, like the lab controller, nmeta and Ryu installed
+in the home directory. Only one local testbed can run per machine.
+"""
+
+import collections
+import getpass
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+#*** A host of the topology, its Ansible group and address:
+Host = collections.namedtuple('Host', ('name', 'group', 'address'))
+
+#*** The lab hosts, with their lab addresses:
+HOSTS = (Host('pc1', 'clients', '10.1.0.1'),
+         Host('lg1', 'load-generators', '10.1.0.6'),
+         Host('sv1', 'servers', '10.1.0.2'))
+PREFIX_LENGTH = 24
+
+#*** Namespaces are named with a prefix, and the switch end of the
+#***  veth pair of each after the host:
+NAMESPACE_PREFIX = 'nmeta_'
+SWITCH_PORT_PREFIX = 'nm-'
+HOST_INTERFACE = 'eth0'
+
+#*** Switch bridge and the controller it connects to:
+BRIDGE = 'br0'
+CONTROLLER = 'tcp:127.0.0.1:6633'
+
+#*** Directory of the per namespace hosts files used by ip netns:
+NETNS_ETC = '/etc/netns'
+
+#*** pkill limited to processes in the caller's network namespace:
+PKILL_SHIM = """#!/bin/sh
+exec "$(PATH=/usr/bin:/bin command -v pkill)" --ns $$ --nslist net "$@"
+"""
+SYSTEM_PATH = '/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin'
+
+class LocalTopology(object):
+    """
+    The lab topology built from network namespaces on this machine,
+    and an Ansible inventory of it. Passed userspace=True to use the
+    Open vSwitch userspace datapath
+    """
+    def __init__(self, logger, name='local', userspace=False,
+                                                        python=None):
+        self.logger = logger
+        self.name = name
+        self.userspace = userspace
+        self.python = python or sys.executable
+        self.directory = tempfile.mkdtemp(prefix='nmeta_local')
+        self.inventory = os.path.join(self.directory, 'inventory')
+        self.bin_dir = os.path.join(self.directory, 'bin')
+        os.mkdir(self.bin_dir)
+        pkill = os.path.join(self.bin_dir, 'pkill')
+        with open(pkill, 'w') as filehandle:
+            filehandle.write(PKILL_SHIM)
+        os.chmod(pkill, 0o755)
+        with open(self.inventory, 'w') as filehandle:
+            filehandle.write(self.inventory_text())
+
+    def interpreter(self, host):
+        """
+        Return the Ansible Python interpreter of a host, which runs
+        in its namespace as the current user
+        """
+        return "sudo ip netns exec %s%s sudo -u %s env PATH=%s:%s %s" % (
+                            NAMESPACE_PREFIX, host.name, getpass.getuser(),
+                            self.bin_dir, SYSTEM_PATH, self.python)
+
+    def inventory_text(self):
+        """
+        Return the Ansible inventory of the topology
+        """
+        lines = ["[controllers]",
+                "controller ansible_connection=local",
+                "", "[switches]",
+                "switch ansible_connection=local"]
+        for host in HOSTS:
+            lines += ["", "[%s]" % host.group,
+                    "%s ansible_connection=local "
+                    "ansible_python_interpreter=\"%s\"" % (host.name,
+                    self.interpreter(host))]
+        return "\n".join(lines) + "\n"
+
+    def setup_script(self):
+        """
+        Return the shell script that builds the topology, after
+        removing any left over from an earlier run
+        """
+        lines = self.teardown_script().splitlines() + ["set -e"]
+        hosts_file = "127.0.0.1 localhost\\n" + "".join(
+                    "%s %s\\n" % (host.address, host.name) for host in HOSTS)
+        ovs = ["ovs-vsctl", "add-br", BRIDGE]
+        if self.userspace:
+            ovs += ["--", "set", "bridge", BRIDGE, "datapath_type=netdev"]
+        ovs += ["--", "set", "bridge", BRIDGE, "protocols=OpenFlow13",
+                "--", "set-fail-mode", BRIDGE, "secure",
+                "--", "set-controller", BRIDGE, CONTROLLER]
+        for host in HOSTS:
+            namespace = NAMESPACE_PREFIX + host.name
+            port = SWITCH_PORT_PREFIX + host.name
+            lines += ["ip netns add %s" % namespace,
+                    "mkdir -p %s/%s" % (NETNS_ETC, namespace),
+                    "printf '%s' > %s/%s/hosts" % (hosts_file, NETNS_ETC,
+                                                                namespace),
+                    "ip link add %s type veth peer name %s netns %s" % (
+                                        port, HOST_INTERFACE, namespace),
+                    "ip link set %s up" % port,
+                    "ip -n %s addr add %s/%s dev %s" % (namespace,
+                            host.address, PREFIX_LENGTH, HOST_INTERFACE),
+                    "ip -n %s link set %s up" % (namespace, HOST_INTERFACE),
+                    "ip -n %s link set lo up" % namespace]
+            ovs += ["--", "add-port", BRIDGE, port]
+        lines.append(" ".join(ovs))
+        return "\n".join(lines) + "\n"
+
+    def teardown_script(self):
+        """
+        Return the shell script that removes the topology, killing
+        any processes left running in its namespaces
+        """
+        lines = ["ovs-vsctl --if-exists del-br %s" % BRIDGE]
+        for host in HOSTS:
+            namespace = NAMESPACE_PREFIX + host.name
+            lines += ["ip netns pids %s 2>/dev/null | xargs -r kill -9" %
+                                                                namespace,
+                    "ip netns delete %s 2>/dev/null || true" % namespace,
+                    "rm -rf %s/%s" % (NETNS_ETC, namespace)]
+        return "\n".join(lines) + "\n"
+
+    def setup(self):
+        """
+        Build the topology. Exits if it cannot be built
+        """
+        self._run('setup', self.setup_script())
+
+    def teardown(self):
+        """
+        Remove the topology and its inventory
+        """
+        self._run('teardown', self.teardown_script())
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _run(self, action, script):
+        """
+        Run a script as root, exiting if it fails
+        """
+        start = time.time()
+        process = subprocess.Popen(['sudo', 'sh', '-s'],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+        output = process.communicate(script.encode('ascii'))[0]
+        if process.returncode:
+            self.logger.critical("local testbed %s failed: %s", action,
+                                    output.decode('utf-8', 'replace'))
+            sys.exit("Please check the local testbed. Exiting...")
+        self.logger.info("local testbed=%s %s took %.2fs", self.name,
+                                                action, time.time() - start)
@@ -26,21 +26,116 @@ Provides quantitative (performance) and qualitative (pass test) data
 
 Requires Ansible and test network environment. See documentation for
 details.
+
+A run profile adjusts the test matrix for the kind of run, and
+settings of every test can be overridden per run:
+    nmeta_systemtest.py --profile smoke --set duration=3
+
+A failed run can be resumed, running only the cases that did not
+pass, and cases can be selected by suite or suite/test:
+    nmeta_systemtest.py --resume 20161017101010 \
+                            --only statistical/constrained-bw-iperf
+
+A recorded run can be replayed without the lab, e.g. to check
+changes to analysis or scheduling in seconds, and the harness's
+own overhead per case benchmarked:
+    nmeta_systemtest.py --replay 20161017101010 [--benchmark]
+
+The traffic tests can also be run on a local testbed of network
+namespaces on this machine, with nmeta running locally:
+    nmeta_systemtest.py --local --profile smoke
+
+Soak mode loops the selected cases for a set duration, failing as
+soon as a trend such as a controller memory leak or latency creep
+crosses its threshold:
+    nmeta_systemtest.py --profile soak --soak 8h --only performance
+
+Each finished case is recorded in the run's results directory as a
+JSON line of its inputs, phase times, measurements, thresholds and
+verdict, and the run as JUnit XML for CI. Where the time of the
+run went, down to each playbook task, is written as a Chrome trace.
+
+The results of each test are collected from all hosts at once, in
+one compressed bundle per host, and runs older than a set age are
+packed into one archive each, which the result parsers read from
+directly.
 """
 
+import argparse
+import collections
 import datetime
 import os
-import time
 from os.path import expanduser
+import random
+import shutil
 import sys
+import threading
+import time
 
 #*** Logging imports:
 import logging
 import logging.handlers
 import coloredlogs
 
-#*** Regular Expressions import:
-import re
+#*** Adaptive readiness polling in place of fixed waits:
+import readiness
+
+#*** Spreading test cases across testbeds:
+import scheduler
+
+#*** Replay of recorded runs without the lab:
+import replay
+
+#*** Local testbed of network namespaces:
+import netns
+
+#*** Looping cases for hours with trend detection:
+import soak
+
+#*** Timing where the time of a run goes:
+import tracing
+
+#*** Playbook execution backends:
+import runner
+
+#*** nmeta controller lifecycle management:
+import controller
+
+#*** Streaming RTT analysis:
+import rtt
+
+#*** Sequential statistical pass/fail of repeated samples:
+import sampling
+
+#*** Historical results store:
+import resultsdb
+
+#*** Iperf CSV time series parsing:
+import iperf
+
+#*** Declarative test matrix:
+import matrix
+
+#*** Controller scaling benchmark:
+import scaling
+
+#*** Switch flow table dump analysis:
+import flows
+
+#*** Controller resource profiling:
+import profiler
+
+#*** Incremental nmeta log checking:
+import logwatch
+
+#*** Trend report over all runs:
+import report
+
+#*** Record of finished cases for resuming runs:
+import manifest
+
+#*** Bulk result collection and packed run archives:
+import artifacts
 
 #*** Filename for results to be written to:
 RESULTS_DIR = 'nmeta_systemtest_results'
@@ -48,85 +143,130 @@ LOGGING_FILENAME = 'test_results.txt'
 LOGGING_FILE_LEVEL = logging.INFO
 LOGGING_FILE_FORMAT = "%(asctime)s %(levelname)s: " \
                             "%(funcName)s: %(message)s"
+#*** Filename for record of readiness waits and time saved:
+READINESS_FILENAME = 'readiness_waits.csv'
+#*** Filename for record of playbook run times and exit codes:
+PLAYBOOK_STEPS_FILENAME = 'playbook_steps.csv'
+#*** Filenames for structured records of finished cases (inputs,
+#***  phase times, measurements, thresholds and verdict), as JSON
+#***  lines and as JUnit XML for CI:
+MANIFEST_FILENAME = 'run_manifest.jsonl'
+JUNIT_FILENAME = 'junit.xml'
+#*** Filename for the trace of harness phases and playbook tasks, in
+#***  Chrome trace event format:
+TRACE_FILENAME = 'run_trace.json'
+#*** Directory that results of cases rerun on resume are moved to:
+ATTEMPTS_DIR = '.attempts'
 
 #*** Parameters for capture of environment configuration:
 ENVIRONMENT_PLAYBOOK = 'nmeta-full-regression-environment-template.yml'
 
-#*** Parameters for regression of Locations classification:
-LOCATIONS_REPEATS = 1
-LOCATIONS_TESTS = ["lg1-constrained-bw", "pc1-constrained-bw"]
-LOCATIONS_POLICY_1 = 'main_policy_regression_locations.yaml'
-LOCATIONS_POLICY_2 = 'main_policy_regression_locations_2.yaml'
-LOCATIONS_DURATION = 10
-LOCATIONS_PLAYBOOK = 'nmeta-full-regression-locations-template.yml'
-LOCATIONS_TCP_PORT = 5555
-LOCATIONS_PAUSE1_SWITCH2CONTROLLER = 10
-LOCATIONS_PAUSE3_INTERTEST = 6
-LOCATIONS_SLEEP = 30
-LOCATIONS_TEST_FILES = ['lg1.example.com-iperf_result.txt',
-                    'pc1.example.com-iperf_result.txt']
-LOCATIONS_THRESHOLD_CONSTRAINED = 200000
-LOCATIONS_THRESHOLD_UNCONSTRAINED = 1000000
-
-#*** Parameters for regression of Static classification:
-STATIC_REPEATS = 1
-STATIC_TESTS = ["constrained-bw-tcp1234", "constrained-bw-tcp5555"]
-STATIC_POLICY_1 = 'main_policy_regression_static.yaml'
-STATIC_POLICY_2 = 'main_policy_regression_static_2.yaml'
-STATIC_DURATION = 10
-STATIC_PLAYBOOK = 'nmeta-full-regression-static-template.yml'
-STATIC_PAUSE_SWITCH2CONTROLLER = 30
-STATIC_SLEEP = 30
-STATIC_TEST_FILES = ["pc1.example.com-1234-iperf_result.txt",
-                    "pc1.example.com-5555-iperf_result.txt"]
-STATIC_THRESHOLD_CONSTRAINED = 200000
-STATIC_THRESHOLD_UNCONSTRAINED = 1000000
-
-#*** Parameters for regression of Identity classification:
-IDENTITY_REPEATS = 1
-IDENTITY_TESTS = ["lg1-constrained-bw", "pc1-constrained-bw"]
-IDENTITY_POLICY_1 = 'main_policy_regression_identity.yaml'
-IDENTITY_POLICY_2 = 'main_policy_regression_identity_2.yaml'
-IDENTITY_DURATION = 10
-IDENTITY_PLAYBOOK = 'nmeta-full-regression-identity-template.yml'
-IDENTITY_TCP_PORT = 5555
-IDENTITY_PAUSE1_SWITCH2CONTROLLER = 10
-IDENTITY_PAUSE2_LLDPLEARN = 30
-IDENTITY_PAUSE3_INTERTEST = 6
-IDENTITY_SLEEP = 30
-IDENTITY_TEST_FILES = ['lg1.example.com-iperf_result.txt',
-                    'pc1.example.com-iperf_result.txt']
-IDENTITY_THRESHOLD_CONSTRAINED = 200000
-IDENTITY_THRESHOLD_UNCONSTRAINED = 1000000
-
-#*** Parameters for regression of Statistical classification:
-STATISTICAL_REPEATS = 1
-STATISTICAL_TESTS = ['constrained-bw-iperf', 'unconstrained-bw-iperf']
-STATISTICAL_POLICY_1 = 'main_policy_regression_statistical.yaml'
-STATISTICAL_POLICY_2 = 'main_policy_regression_statistical_control.yaml'
-STATISTICAL_DURATION = 10
-STATISTICAL_PLAYBOOK = 'nmeta-full-regression-statistical-template.yml'
-STATISTICAL_TCP_PORT = 5555
-STATISTICAL_PAUSE_SWITCH2CONTROLLER = 10
-STATISTICAL_SLEEP = 30
-STATISTICAL_TEST_FILES = ['pc1.example.com-iperf_result.txt',]
-STATISTICAL_THRESHOLD_CONSTRAINED = 400000
-STATISTICAL_THRESHOLD_UNCONSTRAINED = 1000000
-
-#*** Parameters for performance testing:
-#*** Test effect of different classification policies on performance:
-PERFORMANCE_TESTS = ['static', 'identity', 'statistical']
-PERFORMANCE_COUNT = 30
-PERFORMANCE_PLAYBOOK = 'nmeta-full-regression-performance-template.yml'
-PERFORMANCE_PAUSE_SWITCH2CONTROLLER = 10
-PERFORMANCE_HPING3_FILENAME = 'pc1.example.com-hping3_output.txt'
-PERFORMANCE_SLEEP = 30
-
-#*** Parameters for analysis of nmeta syslog events:
-LOGROTATE_PLAYBOOK = 'nmeta-full-regression-logrotate-template.yml'
-LOGCHECK_PLAYBOOK = 'nmeta-full-regression-logcheck-template.yml'
+#*** Declarative matrix of test suites, cases and expectations:
+TEST_MATRIX = 'test_matrix.yaml'
+#*** Run profiles that adjust the matrix, and the one used by default:
+RUN_PROFILES = 'run_profiles.yaml'
+DEFAULT_PROFILE = 'nightly'
+
+#*** Performance test RTT histogram output:
+PERFORMANCE_HISTOGRAM_FILENAME = 'rtt_histogram.csv'
+
+#*** Flow setup benchmark: probes of the same flow run that go via
+#***  the controller, and histogram outputs of the two paths:
+FLOWSETUP_FIRST_PROBES = 1
+FLOWSETUP_CONTROLLER_HISTOGRAM = 'controller_path_histogram.csv'
+FLOWSETUP_FAST_HISTOGRAM = 'fast_path_histogram.csv'
+#*** Range of the random base source port of each flow setup run, so
+#***  that its probes do not match flows left by an earlier run:
+FLOWSETUP_PORT_MIN = 20000
+FLOWSETUP_PORT_MAX = 60000
+
+#*** Scaling benchmark output of each step and the knee point:
+SCALING_FILENAME = 'scaling_steps.csv'
+
+#*** Mixed policy benchmark result file keys end with these for the
+#***  hping3 runs of a host before (idle) and during (loaded) the load,
+#***  other result files are its iperf streams:
+MIXED_IDLE_SUFFIX = '_idle'
+MIXED_LOADED_SUFFIX = '_loaded'
+
+#*** Parameters for analysis of nmeta syslog events. Lines logged
+#***  during a test are checked against the logwatch rules, the same
+#***  as the logwatch command line uses:
+LOGTAIL_PLAYBOOK = 'nmeta-full-regression-logtail-template.yml'
+NMETA_LOG_FILENAME = 'nmeta_log.txt'
+NMETA_LOG_POSITION_FILENAME = 'nmeta_log_position.txt'
 LOG_ERROR_FILENAME = 'errors_logged.txt'
 
+#*** Most flows allowed in any switch flow table snapshot, and most
+#***  flows added between the pc1 and lg1 snapshots, so that nmeta
+#***  changes that blow up the switch flow table footprint fail:
+FLOW_TABLE_MAX_FLOWS = 500
+FLOW_TABLE_MAX_GROWTH = 100
+
+#*** Sample controller CPU, memory and threads during every test,
+#***  every interval seconds, and optionally py-spy stack samples at
+#***  a rate per second (attaches at test start so needs
+#***  CONTROLLER_REUSE):
+CONTROLLER_PROFILE = True
+CONTROLLER_PROFILE_INTERVAL = 0.5
+CONTROLLER_PROFILE_STACKS = False
+CONTROLLER_PROFILE_STACK_RATE = 100
+PROFILE_START_PLAYBOOK = 'nmeta-full-regression-profile-start-template.yml'
+PROFILE_STOP_PLAYBOOK = 'nmeta-full-regression-profile-stop-template.yml'
+PROFILE_FILENAME = 'controller_profile.bin'
+PROFILE_STACKS_FILENAME = 'controller_stacks.txt'
+
+#*** Ansible inventories of isolated testbeds to spread test cases
+#***  across. Empty list runs on the default Ansible inventory:
+TESTBED_INVENTORIES = []
+DEFAULT_TESTBED = 'default'
+#*** Backend that runs playbooks. One of runner.BACKENDS:
+EXECUTION_BACKEND = 'ansible-playbook'
+
+#*** Fetch the results of each test playbook from all hosts in one
+#***  compressed bundle per host, rather than file by file:
+BULK_FETCH = True
+COLLECT_PLAYBOOK = 'nmeta-full-regression-collect-template.yml'
+
+#*** Use the Open vSwitch userspace datapath for a local testbed,
+#***  where the openvswitch kernel module is unavailable:
+LOCAL_USERSPACE_DATAPATH = False
+
+#*** Subdirectory of the results directory for replayed runs, so
+#***  they are kept out of the results database and trend report:
+REPLAY_DIR = 'replay'
+#*** Filename for the harness time of each case of a benchmark:
+BENCHMARK_FILENAME = 'harness_benchmark.csv'
+
+#*** Analyse each test's results in the background while the
+#***  testbed runs the next test:
+PIPELINE_ANALYSIS = True
+
+#*** Latest trace spans kept for the trace file of a soak run, so that
+#***  its memory stays constant however long it runs:
+SOAK_TRACE_SPANS = 10000
+
+#*** Keep nmeta running between test cases that share a policy:
+CONTROLLER_REUSE = True
+CONTROLLER_START_PLAYBOOK = \
+                    'nmeta-full-regression-controller-start-template.yml'
+CONTROLLER_STOP_PLAYBOOK = \
+                    'nmeta-full-regression-controller-stop-template.yml'
+
+#*** Historical results database and regression detection, flagging
+#***  measurements that moved more than the tolerance (fraction) from
+#***  the mean of the previous window runs:
+RESULTS_DB = os.path.join(expanduser("~"), RESULTS_DIR, 'results.sqlite')
+REGRESSION_TOLERANCE = 0.1
+REGRESSION_WINDOW = 5
+#*** Update the trend report over all runs in the results directory
+#***  at the end of each run:
+TREND_REPORT = True
+#*** Pack runs older than this many days into one compressed archive
+#***  each, which the result parsers read without extracting. 0 keeps
+#***  every run as a directory:
+ARCHIVE_AFTER_DAYS = 30
+
 #*** Ansible Playbook directory:
 HOME_DIR = expanduser("~")
 PLAYBOOK_DIR = os.path.join(HOME_DIR,
@@ -136,8 +276,48 @@ def main():
     """
     Main function of nmeta regression tests.
     Sets up logging, creates the timestamped directory
-    and runs functions for the various regression test types
+    and runs functions for the various regression test types.
+    A failed run can be resumed, running only the cases that have
+    not passed
     """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--profile', default=DEFAULT_PROFILE,
+                        help="run profile from %s, e.g. smoke, nightly "
+                        "or soak" % RUN_PROFILES)
+    parser.add_argument('--set', metavar='KEY=VALUE', action='append',
+                        help="override repeats, max_samples, settle or "
+                        "a playbook extra var of every test, may be "
+                        "repeated")
+    parser.add_argument('--resume', metavar='TIMESTAMP',
+                        help="resume the run with this results timestamp, "
+                        "skipping cases that passed")
+    parser.add_argument('--only', metavar='SUITE[/TEST]', action='append',
+                        help="only run cases of a suite or suite/test, "
+                        "may be repeated")
+    parser.add_argument('--replay', metavar='RUN',
+                        help="replay the results of a recorded run, a "
+                        "results timestamp or directory, without the lab")
+    parser.add_argument('--time-scale', type=float, default=0.0,
+                        help="replay playbooks taking their recorded "
+                        "duration times this, default 0")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="with --replay, measure the harness overhead "
+                        "per case")
+    parser.add_argument('--soak', metavar='DURATION',
+                        help="loop the cases for a duration such as 90m "
+                        "or 8h, failing on trends in their measurements")
+    parser.add_argument('--local', action='store_true',
+                        help="run on a local testbed of network "
+                        "namespaces on this machine")
+    args = parser.parse_args()
+    if args.benchmark and not args.replay:
+        parser.error("--benchmark needs --replay")
+    if args.local and args.replay:
+        parser.error("--local and --replay are exclusive")
+    try:
+        soak_seconds = soak.parse_duration(args.soak) if args.soak else 0
+    except ValueError as exception:
+        parser.error(str(exception))
 
     #*** Set up logging:
     logging.basicConfig(level=logging.DEBUG)
@@ -149,6 +329,26 @@ def main():
            "%(funcName)s %(levelname)s %(message)s", datefmt='%H:%M:%S')
     logger.info("Running full regression test of nmeta")
 
+    #*** Load the test matrix, adjusted by the run profile:
+    try:
+        specs = matrix.load_matrix(os.path.join(PLAYBOOK_DIR, TEST_MATRIX))
+        profiles = matrix.load_profiles(os.path.join(PLAYBOOK_DIR,
+                                                            RUN_PROFILES))
+        if args.profile not in profiles:
+            raise ValueError("no profile %s, profiles are %s" % (
+                            args.profile, ", ".join(sorted(profiles))))
+        specs = matrix.apply_profile(specs, profiles[args.profile],
+                                    matrix.parse_overrides(args.set or []))
+        check_flowsetup_counts(specs)
+        check_mixed_specs(specs)
+    except (IOError, ValueError) as exception:
+        logger.critical("invalid test matrix or run profile: %s",
+                                                            exception)
+        sys.exit("Please fix the test matrix or run options. Exiting...")
+    logger.info("profile=%s %s overrides=%s", args.profile,
+                profiles[args.profile].get('description', ''),
+                " ".join(args.set or []))
+
     #*** Timestamp for results root directory:
     timenow = datetime.datetime.now()
     timestamp = timenow.strftime("%Y%m%d%H%M%S")
@@ -156,13 +356,39 @@ def main():
 
     #*** Directory base path to write results to:
     results_dir = os.path.join(HOME_DIR, RESULTS_DIR)
-
-    #*** Create root directory for results:
-    os.chdir(results_dir)
-    logger.debug("creating subdirectory %s", timestamp)
-    os.mkdir(timestamp)
-    basedir = os.path.join(results_dir, timestamp)
+    replayer = None
+    if args.replay:
+        recorded_dir = args.replay if os.path.isdir(args.replay) else \
+                                    os.path.join(results_dir, args.replay)
+        if not os.path.isdir(recorded_dir):
+            logger.critical("no recorded run to replay in %s",
+                                                            recorded_dir)
+            sys.exit("Please check the run to replay. Exiting...")
+        logger.info("replaying run %s time_scale=%s", recorded_dir,
+                    0.0 if args.benchmark else args.time_scale)
+        replayer = replay.Replayer(logger, recorded_dir,
+                                0.0 if args.benchmark else args.time_scale)
+        results_dir = os.path.join(results_dir, REPLAY_DIR)
+        if not os.path.isdir(results_dir):
+            os.makedirs(results_dir)
+
+    #*** Create root directory for results, or reuse the one of the
+    #***  run being resumed:
+    if args.resume:
+        basedir = os.path.join(results_dir, args.resume)
+        if not os.path.isfile(os.path.join(basedir, MANIFEST_FILENAME)):
+            logger.critical("no run to resume in %s", basedir)
+            sys.exit("Please check the resume timestamp. Exiting...")
+    else:
+        logger.debug("creating subdirectory %s", timestamp)
+        basedir = os.path.join(results_dir, timestamp)
+        os.mkdir(basedir)
     logger.info("base directory is %s", basedir)
+    #*** A soak run reads its manifest back rather than keeping it:
+    run_manifest = manifest.Manifest(os.path.join(basedir,
+                        MANIFEST_FILENAME), in_memory=not soak_seconds)
+    if soak_seconds:
+        tracing.TRACER.keep_latest(SOAK_TRACE_SPANS)
 
     #*** Set up logging to file in the root dir for these results:
     logging_file = os.path.join(basedir, LOGGING_FILENAME)
@@ -172,462 +398,903 @@ def main():
     logging_fh.setFormatter(formatter)
     logger.addHandler(logging_fh)
 
-    #*** Capture environment settings:
-    record_environment(logger, basedir)
-
-    #*** Run performance baseline tests:
-    regression_performance(logger, basedir)
-
-    #*** Run locations traffic classification testing:
-    test_locations_tc(logger, basedir)
-
-    #*** Run static traffic classification testing:
-    test_static_tc(logger, basedir)
-
-    #*** Run identity traffic classification testing:
-    test_identity_tc(logger, basedir)
-
-    #*** Run statistical regression testing:
-    test_statistical_tc(logger, basedir)
+    #*** Poll for readiness rather than waiting fixed times:
+    ready = readiness.Readiness(logger)
+
+    #*** Testbeds to spread the test cases across:
+    topology = netns.LocalTopology(logger,
+                        userspace=LOCAL_USERSPACE_DATAPATH) \
+                        if args.local else None
+    testbeds = get_testbeds(replayer, topology)
+
+    #*** Capture environment settings, unless already captured:
+    for testbed in testbeds:
+        if args.resume:
+            break
+        with tracing.span('record environment', testbed=testbed.name):
+            if len(testbeds) == 1:
+                record_environment(logger, basedir, testbed)
+            else:
+                record_environment(logger,
+                            os.path.join(basedir, testbed.name), testbed)
+
+    #*** Build the test cases from the test matrix, performance
+    #***  baseline tests first then traffic classification testing:
+    try:
+        cases = matrix.build_cases(specs, {'iperf': iperf_case,
+                        'performance': performance_case,
+                        'scaling': scaling_case,
+                        'flowsetup': flowsetup_case,
+                        'mixed': mixed_case})
+    except ValueError as exception:
+        logger.critical("invalid test matrix %s: %s", TEST_MATRIX,
+                                                            exception)
+        sys.exit("Please fix the test matrix. Exiting...")
+    for selector in args.only or []:
+        if not any(manifest.matches(case, selector) for case in cases):
+            logger.critical("--only %s matches no test of profile %s",
+                                                selector, args.profile)
+            sys.exit("Please check the selected tests. Exiting...")
+    passed = run_manifest.passed()
+    cases = manifest.select(cases, args.only, passed)
+    if args.resume:
+        logger.info("resuming run %s, skipping %s passed cases",
+                                                args.resume, len(passed))
+        retire_results(logger, basedir, cases, passed, timestamp)
+    if CONTROLLER_REUSE:
+        #*** Group cases by policy to minimise controller restarts:
+        cases = controller.order_by_policy(cases)
+    for line in matrix.ExecutionPlan(cases, len(testbeds)).describe():
+        logger.info("execution plan %s", line)
+
+    #*** Structured record of each case run until it is in the manifest:
+    records = collections.OrderedDict()
+    records_lock = threading.Lock()
+    monitor = soak.SoakMonitor(logger) if soak_seconds else None
+
+    def run_case(case, testbed):
+        """
+        Run a case and record it in the manifest, once its background
+        analysis has also passed
+        """
+        record = manifest.CaseRecord(case, testbed.name)
+        with records_lock:
+            records[id(record)] = record
+        try:
+            with tracing.span("%s test=%s" % (case.suite, case.test),
+                            'case', iteration=case.iteration,
+                            policy=case.policy_name):
+                case.func(logger, basedir, ready, testbed, case, record)
+        except scheduler.Aborted:
+            raise
+        except BaseException as exception:
+            finish(record, *manifest.verdict_of(exception))
+            raise
+        if monitor:
+            #*** Check for trends once the case is analysed:
+            testbed.analyse("%s test=%s" % (case.suite, case.test),
+                            record.checked, monitor.observe, record)
+        testbed.analyse("%s test=%s" % (case.suite, case.test),
+                        finish, record, manifest.PASSED)
+
+    def finish(record, verdict, detail=None):
+        """
+        Record a case in the manifest and let go of its record
+        """
+        run_manifest.record(record, verdict, detail)
+        with records_lock:
+            records.pop(id(record), None)
+
+    try:
+        if topology:
+            with tracing.span('local testbed setup'):
+                topology.setup()
+        if soak_seconds:
+            completed = soak.run_rounds(logger, testbeds, cases, run_case,
+                                soak_seconds, monitor, PIPELINE_ANALYSIS)
+        else:
+            completed = scheduler.Scheduler(logger, testbeds,
+                                PIPELINE_ANALYSIS).run(cases, run_case)
+    finally:
+        #*** Stop any controllers that were kept running:
+        for testbed in testbeds:
+            if testbed.controller:
+                testbed.controller.stop(logger)
+        if topology:
+            with tracing.span('local testbed teardown'):
+                topology.teardown()
+        #*** Record playbook run times and close persistent connections,
+        #***  even when a case failed or the run was interrupted:
+        steps = []
+        for testbed in testbeds:
+            steps += testbed.backend.steps
+            testbed.backend.close()
+        runner.write_steps(logger, steps,
+                        os.path.join(basedir, PLAYBOOK_STEPS_FILENAME))
+        #*** Record cases whose background analysis failed:
+        with records_lock:
+            unfinished = list(records.values())
+        for record in unfinished:
+            if record.verdict is None and record.failure:
+                run_manifest.record(record, *record.failure)
+        run_manifest.write_junit(os.path.join(basedir, JUNIT_FILENAME))
+        tracing.TRACER.write(os.path.join(basedir, TRACE_FILENAME))
+    if CONTROLLER_REUSE:
+        controller.log_summary(logger, [testbed.controller
+                                            for testbed in testbeds])
+    for case, testbed_name, seconds in completed:
+        logger.debug("suite=%s test=%s ran on testbed=%s in %.1fs",
+                        case.suite, case.test, testbed_name, seconds)
+
+    #*** Record how much time readiness polling saved:
+    ready.write_summary(os.path.join(basedir, READINESS_FILENAME))
+
+    if args.benchmark:
+        replay.write_benchmark(logger, run_manifest.latest(),
+                                os.path.join(basedir, BENCHMARK_FILENAME))
+
+    #*** Add results to the historical database and flag regressions,
+    #***  unless they were replayed:
+    if replayer:
+        logger.info("replayed run, not adding results to %s", RESULTS_DB)
+    else:
+        with tracing.span('ingest results'):
+            conn = resultsdb.connect(RESULTS_DB)
+            resultsdb.ingest_run(conn, basedir, replace=bool(args.resume))
+            resultsdb.log_regressions(logger,
+                        resultsdb.detect_regressions(conn,
+                        REGRESSION_TOLERANCE, REGRESSION_WINDOW,
+                        os.path.basename(basedir)))
+            conn.close()
+    if TREND_REPORT and not replayer:
+        with tracing.span('trend report'):
+            report.write_report(logger, results_dir,
+                                os.path.join(results_dir, report.REPORT_DIR))
+
+    #*** Pack old runs once their results are in the database:
+    if ARCHIVE_AFTER_DAYS and not replayer:
+        with tracing.span('archive runs'):
+            conn = resultsdb.connect(RESULTS_DB)
+            resultsdb.ingest_tree(conn, logger, results_dir)
+            conn.close()
+            artifacts.pack_runs(logger, results_dir, ARCHIVE_AFTER_DAYS)
+
+    #*** Record where the time of the run went:
+    tracing.TRACER.write(os.path.join(basedir, TRACE_FILENAME))
+    tracing.TRACER.log_summary(logger)
 
     #*** And we're done!:
     logger.info("All testing finished, that's a PASS!")
     logger.info("See test report at %s/%s", basedir, LOGGING_FILENAME)
 
-def record_environment(logger, basedir):
+def get_testbeds(replayer=None, topology=None):
+    """
+    Return the list of testbeds to run on. With no TESTBED_INVENTORIES
+    this is a single testbed using the default Ansible inventory.
+    If passed a replay.Replayer, the testbeds are local stand-ins
+    that replay a recorded run, and if passed a netns.LocalTopology,
+    the testbed is the local topology
+    """
+    if topology:
+        testbeds = [scheduler.Testbed(topology.name, topology.inventory,
+                            runner.get_backend(EXECUTION_BACKEND))]
+    elif replayer:
+        testbeds = [scheduler.FakeTestbed(os.path.splitext(
+                            os.path.basename(inventory))[0],
+                            responder=replayer)
+                            for inventory in TESTBED_INVENTORIES or
+                            [DEFAULT_TESTBED]]
+    elif not TESTBED_INVENTORIES:
+        testbeds = [scheduler.Testbed(DEFAULT_TESTBED,
+                        backend=runner.get_backend(EXECUTION_BACKEND))]
+    else:
+        testbeds = [scheduler.Testbed(os.path.splitext(
+                            os.path.basename(inventory))[0], inventory,
+                            runner.get_backend(EXECUTION_BACKEND))
+                                    for inventory in TESTBED_INVENTORIES]
+    if CONTROLLER_REUSE:
+        for testbed in testbeds:
+            testbed.controller = controller.ControllerManager(testbed,
+                        os.path.join(PLAYBOOK_DIR, CONTROLLER_START_PLAYBOOK),
+                        os.path.join(PLAYBOOK_DIR, CONTROLLER_STOP_PLAYBOOK))
+    return testbeds
+
+def retire_results(logger, basedir, cases, passed, timestamp):
+    """
+    Before resuming a run, move the results of tests about to be
+    rerun, none of whose iterations passed, out of the way so that
+    they are not mixed with the new results
+    """
+    passed_tests = set((suite, test) for suite, test, _ in passed)
+    for suite, test in sorted(set((case.suite, case.test)
+                                                    for case in cases)):
+        test_dir = os.path.join(basedir, suite, test)
+        if (suite, test) in passed_tests or not os.path.isdir(test_dir):
+            continue
+        attempt_dir = os.path.join(basedir, ATTEMPTS_DIR, timestamp, suite)
+        logger.info("moving earlier results of suite=%s test=%s to %s",
+                                                    suite, test, attempt_dir)
+        if not os.path.isdir(attempt_dir):
+            os.makedirs(attempt_dir)
+        shutil.move(test_dir, attempt_dir)
+
+def record_environment(logger, basedir, testbed):
     """
     Capture details of the environment including info
     on the nmeta build
     """
     extra_vars = {'results_dir': basedir + "/"}
-    playbook_cmd = build_playbook(ENVIRONMENT_PLAYBOOK, extra_vars,
-                                                                logger)
-    os.system(playbook_cmd)
-
-def test_locations_tc(logger, basedir):
-    """
-    Run nmeta locations traffic classification test(s)
-    """
-    logger.info("running locations regression testing")
-    subdir = 'locations'
-    #*** Create subdirectory to write results to:
-    os.chdir(basedir)
-    os.mkdir(subdir)
-    test_basedir = os.path.join(basedir, subdir)
-    #*** Run tests
-    for i in range(LOCATIONS_REPEATS):
-        logger.debug("iteration %s of %s", i+1, LOCATIONS_REPEATS)
-        for test in LOCATIONS_TESTS:
-            #*** Timestamp for specific test subdirectory:
-            timenow = datetime.datetime.now()
-            testdir_timestamp = timenow.strftime("%Y%m%d%H%M%S")
-            logger.info("running test=%s", test)
-            test_dir = os.path.join(test_basedir, test,
-                                                    testdir_timestamp)
-            rotate_log(logger)
-            if test == "lg1-constrained-bw":
-                policy_name = LOCATIONS_POLICY_1
-            elif test == "pc1-constrained-bw":
-                policy_name = LOCATIONS_POLICY_2
-            else:
-                logger.critical("ERROR: unknown locations test %s",
-                                                                   test)
-                sys.exit()
-            extra_vars = {'duration': str(LOCATIONS_DURATION),
-                        'results_dir': test_dir + "/",
-                        'policy_name': policy_name,
-                        'tcp_port': str(LOCATIONS_TCP_PORT),
-                        'pause1':
-                                str(LOCATIONS_PAUSE1_SWITCH2CONTROLLER),
-                        'pause3': str(LOCATIONS_PAUSE3_INTERTEST)}
-            playbook_cmd = build_playbook(LOCATIONS_PLAYBOOK,
-                                            extra_vars, logger)
-            logger.debug("running Ansible playbook for locations...")
-            os.system(playbook_cmd)
-
-            #*** Analyse locations regression results:
-            logger.debug("Reading results in directory %s", test_dir)
-            results = {}
-            for filename in LOCATIONS_TEST_FILES:
-                results[filename] = get_iperf_bw(test_dir, filename)
-
-            #*** Validate that the results are as expected:
-            if test == LOCATIONS_TESTS[0]:
-                constrained = results[LOCATIONS_TEST_FILES[0]]
-                unconstrained = results[LOCATIONS_TEST_FILES[1]]
-            elif test == LOCATIONS_TESTS[1]:
-                constrained = results[LOCATIONS_TEST_FILES[1]]
-                unconstrained = results[LOCATIONS_TEST_FILES[0]]
-            else:
-                #*** Unknown error condition:
-                logger.critical("UNKNOWN TEST TYPE. test=%s", test)
-                sys.exit("Please fix this test code. Exiting...")
-            logger.info("validating bw constrained=%s unconstrained=%s",
-                                             constrained, unconstrained)
-            assert constrained < LOCATIONS_THRESHOLD_CONSTRAINED
-            assert unconstrained > LOCATIONS_THRESHOLD_UNCONSTRAINED
-            logger.info("LOCATIONS TC TEST PASSED. test=%s", test)
-            logger.info("bandwidth constrained=%s unconstrained=%s",
-                                constrained, unconstrained)
-
-            #*** Check for any logs that are CRITICAL or ERROR:
-            check_log(logger, test_dir)
-
-            logger.debug("Sleeping... zzzz")
-            time.sleep(LOCATIONS_SLEEP)
-
-def test_static_tc(logger, basedir):
-    """
-    Run nmeta static traffic classification test(s)
-    """
-    logger.info("running static regression testing")
-    subdir = 'static'
-    #*** Create subdirectory to write results to:
-    os.chdir(basedir)
-    os.mkdir(subdir)
-    test_basedir = os.path.join(basedir, subdir)
-    #*** Run tests
-    for i in range(STATIC_REPEATS):
-        logger.debug("iteration %s of %s", i+1, STATIC_REPEATS)
-        for test in STATIC_TESTS:
-            #*** Timestamp for specific test subdirectory:
-            timenow = datetime.datetime.now()
-            testdir_timestamp = timenow.strftime("%Y%m%d%H%M%S")
-            logger.info("running test=%s", test)
-            test_dir = os.path.join(test_basedir, test,
-                                                    testdir_timestamp)
-            rotate_log(logger)
-            if test == 'constrained-bw-tcp1234':
-                policy_name = STATIC_POLICY_1
-            elif test == 'constrained-bw-tcp5555':
-                policy_name = STATIC_POLICY_2
-            else:
-                logger.critical("ERROR: unknown static test %s", test)
-                sys.exit()
-            extra_vars = {'duration': str(STATIC_DURATION),
-                        'results_dir': test_dir + "/",
-                        'policy_name': policy_name,
-                        'pause1': str(STATIC_PAUSE_SWITCH2CONTROLLER)}
-            playbook_cmd = build_playbook(STATIC_PLAYBOOK,
-                                            extra_vars, logger)
-            logger.debug("running Ansible playbook...")
-            os.system(playbook_cmd)
-
-            #*** Analyse static regression results:
-            logger.debug("Reading results in directory %s", test_dir)
-            results = {}
-            for filename in STATIC_TEST_FILES:
-                results[filename] = get_iperf_bw(test_dir, filename)
-
-            #*** Validate that the results are as expected:
-            if test == STATIC_TESTS[0]:
-                constrained = results[STATIC_TEST_FILES[0]]
-                unconstrained = results[STATIC_TEST_FILES[1]]
-            elif test == STATIC_TESTS[1]:
-                constrained = results[STATIC_TEST_FILES[1]]
-                unconstrained = results[STATIC_TEST_FILES[0]]
-            else:
-                #*** Unknown error condition:
-                logger.critical("UNKNOWN TEST TYPE. test=%s", test)
-                sys.exit("Please fix this test code. Exiting...")
-            logger.info("validating bw constrained=%s unconstrained=%s",
-                                             constrained, unconstrained)
-            assert constrained < STATIC_THRESHOLD_CONSTRAINED
-            assert unconstrained > STATIC_THRESHOLD_UNCONSTRAINED
-            logger.info("STATIC TC TEST PASSED. test=%s", test)
-            logger.info("bandwidth constrained=%s unconstrained=%s",
-                                constrained, unconstrained)
-
-            #*** Check for any logs that are CRITICAL or ERROR:
-            check_log(logger, test_dir)
-
-            logger.debug("Sleeping... zzzz")
-            time.sleep(STATIC_SLEEP)
-
-def test_identity_tc(logger, basedir):
-    """
-    Run nmeta identity traffic classification test(s)
-    """
-    logger.info("running identity regression testing")
-    subdir = 'identity'
-    #*** Create subdirectory to write results to:
-    os.chdir(basedir)
-    os.mkdir(subdir)
-    test_basedir = os.path.join(basedir, subdir)
-    #*** Run tests
-    for i in range(IDENTITY_REPEATS):
-        logger.debug("iteration %s of %s", i+1, IDENTITY_REPEATS)
-        for test in IDENTITY_TESTS:
-            #*** Timestamp for specific test subdirectory:
-            timenow = datetime.datetime.now()
-            testdir_timestamp = timenow.strftime("%Y%m%d%H%M%S")
-            logger.info("running test=%s", test)
-            test_dir = os.path.join(test_basedir, test,
-                                                    testdir_timestamp)
-            rotate_log(logger)
-            if test == "lg1-constrained-bw":
-                policy_name = IDENTITY_POLICY_1
-            elif test == "pc1-constrained-bw":
-                policy_name = IDENTITY_POLICY_2
-            else:
-                logger.critical("ERROR: unknown identity test %s", test)
-                sys.exit()
-            extra_vars = {'duration': str(IDENTITY_DURATION),
-                        'results_dir': test_dir + "/",
-                        'policy_name': policy_name,
-                        'tcp_port': str(IDENTITY_TCP_PORT),
-                        'pause1':
-                                str(IDENTITY_PAUSE1_SWITCH2CONTROLLER),
-                        'pause2': str(IDENTITY_PAUSE2_LLDPLEARN),
-                        'pause3': str(IDENTITY_PAUSE3_INTERTEST)}
-            playbook_cmd = build_playbook(IDENTITY_PLAYBOOK,
-                                            extra_vars, logger)
-            logger.debug("running Ansible playbook...")
-            os.system(playbook_cmd)
-
-            #*** Analyse identity regression results:
-            logger.debug("Reading results in directory %s", test_dir)
-            results = {}
-            for filename in IDENTITY_TEST_FILES:
-                results[filename] = get_iperf_bw(test_dir, filename)
-
-            #*** Validate that the results are as expected:
-            if test == IDENTITY_TESTS[0]:
-                constrained = results[IDENTITY_TEST_FILES[0]]
-                unconstrained = results[IDENTITY_TEST_FILES[1]]
-            elif test == IDENTITY_TESTS[1]:
-                constrained = results[IDENTITY_TEST_FILES[1]]
-                unconstrained = results[IDENTITY_TEST_FILES[0]]
-            else:
-                #*** Unknown error condition:
-                logger.critical("UNKNOWN TEST TYPE. test=%s", test)
-                sys.exit("Please fix this test code. Exiting...")
-            logger.info("validating bw constrained=%s unconstrained=%s",
-                                             constrained, unconstrained)
-            assert constrained < IDENTITY_THRESHOLD_CONSTRAINED
-            assert unconstrained > IDENTITY_THRESHOLD_UNCONSTRAINED
-            logger.info("IDENTITY TC TEST PASSED. test=%s", test)
-            logger.info("bandwidth constrained=%s unconstrained=%s",
-                                constrained, unconstrained)
-
-            #*** Check for any logs that are CRITICAL or ERROR:
-            check_log(logger, test_dir)
-
-            logger.debug("Sleeping... zzzz")
-            time.sleep(IDENTITY_SLEEP)
-
-def test_statistical_tc(logger, basedir):
-    """
-    Run nmeta statistical traffic classification test(s)
-    """
-    logger.info("running statistical regression testing")
-    subdir = 'statistical'
-    #*** Create subdirectory to write results to:
-    os.chdir(basedir)
-    os.mkdir(subdir)
-    test_basedir = os.path.join(basedir, subdir)
-    #*** Run tests
-    for i in range(STATISTICAL_REPEATS):
-        logger.debug("iteration %s of %s", i+1, STATISTICAL_REPEATS)
-        for test in STATISTICAL_TESTS:
-            #*** Timestamp for specific test subdirectory:
-            timenow = datetime.datetime.now()
-            testdir_timestamp = timenow.strftime("%Y%m%d%H%M%S")
-            logger.info("running test=%s", test)
-            test_dir = os.path.join(test_basedir, test,
-                                                    testdir_timestamp)
-            rotate_log(logger)
-            if test == 'constrained-bw-iperf':
-                policy_name = STATISTICAL_POLICY_1
-            elif test == 'unconstrained-bw-iperf':
-                policy_name = STATISTICAL_POLICY_2
-            else:
-                logger.critical("ERROR: unknown statistical test %s",
-                                                                   test)
-                sys.exit()
-            extra_vars = {'duration': str(STATISTICAL_DURATION),
-                        'results_dir': test_dir + "/",
-                        'policy_name': policy_name,
-                        'tcp_port': str(STATISTICAL_TCP_PORT),
-                        'pause1':
-                               str(STATISTICAL_PAUSE_SWITCH2CONTROLLER)}
-            playbook_cmd = build_playbook(STATISTICAL_PLAYBOOK,
-                                            extra_vars, logger)
-            logger.debug("running Ansible playbook...")
-            os.system(playbook_cmd)
-
-            #*** Analyse statistical regression results:
-            logger.debug("Reading results in directory %s", test_dir)
-            results = {}
-            for filename in STATISTICAL_TEST_FILES:
-                results[filename] = get_iperf_bw(test_dir, filename)
-
-            #*** Validate that the results are as expected:
-            if test == STATISTICAL_TESTS[0]:
-                constrained = results[STATISTICAL_TEST_FILES[0]]
-                logger.info("validating statistical bw constrained=%s",
-                                                            constrained)
-                assert constrained < STATISTICAL_THRESHOLD_CONSTRAINED
-            elif test == STATISTICAL_TESTS[1]:
-                unconstrained = results[STATISTICAL_TEST_FILES[0]]
-                logger.info("validating statistical bw unconstrained=%s"
-                                                        , unconstrained)
-                assert unconstrained > \
-                                     STATISTICAL_THRESHOLD_UNCONSTRAINED
-            else:
-                #*** Unknown error condition:
-                logger.critical("UNKNOWN TEST TYPE. test=%s", test)
-                sys.exit("Please fix this test code. Exiting...")
-
-            logger.info("STATISTICAL TC TEST PASSED. test=%s", test)
-
-            #*** Check for any logs that are CRITICAL or ERROR:
-            check_log(logger, test_dir)
-
-            logger.debug("Sleeping... zzzz")
-            time.sleep(STATISTICAL_SLEEP)
-
-def regression_performance(logger, basedir):
-    """
-    Nmeta performance regression testing
-    """
-    logger.info("running performance regression testing")
-    subdir = 'performance'
-    #*** Create subdirectory to write results to:
-    os.chdir(basedir)
-    os.mkdir(subdir)
-    test_basedir = os.path.join(basedir, subdir)
-    #*** Run tests:
-    for test in PERFORMANCE_TESTS:
-        logger.info("running test=%s", test)
-        test_dir = os.path.join(test_basedir, test)
-        rotate_log(logger)
-        if test == "static":
-            policy_name = STATIC_POLICY_1
-        elif test == "identity":
-            policy_name = IDENTITY_POLICY_1
-        elif test == "statistical":
-            policy_name = STATISTICAL_POLICY_1
-        else:
-            logger.critical("ERROR: unknown performance test %s", test)
-            sys.exit()
-        extra_vars = {'count': str(PERFORMANCE_COUNT),
-                        'results_dir': test_dir + "/",
-                        'policy_name': policy_name,
-                        'pause1':
-                               str(PERFORMANCE_PAUSE_SWITCH2CONTROLLER)}
-        playbook_cmd = build_playbook(PERFORMANCE_PLAYBOOK,
-                                            extra_vars, logger)
+    run_playbook(logger, testbed, ENVIRONMENT_PLAYBOOK, extra_vars)
+
+def iperf_case(logger, basedir, ready, testbed, case, record):
+    """
+    Run a single nmeta traffic classification test from the test
+    matrix, sampling it until the verdict is statistically settled
+    """
+    spec = case.spec
+    logger.debug("iteration %s of %s", case.iteration+1, spec['repeats'])
+    logger.info("running suite=%s test=%s", case.suite, case.test)
+    verdict = sampling.SequentialVerdict(matrix.thresholds(spec),
+                                                    spec['max_samples'])
+    record_inputs(record, spec)
+    record.thresholds = [str(threshold) for threshold in
+                                                    verdict.thresholds]
+    while not verdict.settled():
+        test_dir = make_test_dir(basedir, case)
+        with record.phase('mark_log'):
+            mark_log(logger, test_dir, testbed)
+        extra_vars = dict(spec['extra_vars'],
+                            results_dir=test_dir + "/",
+                            policy_name=case.policy_name)
         logger.debug("running Ansible playbook...")
-        os.system(playbook_cmd)
+        with record.phase('playbook'):
+            run_playbook(logger, testbed, spec['playbook'], extra_vars,
+                                                                record)
+
+        #*** Retrieve the nmeta log lines written during the test:
+        with record.phase('fetch_log'):
+            log_elapsed = fetch_log(logger, test_dir, testbed)
+
+        #*** Read the bandwidths that decide whether to sample again:
+        logger.debug("Reading results in directory %s", test_dir)
+        with record.phase('parse'):
+            results = get_iperf_results(logger, test_dir,
+                                    sorted(spec['result_files'].values()))
+
+        #*** Add the sample to the verdict:
+        sample = dict((expect['name'],
+                            results[spec['result_files'][expect['file']]])
+                            for expect in spec['expect'])
+        logger.info("sample %s bandwidth %s", verdict.count + 1,
+                " ".join("%s=%s" % item for item in sorted(sample.items())))
+        verdict.add(sample)
+        for name, value in sorted(sample.items()):
+            record.measure(name, value)
+
+        #*** Check flow tables and logs while the testbed moves on:
+        testbed.analyse("%s test=%s" % (case.suite, case.test),
+                        record.checked, analyse_iperf, logger, test_dir,
+                        spec, log_elapsed, record)
+
+        logger.debug("Waiting for environment to settle...")
+        with record.phase('settle'):
+            ready.wait("%s test=%s" % (case.suite, case.test),
+                                testbed.settle_probes(), spec['settle'])
+
+    #*** Validate that the results are as expected:
+    logger.info("validating bw %s", verdict.describe())
+    assert verdict.passed(), verdict.describe()
+    logger.info("%s TC TEST PASSED. test=%s", case.suite.upper(), case.test)
+
+def performance_case(logger, basedir, ready, testbed, case, record):
+    """
+    Run a single nmeta performance regression test from the test
+    matrix
+    """
+    spec = case.spec
+    logger.info("running test=%s", case.test)
+    record_inputs(record, spec)
+    #*** A directory per run, so iterations and soak rounds are kept
+    #***  and background analysis reads results no later run rewrites:
+    test_dir = make_test_dir(basedir, case)
+    with record.phase('mark_log'):
+        mark_log(logger, test_dir, testbed)
+    extra_vars = dict(spec['extra_vars'], results_dir=test_dir + "/",
+                                        policy_name=case.policy_name)
+    logger.debug("running Ansible playbook...")
+    with record.phase('playbook'):
+        run_playbook(logger, testbed, spec['playbook'], extra_vars,
+                                                                record)
 
-        #*** Read in and analyse hping3 RTT performance results:
-        rtt_results = hping3_read_results(os.path.join(test_dir,
-                                           PERFORMANCE_HPING3_FILENAME))
-        logger.debug("Performance results are %s", rtt_results)
-        rtt_avg = sum(rtt_results) / float(len(rtt_results))
-        logger.info("rtt_avg=%s rtt_max=%s", rtt_avg, max(rtt_results))
+    #*** Retrieve the nmeta log lines written during the test:
+    with record.phase('fetch_log'):
+        log_elapsed = fetch_log(logger, test_dir, testbed)
 
-        #*** Check for any logs that are CRITICAL or ERROR:
-        check_log(logger, test_dir)
+    #*** Analyse results while the testbed moves on:
+    testbed.analyse("performance test=" + case.test, record.checked,
+                    analyse_performance, logger, test_dir, spec,
+                    log_elapsed, record)
 
-        logger.debug("Sleeping... zzzz")
-        time.sleep(PERFORMANCE_SLEEP)
+    logger.debug("Waiting for environment to settle...")
+    with record.phase('settle'):
+        ready.wait("performance test=" + case.test,
+                                testbed.settle_probes(), spec['settle'])
+
+def flowsetup_case(logger, basedir, ready, testbed, case, record):
+    """
+    Run a flow setup latency benchmark from the test matrix,
+    separating first packet (controller path) RTT from fast path
+    (switch forwarded) RTT
+    """
+    spec = case.spec
+    logger.info("running flow setup test=%s", case.test)
+    record_inputs(record, spec)
+    #*** A directory per run, so iterations and soak rounds are kept
+    #***  and background analysis reads results no later run rewrites:
+    test_dir = make_test_dir(basedir, case)
+    with record.phase('mark_log'):
+        mark_log(logger, test_dir, testbed)
+    extra_vars = dict(spec['extra_vars'], results_dir=test_dir + "/",
+                                        policy_name=case.policy_name)
+    ports = flowsetup_ports(int(spec['extra_vars']['count']))
+    extra_vars.update(ports)
+    record.inputs.update(ports)
+    logger.debug("running Ansible playbook...")
+    with record.phase('playbook'):
+        run_playbook(logger, testbed, spec['playbook'], extra_vars,
+                                                                record)
+
+    #*** Retrieve the nmeta log lines written during the test:
+    with record.phase('fetch_log'):
+        log_elapsed = fetch_log(logger, test_dir, testbed)
+
+    #*** Analyse results while the testbed moves on:
+    testbed.analyse("flowsetup test=" + case.test, record.checked,
+                    analyse_flowsetup, logger, test_dir, spec,
+                    case.policy_name, log_elapsed, record)
+
+    logger.debug("Waiting for environment to settle...")
+    with record.phase('settle'):
+        ready.wait("flowsetup test=" + case.test, testbed.settle_probes(),
+                                                        spec['settle'])
+
+def check_flowsetup_counts(specs):
+    """
+    Raise ValueError if a flow setup test, with its overrides, sends
+    more probes than there are source ports to give each a new flow
+    """
+    most = FLOWSETUP_PORT_MAX - FLOWSETUP_PORT_MIN - 1
+    for spec in specs:
+        if spec['runner'] != 'flowsetup':
+            continue
+        try:
+            count = int(spec['extra_vars'].get('count'))
+        except (TypeError, ValueError):
+            raise ValueError("suite=%s test=%s count must be a whole "
+                                "number" % (spec['suite'], spec['test']))
+        if not 0 < count <= most:
+            raise ValueError("suite=%s test=%s count=%s, flow setup "
+                        "count must be 1 to %s, the source ports from %s "
+                        "to %s" % (spec['suite'], spec['test'], count, most,
+                        FLOWSETUP_PORT_MIN, FLOWSETUP_PORT_MAX))
+
+def flowsetup_ports(count):
+    """
+    Return the flow setup playbook extra vars of a random source
+    port for the same flow run, followed by count ports for the new
+    flows run, so that flows installed by an earlier run (e.g. with
+    the controller kept running) are not reused. The count is checked
+    against the port range by check_flowsetup_counts
+    """
+    base = random.randrange(FLOWSETUP_PORT_MIN, FLOWSETUP_PORT_MAX - count)
+    return {'same_flow_port': str(base), 'new_flows_port': str(base + 1)}
+
+def scaling_case(logger, basedir, ready, testbed, case, record):
+    """
+    Run a controller scaling benchmark from the test matrix, ramping
+    load step by step until nmeta saturates, and report the knee
+    point (maximum sustainable flow setup rate) of the policy
+    """
+    spec = case.spec
+    logger.info("running scaling test=%s", case.test)
+    record_inputs(record, spec)
+    duration = int(spec['extra_vars']['duration'])
+    ramp = scaling.Ramp([scaling.Step(**step) for step in spec['ramp']])
+
+    def run_step(step):
+        """
+        Run one step of the ramp and return its measurement
+        """
+        test_dir = make_test_dir(basedir, case)
+        with record.phase('mark_log'):
+            mark_log(logger, test_dir, testbed)
+        extra_vars = dict(spec['extra_vars'], results_dir=test_dir + "/",
+                                            policy_name=case.policy_name)
+        extra_vars.update(scaling.step_vars(step, duration))
+        logger.debug("running Ansible playbook...")
+        with record.phase('playbook'):
+            run_playbook(logger, testbed, spec['playbook'], extra_vars,
+                                                                record)
+        with record.phase('fetch_log'):
+            log_elapsed = fetch_log(logger, test_dir, testbed)
+        with record.phase('parse'):
+            measurement = scaling.read_step(test_dir, step, duration)
+        record.measure('offered_flow_rate', step.flow_rate)
+        record.measure('achieved_flow_rate', measurement.flow_rate)
+        record.measure('rtt_p99', measurement.rtt_p99)
+        record.measure('throughput', measurement.throughput)
+
+        #*** Check the logs written during the step while it moves on:
+        testbed.analyse("scaling test=" + case.test, record.checked,
+                        check_log, logger, test_dir, log_elapsed)
+
+        logger.debug("Waiting for environment to settle...")
+        with record.phase('settle'):
+            ready.wait("scaling test=" + case.test,
+                                testbed.settle_probes(), spec['settle'])
+        return measurement
+
+    knee = scaling.run_ramp(logger, ramp, run_step)
+    ramp.write_csv(os.path.join(basedir, case.suite, case.test,
+                                                    SCALING_FILENAME))
+    if knee:
+        logger.info("policy=%s knee flow_rate=%s rtt_p99=%s "
+                    "throughput=%.0f", case.policy_name,
+                    knee.step.flow_rate, knee.rtt_p99, knee.throughput)
+        record.measure('knee_flow_rate', knee.step.flow_rate)
+    else:
+        logger.warning("policy=%s no scaling step was sustained",
+                                                        case.policy_name)
+
+def mixed_case(logger, basedir, ready, testbed, case, record):
+    """
+    Run a mixed policy benchmark from the test matrix, with iperf
+    streams and hping3 from several hosts at once so that every
+    classifier of the policy is exercised together, sampling it
+    until the isolation verdict is statistically settled
+    """
+    spec = case.spec
+    logger.info("running mixed test=%s", case.test)
+    streams = mixed_streams(spec)
+    verdict = sampling.SequentialVerdict(matrix.thresholds(spec),
+                                                    spec['max_samples'])
+    record_inputs(record, spec)
+    record.thresholds = [str(threshold) for threshold in
+                                                    verdict.thresholds]
+    while not verdict.settled():
+        test_dir = make_test_dir(basedir, case)
+        with record.phase('mark_log'):
+            mark_log(logger, test_dir, testbed)
+        extra_vars = dict(spec['extra_vars'], results_dir=test_dir + "/",
+                                            policy_name=case.policy_name)
+        logger.debug("running Ansible playbook...")
+        with record.phase('playbook'):
+            run_playbook(logger, testbed, spec['playbook'], extra_vars,
+                                                                record)
+
+        #*** Retrieve the nmeta log lines written during the test:
+        with record.phase('fetch_log'):
+            log_elapsed = fetch_log(logger, test_dir, testbed)
+
+        #*** Read the bandwidth of each concurrent stream:
+        with record.phase('parse'):
+            results = get_iperf_results(logger, test_dir,
+                                sorted(spec['result_files'][stream]
+                                for stream in streams))
+        bandwidths = dict((stream, results[spec['result_files'][stream]])
+                                                    for stream in streams)
+        total = sum(bandwidths.values())
+        for stream, bandwidth in sorted(bandwidths.items()):
+            record.measure('bandwidth:' + stream, bandwidth)
+            if total:
+                record.measure('share:' + stream,
+                                            float(bandwidth) / total)
+        logger.info("sample %s bandwidth %s total=%s", verdict.count + 1,
+                    " ".join("%s=%s" % item for item in
+                    sorted(bandwidths.items())), total)
+        verdict.add(dict((expect['name'], bandwidths[expect['file']])
+                                            for expect in spec['expect']))
+
+        #*** Analyse latency, flow tables and logs while the testbed
+        #***  moves on:
+        testbed.analyse("mixed test=" + case.test, record.checked,
+                        analyse_mixed, logger, test_dir, spec,
+                        log_elapsed, record)
+
+        logger.debug("Waiting for environment to settle...")
+        with record.phase('settle'):
+            ready.wait("mixed test=" + case.test, testbed.settle_probes(),
+                                                        spec['settle'])
+
+    #*** Validate that the classes were isolated as expected:
+    logger.info("validating bw %s", verdict.describe())
+    assert verdict.passed(), verdict.describe()
+    logger.info("MIXED TC TEST PASSED. test=%s", case.test)
+
+def check_mixed_specs(specs):
+    """
+    Raise ValueError if a mixed policy benchmark has no isolation
+    expectations, which would pass it without checking anything, or
+    expects a result file that is not an iperf stream
+    """
+    for spec in specs:
+        if spec['runner'] != 'mixed':
+            continue
+        if not spec['expect']:
+            raise ValueError("suite=%s test=%s has no expectations of "
+                        "its classes" % (spec['suite'], spec['test']))
+        streams = mixed_streams(spec)
+        for expect in spec['expect']:
+            if expect['file'] not in streams:
+                raise ValueError("suite=%s test=%s expects %s, which is "
+                        "not an iperf stream" % (spec['suite'],
+                        spec['test'], expect['file']))
+
+def mixed_streams(spec):
+    """
+    Return the sorted result file keys of the iperf streams of a
+    mixed policy benchmark spec
+    """
+    return sorted(key for key in spec['result_files']
+                    if not key.endswith((MIXED_IDLE_SUFFIX,
+                                                MIXED_LOADED_SUFFIX)))
+
+def record_inputs(record, spec):
+    """
+    Record the inputs of a case from its test matrix spec
+    """
+    for key in ('playbook', 'extra_vars', 'repeats', 'max_samples',
+                                                'settle', 'qos_snapshot'):
+        record.inputs[key] = spec[key]
+
+#==================== result analysis ====================
+
+def analyse_iperf(logger, test_dir, spec, log_elapsed, record):
+    """
+    Analyse the flow table dumps and nmeta log lines of a sample of
+    an iperf test
+    """
+    for label, table in check_flows(logger, test_dir,
+                                        spec['qos_snapshot']).items():
+        record.measure('flows:' + label, len(table))
+
+    #*** Check the logs written during the test:
+    check_log(logger, test_dir, log_elapsed)
+
+def analyse_performance(logger, test_dir, spec, log_elapsed, record):
+    """
+    Analyse the results of a performance test
+    """
+    #*** Stream in and analyse hping3 RTT performance results:
+    rtt_stats = rtt.read_hping3(os.path.join(test_dir,
+                                        spec['result_files']['hping3']))
+    rtt_summary = rtt_stats.summary(sent=int(spec['extra_vars']['count']))
+    logger.debug("Performance results are %s", dict(rtt_summary))
+    logger.info("rtt_avg=%s rtt_max=%s", rtt_summary['mean'],
+                                                    rtt_summary['max'])
+    logger.info("rtt_p50=%s rtt_p90=%s rtt_p99=%s rtt_p99.9=%s "
+                "rtt_stddev=%s loss_rate=%s", rtt_summary['p50'],
+                rtt_summary['p90'], rtt_summary['p99'],
+                rtt_summary['p99.9'], rtt_summary['stddev'],
+                rtt_summary['loss_rate'])
+    for key, value in rtt_summary.items():
+        record.measure('rtt_' + key, value)
+    rtt_stats.write_histogram(os.path.join(test_dir,
+                                    PERFORMANCE_HISTOGRAM_FILENAME))
+
+    #*** Check the logs written during the test:
+    check_log(logger, test_dir, log_elapsed)
+
+def analyse_flowsetup(logger, test_dir, spec, policy_name, log_elapsed,
+                                                                record):
+    """
+    Analyse the results of a flow setup benchmark
+    """
+    #*** First probes of the same flow and every probe of new flows
+    #***  are set up through the controller, the rest are fast path:
+    first, fast_path = rtt.read_hping3_split(os.path.join(test_dir,
+                spec['result_files']['same_flow']), FLOWSETUP_FIRST_PROBES)
+    controller_path = rtt.read_hping3(os.path.join(test_dir,
+                                        spec['result_files']['new_flows']))
+    new_flows_loss = controller_path.loss_rate(
+                                        int(spec['extra_vars']['count']))
+    controller_path.merge(first)
+    for name, stats in (('controller_path', controller_path),
+                                            ('fast_path', fast_path)):
+        summary = stats.summary()
+        logger.info("%s count=%s rtt_avg=%s rtt_p50=%s rtt_p90=%s "
+                    "rtt_p99=%s rtt_max=%s", name, summary['count'],
+                    summary['mean'], summary['p50'], summary['p90'],
+                    summary['p99'], summary['max'])
+        for key, value in summary.items():
+            if key != 'loss_rate':
+                record.measure("%s_rtt_%s" % (name, key), value)
+    record.measure('new_flows_loss_rate', new_flows_loss)
+    if controller_path.count and fast_path.count:
+        logger.info("policy=%s flow setup overhead p50=%s new_flows "
+                    "loss_rate=%s", policy_name,
+                    controller_path.percentile(50) -
+                    fast_path.percentile(50), new_flows_loss)
+    controller_path.write_histogram(os.path.join(test_dir,
+                                    FLOWSETUP_CONTROLLER_HISTOGRAM))
+    fast_path.write_histogram(os.path.join(test_dir,
+                                    FLOWSETUP_FAST_HISTOGRAM))
+
+    #*** Check the logs written during the test:
+    check_log(logger, test_dir, log_elapsed)
+
+def analyse_mixed(logger, test_dir, spec, log_elapsed, record):
+    """
+    Analyse the latency of each host of a mixed policy benchmark
+    sample, idle and under the concurrent load, and its flow tables
+    and nmeta log lines
+    """
+    for key in sorted(spec['result_files']):
+        if not key.endswith(MIXED_LOADED_SUFFIX):
+            continue
+        host = key[:-len(MIXED_LOADED_SUFFIX)]
+        loaded = rtt.read_hping3(os.path.join(test_dir,
+                        spec['result_files'][key])).summary(
+                        sent=int(spec['extra_vars']['count']))
+        for name, value in loaded.items():
+            record.measure("rtt_%s:%s" % (name, host), value)
+        idle_key = host + MIXED_IDLE_SUFFIX
+        if idle_key not in spec['result_files']:
+            logger.info("host=%s loaded rtt_p50=%s rtt_p99=%s "
+                        "loss_rate=%s", host, loaded['p50'],
+                        loaded['p99'], loaded['loss_rate'])
+            continue
+        idle = rtt.read_hping3(os.path.join(test_dir,
+                        spec['result_files'][idle_key])).summary(
+                        sent=int(spec['extra_vars']['count']))
+        for name in ('p50', 'p99'):
+            record.measure("idle_rtt_%s:%s" % (name, host), idle[name])
+            #*** Interference is the loaded to idle latency ratio:
+            if idle[name] and loaded[name] is not None:
+                record.measure("rtt_interference_%s:%s" % (name, host),
+                                            loaded[name] / idle[name])
+        logger.info("host=%s idle rtt_p50=%s rtt_p99=%s loaded "
+                    "rtt_p50=%s rtt_p99=%s loss_rate=%s", host,
+                    idle['p50'], idle['p99'], loaded['p50'],
+                    loaded['p99'], loaded['loss_rate'])
+
+    for label, table in check_flows(logger, test_dir,
+                                        spec['qos_snapshot']).items():
+        record.measure('flows:' + label, len(table))
+
+    #*** Check the logs written during the test:
+    check_log(logger, test_dir, log_elapsed)
 
 #==================== helper functions ====================
 
-def get_iperf_bw(test_dir, filename):
+def get_iperf_results(logger, test_dir, filenames):
     """
-    Passed the directory and filename of an Iperf result
-    file and return the reported bandwidth or exit if error
+    Passed the directory and filenames of Iperf result files, log
+    the throughput time series analysis of each and return a
+    dictionary of filename to whole-test bandwidth
     """
-    filename_full = os.path.join(test_dir, filename)
-    with open(filename_full) as filehandle:
-        data = filehandle.read()
-        data = data.split(",")
-        #*** The result is position 8 and remove trailing newline:
-        return int(str(data[8]).rstrip())
+    results = {}
+    for filename in filenames:
+        iperf_result = iperf.read_iperf(os.path.join(test_dir, filename))
+        if iperf_result.bandwidth() is None:
+            logger.critical("no Iperf results in %s", filename)
+            sys.exit("Please check the test environment. Exiting...")
+        results[filename] = int(iperf_result.bandwidth())
+        logger.info("%s bandwidth=%s steady_state=%s ramp_time=%s "
+                    "intervals=%s", filename, results[filename],
+                    iperf_result.steady_state(), iperf_result.ramp_time(),
+                    len(iperf_result.aggregate().bps))
+    return results
 
-def build_playbook(playbook_name, extra_vars, logger):
+def check_flows(logger, test_dir, qos_snapshot=None):
+    """
+    Analyse the switch flow table dumps in a test result directory,
+    logging flows per table and the changes between snapshots, and
+    return the snapshots by label. Exits if a flow table is too big
+    or grew too much, or if the passed snapshot label does not have
+    a QoS (set_queue or meter) flow
+    """
+    snapshots = flows.read_snapshots(test_dir)
+    for label, table in snapshots.items():
+        logger.info("flows snapshot=%s total=%s per_table=%s qos=%s",
+                        label, len(table), dict(table.per_table()),
+                        len(table.qos_flows()))
+        if len(table) > FLOW_TABLE_MAX_FLOWS:
+            logger.critical("snapshot=%s has %s flows, more than %s",
+                            label, len(table), FLOW_TABLE_MAX_FLOWS)
+            sys.exit("Please check the switch flow table. Exiting...")
+    for before, after, delta in flows.snapshot_deltas(snapshots):
+        logger.info("flows %s->%s added=%s removed=%s n_packets=%s "
+                    "n_bytes=%s install_rate=%s", before, after,
+                    len(delta.added), len(delta.removed), delta.n_packets,
+                    delta.n_bytes, delta.install_rate())
+        if delta.growth > FLOW_TABLE_MAX_GROWTH:
+            logger.critical("flow table grew by %s flows from %s to %s, "
+                        "more than %s", delta.growth, before, after,
+                        FLOW_TABLE_MAX_GROWTH)
+            sys.exit("Please check the switch flow table. Exiting...")
+    if qos_snapshot is not None:
+        if qos_snapshot not in snapshots:
+            logger.critical("no %s flow table snapshot in %s",
+                                                qos_snapshot, test_dir)
+            sys.exit("Please check the test environment. Exiting...")
+        if not snapshots[qos_snapshot].qos_flows():
+            logger.critical("snapshot=%s has no QoS flow", qos_snapshot)
+            sys.exit("Please check the switch flow table. Exiting...")
+    return snapshots
+
+def make_test_dir(basedir, case):
+    """
+    Passed the results base directory and a test case, create
+    and return a new timestamped directory for the test results.
+    Safe against other testbeds creating the same directory
+    """
+    #*** Timestamp for specific test subdirectory:
+    timenow = datetime.datetime.now()
+    testdir_timestamp = timenow.strftime("%Y%m%d%H%M%S")
+    test_dir = os.path.join(basedir, case.suite, case.test,
+                                                    testdir_timestamp)
+    suffix = 0
+    while True:
+        try:
+            os.makedirs(test_dir)
+            return test_dir
+        except OSError:
+            if not os.path.isdir(test_dir):
+                raise
+        suffix += 1
+        test_dir = os.path.join(basedir, case.suite, case.test,
+                                "%s-%s" % (testdir_timestamp, suffix))
+
+def run_playbook(logger, testbed, playbook_name, extra_vars,
+                                                            record=None):
     """
     Passed an Ansible Playbook name, and a dictionary of extra
-    vars to pass to it, and return a properly formatted string that
-    will run the Playbook from the command line
+    vars to pass to it, run the Playbook on the testbed through its
+    execution backend and return the timed step result. Controller
+    profile measurements are added to the case record if passed
     """
     playbook = os.path.join(PLAYBOOK_DIR, playbook_name)
     logger.debug("playbook is %s", playbook)
-    playbook_cmd = "ansible-playbook " + playbook
-    if extra_vars:
-        playbook_cmd += " --extra-vars \""
-        for key, value in extra_vars.iteritems():
-            playbook_cmd += key + "=" + value + " "
-        playbook_cmd += "\""
-    logger.debug("playbook_cmd=%s", playbook_cmd)
-    return playbook_cmd
-
-def hping3_read_results(filename):
-    """
-    Passed a full path filename. Open this file and process
-    it line by line, accumulating valid RTT results into a
-    list and returning it
-    """
-    results = []
-    with open(filename, 'r') as filehandle:
-        for line in filehandle.readlines():
-            hping3_result = hping3_read_line(line)
-            if hping3_result:
-                results.append(hping3_result)
-    return results
-
-def hping3_read_line(hping3_line):
-    """
-    Passed a line from the hping3 output file and return the
-    result if it exists, otherwise 0.
-    """
-    #*** Extract hping3 time from the line:
-    #***  Example: len=46 ip=10.1.0.2 ttl=64 DF id=36185 sport=0
-    #***  flags=RA seq=6 win=0 rtt=9.1 ms
-    hping3_match = \
-                re.search(r"rtt=(\S+)", hping3_line)
-    if hping3_match:
-        result = hping3_match.groups()[0]
-        #*** Turn ms into seconds:
-        result = float(result) / 1000
-        return result
+    if BULK_FETCH and 'policy_name' in extra_vars:
+        #*** Test playbook, so leave results on the hosts to collect:
+        extra_vars = dict(extra_vars, bulk_fetch='true')
+    if testbed.controller and 'policy_name' in extra_vars:
+        #*** Test playbook, so reuse or restart the controller with
+        #***  the policy and have the playbook leave it alone:
+        testbed.controller.ensure(logger, extra_vars['policy_name'],
+                                                    extra_vars['pause1'])
+        extra_vars = dict(extra_vars, manage_controller='false')
+    if CONTROLLER_PROFILE and 'policy_name' in extra_vars:
+        #*** Test playbook, so profile the controller while it runs:
+        profile_vars = {'interval': str(CONTROLLER_PROFILE_INTERVAL),
+                    'profile_stacks': str(CONTROLLER_PROFILE_STACKS).lower(),
+                    'stack_rate': str(CONTROLLER_PROFILE_STACK_RATE),
+                    'results_dir': extra_vars['results_dir']}
+        testbed.run_playbook(logger, os.path.join(PLAYBOOK_DIR,
+                                PROFILE_START_PLAYBOOK), profile_vars)
+        step = testbed.run_playbook(logger, playbook, extra_vars)
+        testbed.run_playbook(logger, os.path.join(PLAYBOOK_DIR,
+                                PROFILE_STOP_PLAYBOOK), profile_vars)
+        testbed.analyse("controller profile", log_profile, logger,
+                                        extra_vars['results_dir'], record)
     else:
-        return 0
+        step = testbed.run_playbook(logger, playbook, extra_vars)
+    if extra_vars.get('bulk_fetch') == 'true':
+        collect_results(logger, testbed, extra_vars['results_dir'])
+    return step
 
-def rotate_log(logger):
+def collect_results(logger, testbed, results_dir):
     """
-    Run an Ansible playbook to rotate the nmeta log
-    so that it is fresh for analysis post test
+    Retrieve the results a test playbook left on the hosts of the
+    testbed, one bundle per host all at once, and unpack them
     """
-    logger.debug("Rotating nmeta syslog output for freshness")
-    extra_vars = {}
-    playbook_cmd = build_playbook(LOGROTATE_PLAYBOOK, extra_vars,
-                                                                logger)
-    logger.debug("running Ansible playbook...")
-    os.system(playbook_cmd)
+    with tracing.span('collect results'):
+        testbed.run_playbook(logger, os.path.join(PLAYBOOK_DIR,
+                        COLLECT_PLAYBOOK), {'results_dir': results_dir})
+        files = artifacts.extract_bundles(logger, results_dir)
+    logger.debug("collected %s result files into %s", files, results_dir)
+
+def log_profile(logger, test_dir, record=None):
+    """
+    Log a summary of the controller profile and stack samples
+    retrieved into a test result directory, and add it to the case
+    record if passed
+    """
+    profile_file = os.path.join(test_dir, PROFILE_FILENAME)
+    if not os.path.isfile(profile_file):
+        logger.warning("no controller profile in %s", test_dir)
+        return
+    summary = profiler.read_profile(profile_file).summary()
+    logger.info("controller samples=%s cpu_mean=%s cpu_max=%s "
+                "rss_max=%s rss_growth=%s threads_max=%s restarts=%s",
+                summary['samples'], summary['cpu_mean'],
+                summary['cpu_max'], summary['rss_max'],
+                summary['rss_growth'], summary['threads_max'],
+                summary['restarts'])
+    if record:
+        for key in ('cpu_mean', 'rss_max', 'threads_max'):
+            record.measure('controller_' + key, summary[key])
+    stacks_file = os.path.join(test_dir, PROFILE_STACKS_FILENAME)
+    if os.path.isfile(stacks_file):
+        for function, samples in profiler.read_stacks(stacks_file):
+            logger.info("controller hot function=%s samples=%s",
+                                                        function, samples)
+
+def mark_log(logger, test_dir, testbed):
+    """
+    Record the position of the nmeta log before a test, unless the
+    last check of the testbed's log already left it at the end, so
+    that only lines logged from then on are checked after the test
+    """
+    if testbed.log_position is None:
+        logger.debug("Marking nmeta syslog position")
+        testbed.log_position = tail_log(logger, test_dir, testbed,
+                                                                None)[0]
 
-def check_log(logger, test_dir):
+def tail_log(logger, test_dir, testbed, position):
     """
-    Check the nmeta log file to see if it has any log events that
-    should cause the test to fail so that code can be fixed
+    Run an Ansible playbook to retrieve the nmeta log lines written
+    since the passed position (just the current position if None)
+    into the test directory. Returns (position, start) of the end of
+    the log and the offset it was read from
     """
-    logger.debug("Checking nmeta syslog for error or critical messages")
     extra_vars = {'results_dir': test_dir + "/",
-                'error_filename': LOG_ERROR_FILENAME}
-    playbook_cmd = build_playbook(LOGCHECK_PLAYBOOK, extra_vars,
-                                                                logger)
+                'inode': str(position.inode if position else 0),
+                'offset': str(position.offset if position else 0),
+                'log_filename': NMETA_LOG_FILENAME,
+                'position_filename': NMETA_LOG_POSITION_FILENAME}
     logger.debug("running Ansible playbook...")
-    os.system(playbook_cmd)
-    #*** Presence of non-zero file indicates ERROR and/or CRITICAL logs:
-    error_file = os.path.join(test_dir, LOG_ERROR_FILENAME)
-    if os.path.isfile(error_file):
-        if os.stat(error_file).st_size > 0:
-            logger.critical("ERROR and/or CRITICAL logs need attention")
-            logger.info("Check file %s", error_file)
-            sys.exit()
+    run_playbook(logger, testbed, LOGTAIL_PLAYBOOK, extra_vars)
+    try:
+        return logwatch.read_position(os.path.join(test_dir,
+                                            NMETA_LOG_POSITION_FILENAME))
+    except (IOError, ValueError) as exception:
+        logger.critical("no nmeta log position in %s: %s", test_dir,
+                                                            exception)
+        sys.exit("Please check the test environment. Exiting...")
+
+def fetch_log(logger, test_dir, testbed):
+    """
+    Retrieve the nmeta log lines written since the position marked
+    before the test, and return the seconds they were logged over
+    """
+    marked = testbed.log_position
+    testbed.log_position, start = tail_log(logger, test_dir, testbed,
+                                                                marked)
+    if marked and start != marked.offset:
+        logger.warning("nmeta log was rotated or truncated, checking "
+                                                    "it from the start")
+    return testbed.log_position.time - marked.time if marked else 0
+
+def check_log(logger, test_dir, elapsed):
+    """
+    Check the nmeta log lines retrieved into a test directory, logged
+    over elapsed seconds, against the log rules, to fail tests that
+    log events that should cause the code to be fixed
+    """
+    logger.debug("Checking new nmeta syslog lines against log rules")
+    with tracing.span('check_log', 'analysis'):
+        report = logwatch.RuleSet(logwatch.RULES).scan_file(os.path.join(
+                                            test_dir, NMETA_LOG_FILENAME))
+    logger.info("log lines=%s %s", report.lines, " ".join("%s=%s" % item
+                                        for item in report.counts.items()))
+    violations = report.violations(elapsed)
+    if violations:
+        error_file = os.path.join(test_dir, LOG_ERROR_FILENAME)
+        with open(error_file, 'wb') as filehandle:
+            for rule, count, per_minute in violations:
+                if rule.max_per_minute:
+                    logger.critical("log rule=%s matched %s lines, %.1f "
+                            "per minute, allowed %s", rule.name, count,
+                            per_minute, rule.max_per_minute)
+                else:
+                    logger.critical("log rule=%s matched %s lines",
+                                                        rule.name, count)
+                for line in report.examples[rule.name]:
+                    filehandle.write(line + b"\n")
+        logger.info("Check file %s", error_file)
+        sys.exit("Please check the nmeta log. Exiting...")
 
 if __name__ == "__main__":
     #*** Run the main function
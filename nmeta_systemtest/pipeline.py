@@ -0,0 +1,101 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Background analysis of nmeta system test results.
+
+Once a test's result files have been retrieved, parsing them,
+analysing flow table dumps and checking the nmeta log only needs
+the local files, so it is handed to a pipeline thread while the
+testbed moves on to settling and setting up the next test.
+
+Jobs run in the order they were submitted. The first job to fail
+(an AssertionError, a sys.exit() or any other exception) sets the
+run's abort event so that the testbeds stop at their next
+playbook, keeping the fail as soon as there is an issue
+behaviour, and is re-raised when the pipeline is closed.
+"""
+
+import threading
+import time
+
+import tracing
+
+try:
+    import queue
+except ImportError:
+    #*** Python 2:
+    import Queue as queue
+
+class Pipeline(object):
+    """
+    Thread that runs analysis jobs in submission order. Passed the
+    threading.Event that aborts the run
+    """
+    def __init__(self, logger, name, abort):
+        self.logger = logger
+        self.name = name
+        self.abort = abort
+        #*** First exception raised by a job, if any:
+        self.failure = None
+        #*** Jobs run and seconds spent running them:
+        self.jobs = 0
+        self.seconds = 0.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run,
+                                        name="analysis-" + name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, label, func, *args):
+        """
+        Queue func(*args) to run in the background
+        """
+        self._queue.put((label, func, args))
+
+    def _run(self):
+        """
+        Run queued jobs until closed. Jobs queued after a failure
+        are dropped
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            label, func, args = item
+            if self.abort.is_set():
+                self.logger.debug("analysis=%s dropped %s, run aborted",
+                                                        self.name, label)
+                continue
+            self.logger.info("analysing results of %s", label)
+            start = time.time()
+            try:
+                with tracing.span(label, 'analysis'):
+                    func(*args)
+            except BaseException as exception:
+                #*** Includes AssertionError and sys.exit() from jobs:
+                self.logger.critical("analysis=%s failed %s, aborting "
+                                "run", self.name, label, exc_info=True)
+                self.failure = exception
+                self.abort.set()
+            self.jobs += 1
+            self.seconds += time.time() - start
+
+    def close(self):
+        """
+        Wait for queued jobs to finish and stop the thread
+        """
+        self._queue.put(None)
+        #*** Join with a timeout so Ctrl-C still interrupts:
+        while self._thread.is_alive():
+            self._thread.join(1)
@@ -0,0 +1,260 @@
+#!/usr/bin/python
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Controller resource profiling for the nmeta system tests.
+
+Run on the controller (copied there by the profile-start playbook)
+this samples the CPU time, resident memory (RSS) and thread count
+of the nmeta process from /proc at a fixed interval until it is
+sent SIGTERM, then writes the samples in a compact columnar binary
+file. If nmeta restarts while sampling, the new process is found
+and sampled.
+
+Back on the test host, the same module reads a profile and
+summarises it per test (mean and peak CPU, peak and growth of RSS,
+peak threads), and summarises py-spy raw stack samples if they
+were taken.
+
+Usage on the controller:
+    profiler.py [--pattern nmeta.py] [--interval 0.5] --output FILE
+"""
+
+import argparse
+import array
+import collections
+import json
+import os
+import signal
+import sys
+import time
+
+#*** Columnar profile file format: magic line, JSON header line,
+#***  then each column as little endian doubles:
+MAGIC = b"NMPROF1\n"
+COLUMNS = ('time', 'pid', 'cpu_seconds', 'rss_bytes', 'threads')
+
+#*** Default process to sample and interval between samples (s):
+PATTERN = 'nmeta.py'
+INTERVAL = 0.5
+
+#*** Number of hottest functions to report from stack samples:
+TOP_FUNCTIONS = 10
+
+class Profile(object):
+    """
+    Columns of controller process samples
+    """
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self.columns = collections.OrderedDict(
+                        (name, array.array('d')) for name in COLUMNS)
+
+    def __len__(self):
+        return len(self.columns['time'])
+
+    def add(self, sample):
+        """
+        Add a sample, a dictionary of column name to value
+        """
+        for name, column in self.columns.items():
+            column.append(sample[name])
+
+    def write(self, filename):
+        """
+        Write the profile to a file, atomically so that a reader
+        never sees a partial file
+        """
+        header = {'columns': list(self.columns), 'count': len(self),
+                                                'interval': self.interval}
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'wb') as filehandle:
+            filehandle.write(MAGIC)
+            filehandle.write(json.dumps(header).encode('ascii') + b"\n")
+            for column in self.columns.values():
+                if sys.byteorder == 'big':
+                    column = array.array('d', column)
+                    column.byteswap()
+                filehandle.write(column.tostring() if
+                            sys.version_info[0] < 3 else column.tobytes())
+        os.rename(temp_filename, filename)
+
+    def summary(self):
+        """
+        Return an ordered dictionary of summary statistics. CPU is
+        in percent of one core and only measured between consecutive
+        samples of the same process
+        """
+        times = self.columns['time']
+        pids = self.columns['pid']
+        cpu = self.columns['cpu_seconds']
+        rss = [value for value in self.columns['rss_bytes'] if value]
+        summary = collections.OrderedDict()
+        summary['samples'] = len(self)
+        summary['duration'] = times[-1] - times[0] if len(self) else 0.0
+        cpu_percents = []
+        cpu_used = 0.0
+        cpu_elapsed = 0.0
+        for index in range(1, len(self)):
+            elapsed = times[index] - times[index - 1]
+            if pids[index] != pids[index - 1] or not pids[index] or \
+                                                            elapsed <= 0:
+                continue
+            used = cpu[index] - cpu[index - 1]
+            cpu_percents.append(100.0 * used / elapsed)
+            cpu_used += used
+            cpu_elapsed += elapsed
+        summary['cpu_mean'] = 100.0 * cpu_used / cpu_elapsed \
+                                                if cpu_elapsed else None
+        summary['cpu_max'] = max(cpu_percents) if cpu_percents else None
+        summary['rss_mean'] = sum(rss) / len(rss) if rss else None
+        summary['rss_max'] = max(rss) if rss else None
+        summary['rss_growth'] = rss[-1] - rss[0] if rss else None
+        threads = self.columns['threads']
+        summary['threads_max'] = max(threads) if len(threads) else None
+        summary['restarts'] = len(set(pid for pid in pids if pid)) - 1 \
+                                                    if any(pids) else 0
+        return summary
+
+def read_profile(filename):
+    """
+    Passed a full path filename of a profile file, return a Profile
+    """
+    with open(filename, 'rb') as filehandle:
+        if filehandle.readline() != MAGIC:
+            raise ValueError("%s is not a profile file" % filename)
+        header = json.loads(filehandle.readline().decode('ascii'))
+        profile = Profile(header['interval'])
+        profile.columns = collections.OrderedDict()
+        for name in header['columns']:
+            column = array.array('d')
+            data = filehandle.read(column.itemsize * header['count'])
+            if sys.version_info[0] < 3:
+                column.fromstring(data)
+            else:
+                column.frombytes(data)
+            if sys.byteorder == 'big':
+                column.byteswap()
+            profile.columns[name] = column
+    return profile
+
+def read_stacks(filename, top=TOP_FUNCTIONS):
+    """
+    Passed a py-spy raw (collapsed stacks) file, return a list of
+    (function, samples) of the functions most often on top of the
+    stack
+    """
+    functions = collections.Counter()
+    with open(filename) as filehandle:
+        for line in filehandle:
+            stack, _, count = line.rstrip().rpartition(" ")
+            if not stack or not count.isdigit():
+                continue
+            functions[stack.rsplit(";", 1)[-1]] += int(count)
+    return functions.most_common(top)
+
+#==================== sampling on the controller ====================
+
+def find_pid(pattern, page_size):
+    """
+    Return the pid of the process whose command line contains the
+    pattern, other than this process, or None. If several match
+    (e.g. a shell that launched it) the one with the largest RSS is
+    taken
+    """
+    best_pid, best_rss = None, -1
+    for name in os.listdir('/proc'):
+        if not name.isdigit() or int(name) == os.getpid():
+            continue
+        try:
+            with open('/proc/%s/cmdline' % name, 'rb') as filehandle:
+                cmdline = filehandle.read().replace(b"\0", b" ")
+        except IOError:
+            continue
+        if pattern.encode('ascii') not in cmdline:
+            continue
+        values = sample_process(int(name), 1, page_size)
+        if values and values[1] > best_rss:
+            best_pid, best_rss = int(name), values[1]
+    return best_pid
+
+def sample_process(pid, clock_ticks, page_size):
+    """
+    Return (cpu_seconds, rss_bytes, threads) of a process from /proc,
+    or None if it no longer exists
+    """
+    try:
+        with open('/proc/%s/stat' % pid) as filehandle:
+            stat = filehandle.read()
+    except IOError:
+        return None
+    #*** Fields after the command name, which may contain spaces:
+    fields = stat.rpartition(")")[2].split()
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / float(clock_ticks)
+    threads = int(fields[17])
+    rss_bytes = int(fields[21]) * page_size
+    return cpu_seconds, rss_bytes, threads
+
+def sample(pattern, interval, filename):
+    """
+    Sample the process matching the pattern every interval seconds
+    until SIGTERM or SIGINT, then write the profile to the file
+    """
+    stopping = []
+    handler = lambda signum, frame: stopping.append(signum)
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
+    clock_ticks = os.sysconf('SC_CLK_TCK')
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    profile = Profile(interval)
+    pid = None
+    next_sample = time.time()
+    while not stopping:
+        values = sample_process(pid, clock_ticks, page_size) if pid \
+                                                                else None
+        if values is None:
+            #*** Controller not running yet, or restarted:
+            pid = find_pid(pattern, page_size)
+            values = sample_process(pid, clock_ticks, page_size) if pid \
+                                                                else None
+        if values is None:
+            pid = None
+            values = (0.0, 0, 0)
+        profile.add({'time': time.time(), 'pid': pid or 0,
+                        'cpu_seconds': values[0], 'rss_bytes': values[1],
+                        'threads': values[2]})
+        #*** Sample on a fixed schedule rather than drifting:
+        next_sample += interval
+        delay = next_sample - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            next_sample = time.time()
+    profile.write(filename)
+
+def main():
+    """
+    Command line interface to sample the controller process
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--pattern', default=PATTERN)
+    parser.add_argument('--interval', type=float, default=INTERVAL)
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args()
+    sample(args.pattern, args.interval, args.output)
+
+if __name__ == "__main__":
+    #*** Run the main function
+    main()
@@ -0,0 +1,204 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Adaptive readiness polling for nmeta system tests.
+
+Replaces blind fixed waits with probes of the test environment
+that are polled with exponential backoff until they all pass or
+the old fixed wait expires, whichever comes first. Records how
+much wall-clock time was saved compared to the fixed waits.
+
+Probes are plain objects with a name and a check() method, so
+they can be swapped for CallableProbe instances to exercise the
+polling logic without a test network.
+"""
+
+import os
+import subprocess
+import threading
+import time
+
+import runner
+import tracing
+
+#*** Polling backoff parameters (seconds):
+POLL_INITIAL = 0.5
+POLL_MAX = 5
+POLL_BACKOFF = 2
+
+#*** nmeta syslog file on the controller:
+NMETA_LOG = '/var/log/nmeta'
+#*** Seconds without a write to the nmeta log for it to be quiet:
+LOG_QUIET_SECONDS = 3
+
+class Probe(object):
+    """
+    Base class for a readiness probe. Subclasses override check()
+    to return True when the condition they test for is met
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def check(self):
+        """
+        Return True if ready, otherwise False
+        """
+        raise NotImplementedError
+
+class CallableProbe(Probe):
+    """
+    Probe that calls a passed function to determine readiness.
+    Used to mock the environment when testing locally
+    """
+    def __init__(self, name, func):
+        super(CallableProbe, self).__init__(name)
+        self.func = func
+
+    def check(self):
+        return bool(self.func())
+
+class CommandProbe(Probe):
+    """
+    Probe that runs a shell command on an Ansible host pattern
+    as an ad-hoc task. Ready when the command exits zero on all
+    matched hosts
+    """
+    def __init__(self, name, hosts, command, inventory=None):
+        super(CommandProbe, self).__init__(name)
+        self.hosts = hosts
+        self.command = command
+        self.inventory = inventory
+
+    def argv(self):
+        """
+        Return the ansible ad-hoc argument list for this probe
+        """
+        argv = ['ansible', self.hosts, '-m', 'shell', '-a', self.command]
+        if self.inventory:
+            argv += ['-i', self.inventory]
+        return argv
+
+    def check(self):
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(self.argv(), stdout=devnull,
+                            stderr=devnull, env=runner.ansible_env()) == 0
+
+def controller_stopped_probe(inventory=None):
+    """
+    Ready when no ryu-manager process is running on the controller
+    """
+    return CommandProbe('controller-stopped', 'controllers',
+                "! pgrep -f ryu-manager", inventory)
+
+def log_quiet_probe(inventory=None, quiet_seconds=LOG_QUIET_SECONDS):
+    """
+    Ready when the nmeta log has not been written to recently
+    """
+    return CommandProbe('log-quiet', 'controllers',
+                "test $(( $(date +%%s) - $(stat -c %%Y %s) )) -ge %s"
+                % (NMETA_LOG, quiet_seconds), inventory)
+
+def settle_probes(inventory=None, controller_reused=False):
+    """
+    Return the probes that indicate the environment has settled
+    after a test and the next test can start. When the controller
+    is kept running between tests it is not expected to stop
+    """
+    if controller_reused:
+        return [log_quiet_probe(inventory)]
+    return [controller_stopped_probe(inventory),
+            log_quiet_probe(inventory)]
+
+class Readiness(object):
+    """
+    Polls probes with backoff and keeps a ledger of time spent
+    waiting versus the fixed waits that the polling replaced.
+
+    Clock and sleep functions may be passed in so that the polling
+    can be tested without real time passing
+    """
+    def __init__(self, logger, initial=POLL_INITIAL, maximum=POLL_MAX,
+                    backoff=POLL_BACKOFF, clock=time.time,
+                    sleep=time.sleep):
+        self.logger = logger
+        self.initial = initial
+        self.maximum = maximum
+        self.backoff = backoff
+        self.clock = clock
+        self.sleep = sleep
+        #*** Ledger of (label, fixed, waited, ready) tuples:
+        self.waits = []
+        self._lock = threading.Lock()
+
+    def wait(self, label, probes, timeout):
+        """
+        Poll the probes until all pass or timeout seconds elapse.
+        The timeout is the fixed wait being replaced so a run is
+        never slower than before. Returns True if ready
+        """
+        with tracing.span(label, 'wait', timeout=timeout):
+            return self._wait(label, probes, timeout)
+
+    def _wait(self, label, probes, timeout):
+        """
+        Poll the probes, logging and recording the wait
+        """
+        start = self.clock()
+        delay = self.initial
+        pending = list(probes)
+        while True:
+            pending = [probe for probe in pending if not probe.check()]
+            elapsed = self.clock() - start
+            if not pending:
+                ready = True
+                break
+            if elapsed >= timeout:
+                ready = False
+                break
+            self.sleep(min(delay, timeout - elapsed))
+            delay = min(delay * self.backoff, self.maximum)
+        waited = self.clock() - start
+        if ready:
+            self.logger.debug("%s ready after %.1fs (fixed wait %ss)",
+                                                label, waited, timeout)
+        else:
+            self.logger.warning("%s not ready after %ss, waiting on %s",
+                        label, timeout,
+                        ", ".join(probe.name for probe in pending))
+        with self._lock:
+            self.waits.append((label, timeout, waited, ready))
+        return ready
+
+    def saved(self):
+        """
+        Return total seconds saved versus the fixed waits
+        """
+        with self._lock:
+            return sum(fixed - waited for _, fixed, waited, _ in
+                                                            self.waits)
+
+    def write_summary(self, filename):
+        """
+        Write the ledger of waits to a CSV file and log the total
+        time saved
+        """
+        with self._lock:
+            waits = list(self.waits)
+        with open(filename, 'w') as filehandle:
+            filehandle.write("label,fixed,waited,ready\n")
+            for label, fixed, waited, ready in waits:
+                filehandle.write("%s,%s,%.3f,%s\n" % (label, fixed,
+                                                        waited, ready))
+        self.logger.info("readiness polling saved %.1fs over %s waits",
+                                            self.saved(), len(waits))
@@ -0,0 +1,207 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Offline replay of a recorded nmeta system test run.
+
+A Replayer is the responder of a scheduler.FakeTestbed. In place
+of each test playbook it copies the result files (iperf CSVs,
+hping3 output, flow table dumps, controller profiles, ...) that
+the same suite and test wrote in a recorded run's results
+directory, sample by sample, and in place of the log tail playbook
+it serves the nmeta log lines the recorded test retrieved. So the
+whole harness, scheduling and analysis included, runs end to end
+without the lab, in seconds.
+
+Playbook durations are synthetic: the mean recorded duration of
+each playbook (from the recorded run's playbook steps) scaled by a
+time scale, zero by default so that nothing waits.
+
+A benchmark of the harness's own overhead per case is written
+from the manifest of a replayed run: with no time spent in
+playbooks or waits, the time a case takes is all harness.
+"""
+
+import collections
+import itertools
+import os
+import re
+import shutil
+import threading
+import time
+
+#*** Names of timestamped sample directories made per test sample:
+SAMPLE_DIR_RE = re.compile(r"^\d{14}(-\d+)?$")
+
+#*** Playbook that tails the nmeta log, served from recorded logs:
+LOGTAIL_PLAYBOOK = 'nmeta-full-regression-logtail-template.yml'
+
+#*** Playbook step times of a run, written by runner.write_steps:
+PLAYBOOK_STEPS_FILENAME = 'playbook_steps.csv'
+
+#*** Inode of the replayed nmeta log:
+REPLAY_INODE = 1
+
+class Replayer(object):
+    """
+    Serves the results of a recorded run to the playbooks of a
+    FakeTestbed. Passed the recorded run's results directory and a
+    time scale for the recorded playbook durations
+    """
+    def __init__(self, logger, recorded_dir, time_scale=0.0):
+        self.logger = logger
+        self.recorded_dir = recorded_dir
+        self.time_scale = time_scale
+        self.seconds = recorded_seconds(os.path.join(recorded_dir,
+                                                PLAYBOOK_STEPS_FILENAME))
+        #*** Cycle of recorded sample directories of each test, and
+        #***  the recorded directory each results directory replays:
+        self._samples = {}
+        self._sources = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, playbook, extra_vars):
+        """
+        Replay a playbook, writing any recorded results it retrieves
+        into its results directory
+        """
+        name = os.path.basename(playbook)
+        if self.time_scale:
+            time.sleep(self.seconds.get(name, 0.0) * self.time_scale)
+        if 'results_dir' not in extra_vars:
+            return
+        #*** As Ansible fetch does, create the results directory:
+        try:
+            os.makedirs(extra_vars['results_dir'])
+        except OSError:
+            if not os.path.isdir(extra_vars['results_dir']):
+                raise
+        if name == LOGTAIL_PLAYBOOK:
+            self.replay_log(extra_vars)
+        elif 'policy_name' in extra_vars:
+            source = self.source(extra_vars['results_dir'])
+            if source is None:
+                return
+            for filename in os.listdir(source):
+                path = os.path.join(source, filename)
+                if os.path.isfile(path):
+                    shutil.copy(path, extra_vars['results_dir'])
+
+    def source(self, results_dir):
+        """
+        Return the recorded directory that a results directory
+        replays, the next recorded sample of the test for a new
+        sample directory, or None if the test was not recorded
+        """
+        results_dir = os.path.normpath(results_dir)
+        with self._lock:
+            if results_dir in self._sources:
+                return self._sources[results_dir]
+            parts = results_dir.split(os.sep)
+            if SAMPLE_DIR_RE.match(parts[-1]):
+                test_dir = os.path.join(self.recorded_dir, parts[-3],
+                                                                parts[-2])
+                if test_dir not in self._samples:
+                    samples = sorted(name for name in os.listdir(test_dir)
+                                    if SAMPLE_DIR_RE.match(name)) \
+                                    if os.path.isdir(test_dir) else []
+                    #*** Runs recorded before performance and flow setup
+                    #***  tests had a directory per run keep their
+                    #***  results in the test directory:
+                    if not samples and os.path.isdir(test_dir):
+                        samples = ['']
+                    self._samples[test_dir] = itertools.cycle(samples) \
+                                                        if samples else None
+                cycle = self._samples[test_dir]
+                source = os.path.join(test_dir, next(cycle)) \
+                                                        if cycle else None
+            else:
+                source = os.path.join(self.recorded_dir, parts[-2],
+                                                                parts[-1])
+                if not os.path.isdir(source):
+                    source = None
+            if source is None:
+                self.logger.warning("no recorded results to replay for %s",
+                                                            results_dir)
+            self._sources[results_dir] = source
+            return source
+
+    def replay_log(self, extra_vars):
+        """
+        Write the position of the replayed nmeta log as the log tail
+        playbook does, serving the recorded log lines of the test
+        unless only marking the position
+        """
+        results_dir = extra_vars['results_dir']
+        offset = int(extra_vars['offset'])
+        data = b""
+        if extra_vars['inode'] != '0':
+            source = self.source(results_dir)
+            log_file = os.path.join(source or "",
+                                        extra_vars['log_filename'])
+            if source and os.path.isfile(log_file):
+                with open(log_file, 'rb') as filehandle:
+                    data = filehandle.read()
+            with open(os.path.join(results_dir,
+                            extra_vars['log_filename']), 'wb') as filehandle:
+                filehandle.write(data)
+        with open(os.path.join(results_dir,
+                        extra_vars['position_filename']), 'w') as filehandle:
+            filehandle.write("%s %s %s\n" % (REPLAY_INODE,
+                                            offset + len(data), offset))
+
+def recorded_seconds(filename):
+    """
+    Passed a full path filename of the playbook steps of a run,
+    return a dictionary of the mean seconds of each playbook
+    """
+    totals = collections.defaultdict(list)
+    if os.path.isfile(filename):
+        with open(filename) as filehandle:
+            next(filehandle, None)
+            for line in filehandle:
+                fields = line.strip().split(',')
+                if len(fields) == 3:
+                    totals[fields[0]].append(float(fields[2]))
+    return dict((name, sum(seconds) / len(seconds))
+                                    for name, seconds in totals.items())
+
+def write_benchmark(logger, entries, filename):
+    """
+    Passed the manifest entries of a replayed run, write the harness
+    time of each case and its phases to a CSV file and log the mean
+    """
+    phases = []
+    for entry in entries:
+        for phase in entry.get('phases') or {}:
+            if phase not in phases:
+                phases.append(phase)
+    with open(filename, 'w') as filehandle:
+        filehandle.write(",".join(['suite', 'test', 'iteration', 'verdict',
+                                            'seconds'] + phases) + "\n")
+        for entry in entries:
+            filehandle.write(",".join(str(value) for value in
+                        [entry['suite'], entry['test'], entry['iteration'],
+                        entry['verdict'], entry['seconds']] +
+                        [(entry.get('phases') or {}).get(phase, 0)
+                                                for phase in phases]) + "\n")
+    if not entries:
+        return
+    total = sum(entry['seconds'] for entry in entries)
+    logger.info("benchmark cases=%s harness=%.2fs mean=%.3fs per case",
+                                len(entries), total, total / len(entries))
+    for phase in phases:
+        seconds = sum((entry.get('phases') or {}).get(phase, 0)
+                                                    for entry in entries)
+        logger.info("benchmark phase=%s total=%.2fs mean=%.3fs per case",
+                                    phase, seconds, seconds / len(entries))
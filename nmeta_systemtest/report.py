@@ -0,0 +1,311 @@
+#!/usr/bin/python
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Trend report over many nmeta system test runs.
+
+Scans a results root of timestamped run directories in one pass,
+parsing the measurements of each run in a process pool. Parsed
+runs are summarised (mean of each measurement per suite, test and
+policy) and cached in a JSON file in the results root, keyed by
+run and invalidated when the number of files or the latest file
+mtime of the run changes, so after a new run only that run is
+parsed. Runs packed into archives keep their cached summary.
+
+Writes a CSV of every summarised measurement and a self-contained
+HTML report (inline SVG, no external assets) with trends of
+throughput and RTT percentiles per suite, test and policy, and the
+change of each from the previous run.
+
+Usage:
+    report.py [--root RESULTS_ROOT] [--output DIR] [--processes N]
+"""
+
+import argparse
+import collections
+import json
+import logging
+import multiprocessing
+import os
+import re
+
+import artifacts
+import resultsdb
+
+#*** Cache of parsed runs, in the results root:
+CACHE_FILENAME = '.report_cache.json'
+#*** Report files, in the output directory:
+CSV_FILENAME = 'trends.csv'
+HTML_FILENAME = 'trends.html'
+REPORT_DIR = 'report'
+
+#*** Measurements shown as trends in the HTML report:
+TREND_METRICS_RE = re.compile(r"^(bandwidth|steady_bandwidth|"
+                    r"(controller_path_|fast_path_)?rtt_p(50|99)|"
+                    r"knee_flow_rate|controller_cpu_mean|"
+                    r"controller_rss_max)(:|$)")
+
+#*** Sparkline size in pixels:
+SPARK_WIDTH = 240
+SPARK_HEIGHT = 40
+
+def run_signature(basedir):
+    """
+    Return [files, latest mtime] of a run directory, which changes
+    when result files are added or rewritten
+    """
+    files = 0
+    latest = 0.0
+    for dirpath, dirnames, filenames in os.walk(basedir):
+        dirnames[:] = [name for name in dirnames
+                                            if not name.startswith('.')]
+        for filename in filenames:
+            files += 1
+            latest = max(latest, os.path.getmtime(os.path.join(dirpath,
+                                                                filename)))
+    return [files, latest]
+
+def parse_run(basedir):
+    """
+    Passed a run base directory, return (basedir, summary, error)
+    where summary is a dictionary of the run metadata and rows of
+    [suite, test, policy, metric, mean, samples]. Runs in a worker
+    process, so errors are returned rather than raised
+    """
+    try:
+        signature = run_signature(basedir)
+        run_id, started, commit, branch = resultsdb.run_metadata(basedir)
+        values = collections.OrderedDict()
+        for suite, test, policy, _, metric, value in \
+                                    resultsdb.run_measurements(basedir):
+            if value is not None:
+                values.setdefault((suite, test, policy, metric),
+                                                    []).append(value)
+    except Exception as exception:
+        return basedir, None, "%s: %s" % (type(exception).__name__,
+                                                            exception)
+    rows = [list(key) + [sum(samples) / float(len(samples)), len(samples)]
+                                        for key, samples in values.items()]
+    return basedir, {'run_id': run_id, 'started': started,
+                    'commit': commit, 'branch': branch,
+                    'signature': signature, 'rows': rows}, None
+
+def read_cache(filename):
+    """
+    Return the cached run summaries, by run id
+    """
+    if not os.path.isfile(filename):
+        return {}
+    try:
+        with open(filename) as filehandle:
+            return json.load(filehandle)
+    except ValueError:
+        return {}
+
+def write_cache(filename, cache):
+    """
+    Write the cached run summaries atomically
+    """
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'w') as filehandle:
+        json.dump(cache, filehandle)
+    os.rename(temp_filename, filename)
+
+def scan_runs(logger, root, processes=None):
+    """
+    Return summaries of every run under a results root, sorted by
+    start time, parsing only runs that are new or changed since they
+    were cached
+    """
+    cache_file = os.path.join(root, CACHE_FILENAME)
+    cache = read_cache(cache_file)
+    runs = {}
+    stale = []
+    for name in sorted(os.listdir(root)):
+        basedir = os.path.join(root, name)
+        packed = name[:-len(artifacts.ARCHIVE_SUFFIX)]
+        if name.endswith(artifacts.ARCHIVE_SUFFIX) and packed in cache:
+            #*** Packed runs do not change, so keep their summary:
+            runs[packed] = cache[packed]
+            continue
+        if not resultsdb.RUN_DIR_RE.match(name) or \
+                                            not os.path.isdir(basedir):
+            continue
+        cached = cache.get(name)
+        if cached and cached['signature'] == run_signature(basedir):
+            runs[name] = cached
+        else:
+            stale.append(basedir)
+    logger.info("runs=%s cached=%s parsing=%s", len(runs) + len(stale),
+                                                    len(runs), len(stale))
+    if processes == 1 or len(stale) < 2:
+        results = (parse_run(basedir) for basedir in stale)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(parse_run, stale)
+    try:
+        for basedir, summary, error in results:
+            if error:
+                logger.warning("skipping run %s: %s", basedir, error)
+                continue
+            runs[summary['run_id']] = summary
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    write_cache(cache_file, runs)
+    return sorted(runs.values(), key=lambda run: run['started'])
+
+def trends(runs):
+    """
+    Return an ordered dictionary of (suite, test, policy) to an
+    ordered dictionary of metric to [(run, value)] in run order
+    """
+    result = collections.OrderedDict()
+    for run in runs:
+        for suite, test, policy, metric, value, _ in run['rows']:
+            result.setdefault((suite, test, policy),
+                        collections.OrderedDict()).setdefault(metric,
+                        []).append((run, value))
+    return collections.OrderedDict(sorted(result.items(),
+                                    key=lambda item: [str(part)
+                                                    for part in item[0]]))
+
+def change(series):
+    """
+    Return (latest, previous, relative change) of a metric series,
+    with previous and change None if there is only one value
+    """
+    latest = series[-1][1]
+    if len(series) < 2:
+        return latest, None, None
+    previous = series[-2][1]
+    return latest, previous, (latest - previous) / previous \
+                                                    if previous else None
+
+def write_csv(runs, filename):
+    """
+    Write every summarised measurement of the runs to a CSV file
+    """
+    with open(filename, 'w') as filehandle:
+        filehandle.write("run_id,started,commit,branch,suite,test,"
+                            "policy,metric,value,samples\n")
+        for run in runs:
+            for suite, test, policy, metric, value, samples in run['rows']:
+                filehandle.write("%s,%s,%s,%s,%s,%s,%s,%s,%r,%s\n" % (
+                            run['run_id'], run['started'],
+                            run['commit'] or "", run['branch'] or "",
+                            suite, test, policy or "", metric, value,
+                            samples))
+
+def escape(text):
+    """
+    Return text escaped for HTML
+    """
+    return str(text).replace("&", "&amp;").replace("<", "&lt;").replace(
+                                ">", "&gt;").replace('"', "&quot;")
+
+def sparkline(series):
+    """
+    Return an inline SVG line of a metric series
+    """
+    values = [value for _, value in series]
+    low, high = min(values), max(values)
+    span = (high - low) or 1.0
+    step = float(SPARK_WIDTH - 4) / max(1, len(values) - 1)
+    points = [(2 + index * step, SPARK_HEIGHT - 2 - (value - low) / span *
+                (SPARK_HEIGHT - 4)) for index, value in enumerate(values)]
+    return ('<svg width="%s" height="%s"><title>%s to %s</title>'
+            '<polyline fill="none" stroke="#36c" points="%s"/>'
+            '<circle cx="%.1f" cy="%.1f" r="2" fill="#c33"/></svg>' % (
+            SPARK_WIDTH, SPARK_HEIGHT, escape("%.6g" % low),
+            escape("%.6g" % high), " ".join("%.1f,%.1f" % point
+            for point in points), points[-1][0], points[-1][1]))
+
+def write_html(runs, filename, tolerance=resultsdb.TOLERANCE):
+    """
+    Write a self-contained HTML report of the metric trends of the
+    runs, flagging changes from the previous run beyond tolerance
+    """
+    lines = ["<!DOCTYPE html>", "<html><head><meta charset=\"utf-8\">",
+            "<title>nmeta system test trends</title>",
+            "<style>body{font-family:sans-serif}table{border-collapse:"
+            "collapse}td,th{border:1px solid #ccc;padding:2px 6px}"
+            ".moved{background:#fdd}</style></head><body>",
+            "<h1>nmeta system test trends</h1>"]
+    if runs:
+        lines.append("<p>%s runs from %s to %s, latest nmeta commit %s</p>"
+                    % (len(runs), escape(runs[0]['run_id']),
+                    escape(runs[-1]['run_id']),
+                    escape(runs[-1]['commit'] or "unknown")))
+    for (suite, test, policy), metrics in trends(runs).items():
+        lines.append("<h2>%s / %s</h2><p>policy %s</p>" % (escape(suite),
+                                    escape(test), escape(policy or "")))
+        lines.append("<table><tr><th>metric</th><th>trend</th><th>runs"
+                    "</th><th>latest</th><th>previous</th><th>change</th>"
+                    "</tr>")
+        for metric, series in metrics.items():
+            if not TREND_METRICS_RE.match(metric):
+                continue
+            latest, previous, moved = change(series)
+            flagged = moved is not None and abs(moved) > tolerance
+            lines.append("<tr%s><td>%s</td><td>%s</td><td>%s</td>"
+                        "<td>%.6g</td><td>%s</td><td>%s</td></tr>" % (
+                        ' class="moved"' if flagged else "", escape(metric),
+                        sparkline(series), len(series), latest,
+                        "" if previous is None else "%.6g" % previous,
+                        "" if moved is None else "%+.1f%%" % (moved * 100)))
+        lines.append("</table>")
+    lines.append("</body></html>")
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'w') as filehandle:
+        filehandle.write("\n".join(lines) + "\n")
+    os.rename(temp_filename, filename)
+
+def write_report(logger, root, output_dir, processes=None):
+    """
+    Scan the runs under a results root and write the CSV and HTML
+    trend reports to the output directory
+    """
+    runs = scan_runs(logger, root, processes)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    write_csv(runs, os.path.join(output_dir, CSV_FILENAME))
+    write_html(runs, os.path.join(output_dir, HTML_FILENAME))
+    logger.info("trend report of %s runs in %s", len(runs),
+                                os.path.join(output_dir, HTML_FILENAME))
+
+def main():
+    """
+    Command line interface to write a trend report
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--root', default=resultsdb.RESULTS_ROOT)
+    parser.add_argument('--output',
+                        help="report directory, default ROOT/%s" %
+                        REPORT_DIR)
+    parser.add_argument('--processes', type=int,
+                        help="parsing processes, default one per CPU")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+    write_report(logger, args.root, args.output or os.path.join(args.root,
+                                            REPORT_DIR), args.processes)
+
+if __name__ == "__main__":
+    #*** Run the main function
+    main()
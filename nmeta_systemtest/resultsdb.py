@@ -0,0 +1,392 @@
+#!/usr/bin/python
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Historical results store for nmeta system test runs.
+
+Ingests timestamped result trees written by nmeta_systemtest into
+an SQLite database, indexed by nmeta git commit, suite, test and
+policy, and flags measurements that have moved beyond a tolerance
+compared to a rolling baseline of earlier runs.
+
+Usage:
+    resultsdb.py ingest [RESULTS_ROOT_OR_RUN_DIR ...]
+    resultsdb.py regressions [--tolerance 0.1] [--window 5]
+"""
+
+import argparse
+import csv
+import datetime
+import logging
+import os
+import re
+import sqlite3
+
+import flows
+import iperf
+import profiler
+import rtt
+
+#*** Default locations of results and the database:
+HOME_DIR = os.path.expanduser("~")
+RESULTS_ROOT = os.path.join(HOME_DIR, 'nmeta_systemtest_results')
+DB_FILENAME = os.path.join(RESULTS_ROOT, 'results.sqlite')
+
+#*** Files written by the environment playbook:
+GIT_COMMIT_FILENAME = 'nmeta_git_commit.txt'
+GIT_STATUS_FILENAME = 'nmeta_git_status.txt'
+
+#*** Result file name patterns:
+IPERF_SUFFIX = 'iperf_result.txt'
+HPING3_SUFFIX = 'hping3_output.txt'
+HPING3_IDLE_SUFFIX = 'hping3_idle.txt'
+SAME_FLOW_SUFFIX = 'flowsetup_same_flow.txt'
+NEW_FLOWS_SUFFIX = 'flowsetup_new_flows.txt'
+PARAMETERS_SUFFIX = '.parameters.txt'
+PROFILE_FILENAME = 'controller_profile.bin'
+SCALING_FILENAME = 'scaling_steps.csv'
+
+#*** Run directories are named by timestamp:
+RUN_DIR_RE = re.compile(r"^\d{14}$")
+POLICY_RE = re.compile(r"policy_name=(\S+)")
+BRANCH_RE = re.compile(r"On branch (\S+)")
+
+#*** Default relative change from baseline that is flagged, and
+#***  number of previous runs that make up the baseline:
+TOLERANCE = 0.1
+BASELINE_WINDOW = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started TEXT,
+    basedir TEXT,
+    nmeta_commit TEXT,
+    nmeta_branch TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT REFERENCES runs(run_id),
+    suite TEXT,
+    test TEXT,
+    policy TEXT,
+    test_dir TEXT,
+    metric TEXT,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS runs_commit ON runs (nmeta_commit);
+CREATE INDEX IF NOT EXISTS results_suite_test
+                            ON results (suite, test, metric);
+CREATE INDEX IF NOT EXISTS results_policy ON results (policy);
+CREATE INDEX IF NOT EXISTS results_run ON results (run_id);
+"""
+
+def connect(filename=DB_FILENAME):
+    """
+    Open (creating if needed) the results database
+    """
+    conn = sqlite3.connect(filename)
+    conn.executescript(SCHEMA)
+    return conn
+
+def read_first_line(filename):
+    """
+    Return the first line of a file stripped, or None if missing
+    """
+    if not os.path.isfile(filename):
+        return None
+    with open(filename) as filehandle:
+        return filehandle.readline().strip() or None
+
+def run_metadata(basedir):
+    """
+    Passed a run base directory, return (run_id, started,
+    nmeta_commit, nmeta_branch) from the environment capture
+    """
+    run_id = os.path.basename(os.path.normpath(basedir))
+    started = datetime.datetime.strptime(run_id, "%Y%m%d%H%M%S")
+    #*** Environment is in a per-testbed subdirectory when a run
+    #***  used more than one testbed, so take the first found:
+    env_dir = basedir
+    if not os.path.isfile(os.path.join(basedir, GIT_COMMIT_FILENAME)):
+        for name in sorted(os.listdir(basedir)):
+            if os.path.isfile(os.path.join(basedir, name,
+                                                    GIT_COMMIT_FILENAME)):
+                env_dir = os.path.join(basedir, name)
+                break
+    commit = read_first_line(os.path.join(env_dir, GIT_COMMIT_FILENAME))
+    branch = None
+    status_file = os.path.join(env_dir, GIT_STATUS_FILENAME)
+    if os.path.isfile(status_file):
+        with open(status_file) as filehandle:
+            branch_match = BRANCH_RE.search(filehandle.read())
+            if branch_match:
+                branch = branch_match.group(1)
+    return run_id, started.isoformat(), commit, branch
+
+def test_policy(test_dir):
+    """
+    Return the policy_name a test ran with from its parameters file
+    """
+    for filename in os.listdir(test_dir):
+        if filename.endswith(PARAMETERS_SUFFIX):
+            with open(os.path.join(test_dir, filename)) as filehandle:
+                policy_match = POLICY_RE.search(filehandle.read())
+                if policy_match:
+                    return policy_match.group(1)
+    return None
+
+def test_metrics(test_dir):
+    """
+    Passed a test result directory, yield (metric, value) for each
+    measurement found in it. Where more than one host ran hping3, as
+    in the mixed suite, its RTT metrics are qualified by host the
+    same as the harness measures them, e.g. rtt_p50:pc1
+    """
+    filenames = sorted(os.listdir(test_dir))
+    rtt_hosts = set(rtt_host(filename) for filename in filenames
+                            if filename.endswith((HPING3_SUFFIX,
+                            HPING3_IDLE_SUFFIX)))
+    for filename in filenames:
+        full_path = os.path.join(test_dir, filename)
+        if filename.endswith(IPERF_SUFFIX):
+            iperf_result = iperf.read_iperf(full_path)
+            if not iperf_result.streams:
+                continue
+            name = filename[:-len(IPERF_SUFFIX)].rstrip('-')
+            yield ('bandwidth:' + name, iperf_result.bandwidth())
+            yield ('steady_bandwidth:' + name,
+                                            iperf_result.steady_state())
+            ramp_time = iperf_result.ramp_time()
+            if ramp_time is not None:
+                yield ('ramp_time:' + name, ramp_time)
+        elif filename.endswith(HPING3_SUFFIX):
+            summary = rtt.read_hping3(full_path).summary()
+            for key, value in summary.items():
+                if key != 'count' and value is not None:
+                    yield (rtt_metric('rtt_' + key, filename, rtt_hosts),
+                                                                    value)
+        elif filename.endswith(HPING3_IDLE_SUFFIX):
+            summary = rtt.read_hping3(full_path).summary()
+            for key, value in summary.items():
+                if key != 'count' and value is not None:
+                    yield (rtt_metric('idle_rtt_' + key, filename,
+                                                        rtt_hosts), value)
+        elif filename.endswith(NEW_FLOWS_SUFFIX):
+            summary = rtt.read_hping3(full_path).summary()
+            for key, value in summary.items():
+                if key not in ('count', 'loss_rate') and value is not None:
+                    yield ('controller_path_rtt_' + key, value)
+        elif filename.endswith(SAME_FLOW_SUFFIX):
+            summary = rtt.read_hping3_split(full_path)[1].summary()
+            for key, value in summary.items():
+                if key not in ('count', 'loss_rate') and value is not None:
+                    yield ('fast_path_rtt_' + key, value)
+        elif filename == SCALING_FILENAME:
+            knee = scaling_knee(full_path)
+            if knee is not None:
+                yield ('knee_flow_rate', knee)
+        elif filename == PROFILE_FILENAME:
+            summary = profiler.read_profile(full_path).summary()
+            for key, value in summary.items():
+                if key not in ('samples', 'duration') and value is not None:
+                    yield ('controller_' + key, value)
+    #*** Switch flow table footprint:
+    snapshots = flows.read_snapshots(test_dir)
+    for label, table in snapshots.items():
+        yield ('flows:' + label, len(table))
+        for table_id, count in table.per_table().items():
+            yield ('flows_table%s:%s' % (table_id, label), count)
+    for before, after, delta in flows.snapshot_deltas(snapshots):
+        install_rate = delta.install_rate()
+        if install_rate is not None:
+            yield ('flow_install_rate:%s-%s' % (before, after),
+                                                            install_rate)
+
+def rtt_host(filename):
+    """
+    Return the short name of the host of an hping3 result file, e.g.
+    pc1 for pc1.example.com-hping3_output.txt
+    """
+    for suffix in (HPING3_SUFFIX, HPING3_IDLE_SUFFIX):
+        if filename.endswith(suffix):
+            filename = filename[:-len(suffix)]
+    return filename.rstrip('-').split('.')[0]
+
+def rtt_metric(metric, filename, rtt_hosts):
+    """
+    Return an RTT metric name, qualified by the host of its result
+    file if the test has hping3 results of more than one host
+    """
+    if len(rtt_hosts) > 1:
+        return "%s:%s" % (metric, rtt_host(filename))
+    return metric
+
+def scaling_knee(filename):
+    """
+    Return the highest flow rate of a scaling benchmark that was not
+    saturated, or None
+    """
+    with open(filename) as filehandle:
+        rows = list(csv.DictReader(filehandle))
+    rates = [float(row['flow_rate']) for row in rows if not row['saturated']]
+    return max(rates) if rates else None
+
+def run_measurements(basedir):
+    """
+    Passed a run base directory, yield (suite, test, policy,
+    test_dir, metric, value) for each measurement of its tests
+    """
+    for dirpath, dirnames, filenames in os.walk(basedir):
+        #*** Skip hidden directories, e.g. superseded attempts:
+        dirnames[:] = [name for name in dirnames
+                                            if not name.startswith('.')]
+        relative = os.path.relpath(dirpath, basedir).split(os.sep)
+        if len(relative) < 2 or not any(name.endswith((IPERF_SUFFIX,
+                                    HPING3_SUFFIX, NEW_FLOWS_SUFFIX,
+                                    SCALING_FILENAME))
+                                    for name in filenames):
+            continue
+        suite, test = relative[0], relative[1]
+        policy = test_policy(dirpath)
+        for metric, value in test_metrics(dirpath):
+            yield (suite, test, policy, dirpath, metric, value)
+
+def ingest_run(conn, basedir, replace=False):
+    """
+    Passed a run base directory, add its measurements to the
+    database. Returns the number of measurements added, or 0 if the
+    run was already ingested (unless replace is True)
+    """
+    run_id, started, commit, branch = run_metadata(basedir)
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM runs WHERE run_id=?", (run_id,))
+    if cursor.fetchone():
+        if not replace:
+            return 0
+        cursor.execute("DELETE FROM results WHERE run_id=?", (run_id,))
+        cursor.execute("DELETE FROM runs WHERE run_id=?", (run_id,))
+    cursor.execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?)",
+                                (run_id, started, basedir, commit, branch))
+    rows = [(run_id,) + measurement
+                                for measurement in run_measurements(basedir)]
+    cursor.executemany("INSERT INTO results (run_id, suite, test, policy,"
+                    " test_dir, metric, value) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows)
+    conn.commit()
+    return len(rows)
+
+def ingest_tree(conn, logger, root=RESULTS_ROOT):
+    """
+    Ingest every timestamped run directory under a results root
+    that is not already in the database
+    """
+    total = 0
+    for name in sorted(os.listdir(root)):
+        basedir = os.path.join(root, name)
+        if RUN_DIR_RE.match(name) and os.path.isdir(basedir):
+            added = ingest_run(conn, basedir)
+            if added:
+                logger.info("ingested run=%s measurements=%s", name,
+                                                                added)
+            total += added
+    return total
+
+def detect_regressions(conn, tolerance=TOLERANCE, window=BASELINE_WINDOW,
+                                                        run_id=None):
+    """
+    Compare each measurement of a run (the latest run if not passed)
+    against the mean of the same suite/test/policy/metric over the
+    previous window runs. Returns a list of (suite, test, policy,
+    metric, value, baseline, change) where the relative change
+    exceeds the tolerance in either direction
+    """
+    cursor = conn.cursor()
+    if run_id is None:
+        cursor.execute("SELECT run_id FROM runs ORDER BY started DESC "
+                                                            "LIMIT 1")
+        row = cursor.fetchone()
+        if not row:
+            return []
+        run_id = row[0]
+    cursor.execute("SELECT started FROM runs WHERE run_id=?", (run_id,))
+    started = cursor.fetchone()[0]
+    cursor.execute("SELECT suite, test, policy, metric, AVG(value) "
+                    "FROM results WHERE run_id=? "
+                    "GROUP BY suite, test, policy, metric", (run_id,))
+    regressions = []
+    for suite, test, policy, metric, value in cursor.fetchall():
+        baseline_cursor = conn.execute(
+            "SELECT AVG(run_value) FROM ("
+            " SELECT AVG(results.value) AS run_value FROM results"
+            " JOIN runs ON runs.run_id = results.run_id"
+            " WHERE suite=? AND test=? AND metric=? AND policy IS ?"
+            " AND runs.started < ?"
+            " GROUP BY results.run_id ORDER BY runs.started DESC"
+            " LIMIT ?)", (suite, test, metric, policy, started, window))
+        baseline = baseline_cursor.fetchone()[0]
+        if not baseline:
+            continue
+        change = (value - baseline) / baseline
+        if abs(change) > tolerance:
+            regressions.append((suite, test, policy, metric, value,
+                                                    baseline, change))
+    return regressions
+
+def log_regressions(logger, regressions):
+    """
+    Log flagged measurements
+    """
+    for suite, test, policy, metric, value, baseline, change in \
+                                                            regressions:
+        logger.warning("suite=%s test=%s policy=%s %s=%s moved %+.1f%% "
+                        "from baseline=%s", suite, test, policy, metric,
+                        value, change * 100, baseline)
+
+def main():
+    """
+    Command line interface to ingest results and check regressions
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--db', default=DB_FILENAME)
+    subparsers = parser.add_subparsers(dest='command')
+    ingest = subparsers.add_parser('ingest')
+    ingest.add_argument('paths', nargs='*', default=[RESULTS_ROOT])
+    check = subparsers.add_parser('regressions')
+    check.add_argument('--tolerance', type=float, default=TOLERANCE)
+    check.add_argument('--window', type=int, default=BASELINE_WINDOW)
+    check.add_argument('--run')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+    conn = connect(args.db)
+    if args.command == 'ingest':
+        for path in args.paths:
+            if RUN_DIR_RE.match(os.path.basename(os.path.normpath(path))):
+                logger.info("ingested %s measurements",
+                                                ingest_run(conn, path))
+            else:
+                logger.info("ingested %s measurements",
+                                        ingest_tree(conn, logger, path))
+    elif args.command == 'regressions':
+        regressions = detect_regressions(conn, args.tolerance,
+                                                args.window, args.run)
+        log_regressions(logger, regressions)
+        logger.info("%s measurements beyond tolerance", len(regressions))
+
+if __name__ == "__main__":
+    #*** Run the main function
+    main()
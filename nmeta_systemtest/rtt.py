@@ -0,0 +1,292 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Streaming analysis of hping3 round trip time (RTT) results.
+
+hping3 captures are read a line at a time as bytes and matched with
+a precompiled regular expression, so multi-million line soak test
+captures are processed without holding them in memory.
+
+A capture can also be split by seq into first packet RTTs (the
+probes that set up a flow through the controller) and fast path
+RTTs (probes forwarded by the switch on an installed flow).
+
+RTTs are accumulated into a fixed size log-bucketed histogram
+(relative precision RTT_PRECISION) from which percentiles are
+estimated, alongside exact count, mean, standard deviation, min
+and max. Loss is calculated from the hping3 seq= numbers that
+were never seen, tracked in a fixed size bitmap of the latest seq
+numbers.
+"""
+
+import array
+import collections
+import math
+import re
+
+import artifacts
+
+#*** Optional NumPy for exporting histograms:
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#*** Extract seq and rtt from a hping3 line.
+#***  Example: len=46 ip=10.1.0.2 ttl=64 DF id=36185 sport=0
+#***  flags=RA seq=6 win=0 rtt=9.1 ms
+HPING3_RE = re.compile(br"seq=(\d+) .*rtt=([0-9.]+)")
+
+#*** Histogram range (seconds) and relative precision of buckets:
+RTT_MIN = 0.000001
+RTT_MAX = 100.0
+RTT_PRECISION = 0.01
+
+#*** hping3 seq numbers are 16 bit and wrap on long runs:
+SEQ_MODULO = 65536
+#*** Latest seq numbers kept for spotting duplicate replies. Older
+#***  replies than this are taken to be distinct:
+SEQ_WINDOW = SEQ_MODULO // 2
+
+#*** Percentiles reported in summaries:
+PERCENTILES = (50, 90, 99, 99.9)
+
+class RttStats(object):
+    """
+    Constant memory accumulator of RTT samples in seconds
+    """
+    def __init__(self):
+        self._log_base = math.log(1 + RTT_PRECISION)
+        self._buckets = int(math.ceil(math.log(RTT_MAX / RTT_MIN) /
+                                                    self._log_base)) + 1
+        self.counts = array.array('L', [0] * self._buckets)
+        self.count = 0
+        self.minimum = None
+        self.maximum = None
+        #*** Welford running mean and sum of squared differences:
+        self._mean = 0.0
+        self._m2 = 0.0
+        #*** Circular bitmap of the latest SEQ_WINDOW seq numbers seen,
+        #***  count of distinct seq numbers and unwrapping state:
+        self._seen = bytearray(SEQ_WINDOW // 8)
+        self._received = 0
+        self._seq_epoch = 0
+        self._last_seq = None
+        self.highest_seq = None
+
+    def _bucket(self, rtt):
+        """
+        Return the histogram bucket index for an RTT
+        """
+        if rtt <= RTT_MIN:
+            return 0
+        index = int(math.log(rtt / RTT_MIN) / self._log_base)
+        return min(index, self._buckets - 1)
+
+    def bucket_value(self, index):
+        """
+        Return the representative (geometric mid) RTT of a bucket
+        """
+        return RTT_MIN * math.exp((index + 0.5) * self._log_base)
+
+    def add(self, rtt, seq=None):
+        """
+        Add an RTT sample in seconds, with its hping3 seq if known
+        """
+        self.count += 1
+        delta = rtt - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (rtt - self._mean)
+        if self.minimum is None or rtt < self.minimum:
+            self.minimum = rtt
+        if self.maximum is None or rtt > self.maximum:
+            self.maximum = rtt
+        self.counts[self._bucket(rtt)] += 1
+        if seq is not None:
+            self._add_seq(seq)
+
+    def _add_seq(self, seq):
+        """
+        Record a seq number as seen, unwrapping 16 bit wraparound
+        """
+        if self._last_seq is not None and \
+                            seq < self._last_seq - SEQ_MODULO // 2:
+            self._seq_epoch += SEQ_MODULO
+        self._last_seq = seq
+        seq += self._seq_epoch
+        if self.highest_seq is None or seq > self.highest_seq:
+            #*** Clear the bits of the seq numbers the window moves onto:
+            start = 0 if self.highest_seq is None else \
+                                                    self.highest_seq + 1
+            if seq - start >= SEQ_WINDOW:
+                self._seen[:] = bytearray(len(self._seen))
+            else:
+                for skipped in range(start, seq + 1):
+                    byte, bit = divmod(skipped % SEQ_WINDOW, 8)
+                    self._seen[byte] &= ~(1 << bit) & 0xff
+            self.highest_seq = seq
+        elif seq <= self.highest_seq - SEQ_WINDOW:
+            self._received += 1
+            return
+        byte, bit = divmod(seq % SEQ_WINDOW, 8)
+        if not self._seen[byte] & 1 << bit:
+            self._seen[byte] |= 1 << bit
+            self._received += 1
+
+    def merge(self, other):
+        """
+        Add the RTT samples of another RttStats, e.g. from another
+        client. Seq numbers are not merged as each client numbers
+        its probes from zero
+        """
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other._mean - self._mean
+        self._m2 += other._m2 + delta * delta * self.count * other.count \
+                                                                / count
+        self._mean += delta * other.count / count
+        self.count = count
+        for index, bucket_count in enumerate(other.counts):
+            if bucket_count:
+                self.counts[index] += bucket_count
+        if self.minimum is None or other.minimum < self.minimum:
+            self.minimum = other.minimum
+        if self.maximum is None or other.maximum > self.maximum:
+            self.maximum = other.maximum
+
+    @property
+    def mean(self):
+        return self._mean if self.count else None
+
+    @property
+    def stddev(self):
+        if self.count < 2:
+            return 0.0 if self.count else None
+        return math.sqrt(self._m2 / (self.count - 1))
+
+    def percentile(self, percent):
+        """
+        Return an estimate of the passed percentile (0-100) of RTT,
+        accurate to within RTT_PRECISION
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(self.count * percent / 100.0)))
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                value = self.bucket_value(index)
+                #*** Never report outside the exact observed range:
+                return min(max(value, self.minimum), self.maximum)
+        return self.maximum
+
+    def received(self):
+        """
+        Return the number of distinct seq numbers seen
+        """
+        return self._received
+
+    def loss_rate(self, sent=None):
+        """
+        Return the fraction of probes lost. Passed the number sent,
+        otherwise assumes probes were numbered from zero up to the
+        highest seq seen
+        """
+        if sent is None:
+            if self.highest_seq is None:
+                return None
+            sent = self.highest_seq + 1
+        if not sent:
+            return None
+        return max(0.0, (sent - self.received()) / float(sent))
+
+    def histogram(self):
+        """
+        Return (bucket RTTs, counts) for non-empty buckets, as NumPy
+        arrays if NumPy is installed, otherwise as arrays
+        """
+        values = array.array('d')
+        counts = array.array('L')
+        for index, count in enumerate(self.counts):
+            if count:
+                values.append(self.bucket_value(index))
+                counts.append(count)
+        if numpy is not None:
+            return numpy.array(values), numpy.array(counts)
+        return values, counts
+
+    def summary(self, sent=None):
+        """
+        Return an ordered dictionary of summary statistics
+        """
+        summary = collections.OrderedDict()
+        summary['count'] = self.count
+        summary['mean'] = self.mean
+        summary['stddev'] = self.stddev
+        summary['min'] = self.minimum
+        summary['max'] = self.maximum
+        for percent in PERCENTILES:
+            summary['p%s' % percent] = self.percentile(percent)
+        summary['loss_rate'] = self.loss_rate(sent)
+        return summary
+
+    def write_histogram(self, filename):
+        """
+        Write the non-empty histogram buckets to a CSV file
+        """
+        values, counts = self.histogram()
+        with open(filename, 'w') as filehandle:
+            filehandle.write("rtt,count\n")
+            for value, count in zip(values, counts):
+                filehandle.write("%.9f,%d\n" % (value, count))
+
+def read_hping3(filename, stats=None):
+    """
+    Passed a full path filename of hping3 output, stream it into an
+    RttStats (a new one unless one is passed) and return it. The
+    file may be in a packed run archive
+    """
+    if stats is None:
+        stats = RttStats()
+    match = HPING3_RE.search
+    with artifacts.open_result(filename, binary=True) as filehandle:
+        for line in filehandle:
+            hping3_match = match(line)
+            if hping3_match:
+                #*** Turn ms into seconds:
+                stats.add(float(hping3_match.group(2)) / 1000,
+                                            int(hping3_match.group(1)))
+    return stats
+
+def read_hping3_split(filename, first_probes=1):
+    """
+    Passed a full path filename of hping3 output from probes of one
+    flow, return (first, fast) RttStats where first holds the probes
+    with seq below first_probes (flow set up through the controller)
+    and fast the rest (forwarded by the switch)
+    """
+    first = RttStats()
+    fast = RttStats()
+    match = HPING3_RE.search
+    with artifacts.open_result(filename, binary=True) as filehandle:
+        for line in filehandle:
+            hping3_match = match(line)
+            if hping3_match:
+                seq = int(hping3_match.group(1))
+                stats = first if seq < first_probes else fast
+                #*** Turn ms into seconds:
+                stats.add(float(hping3_match.group(2)) / 1000, seq)
+    return first, fast
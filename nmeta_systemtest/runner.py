@@ -0,0 +1,297 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Execution backends that run Ansible playbooks for the nmeta
+system tests.
+
+All backends time each playbook run (step) and return its real
+exit code. The Ansible backends share persistent multiplexed SSH
+connections (ControlMaster/ControlPersist) and pipelining across
+every playbook and ad-hoc probe in a run, so connection setup to
+each test host is paid once per run rather than once per task.
+
+Every playbook run is added to the run's trace, and the Ansible
+backends add the timing of each task on each host through the
+callback plugin in callback_plugins/.
+
+LocalBackend runs local commands in place of playbooks so the
+harness can be exercised offline.
+"""
+
+import collections
+import contextlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import tracing
+
+#*** Optional in-process Ansible runner:
+try:
+    import ansible_runner
+except ImportError:
+    ansible_runner = None
+
+#*** Seconds to keep idle multiplexed SSH connections open for:
+SSH_CONTROL_PERSIST = 1800
+#*** Private directory of the run's multiplexed SSH control sockets,
+#***  made on first use, so that closing them leaves the connections
+#***  of other Ansible or ssh sessions alone:
+_control_path_dir = None
+_control_path_lock = threading.Lock()
+
+#*** Ansible callback plugin that times tasks for the run trace, and
+#***  the environment variable naming the file it writes to:
+CALLBACK_PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(
+                                        __file__)), 'callback_plugins')
+TRACE_CALLBACK = 'nmeta_trace'
+TRACE_TASKS_ENV = 'NMETA_TRACE_TASKS'
+
+#*** Result of running one playbook:
+StepResult = collections.namedtuple('StepResult', ['name', 'returncode',
+                                                            'seconds'])
+
+def control_path_dir():
+    """
+    Return the run's directory for multiplexed SSH control sockets,
+    making it if needed
+    """
+    global _control_path_dir
+    with _control_path_lock:
+        if _control_path_dir is None:
+            _control_path_dir = tempfile.mkdtemp(prefix='nmeta_cp')
+        return _control_path_dir
+
+def close_connections():
+    """
+    Close the multiplexed SSH master connections of the run and
+    remove its control socket directory
+    """
+    global _control_path_dir
+    with _control_path_lock:
+        directory, _control_path_dir = _control_path_dir, None
+    if directory is None:
+        return
+    with open(os.devnull, 'w') as devnull:
+        for socket_name in os.listdir(directory):
+            subprocess.call(['ssh', '-O', 'exit', '-S',
+                        os.path.join(directory, socket_name),
+                        'nmeta_systemtest'], stdout=devnull,
+                        stderr=devnull)
+    shutil.rmtree(directory, ignore_errors=True)
+
+def ansible_env(trace_file=None):
+    """
+    Return a copy of the environment with Ansible set to reuse
+    multiplexed SSH connections and to pipeline module execution,
+    and if passed a trace file, to write task timings to it. Any
+    ssh arguments already in the environment (e.g. a ProxyJump the
+    lab needs) are kept, and take precedence
+    """
+    env = dict(os.environ)
+    env['ANSIBLE_SSH_ARGS'] = " ".join(filter(None,
+                    [env.get('ANSIBLE_SSH_ARGS'), "-C -o ControlMaster=auto "
+                    "-o ControlPersist=%ss" % SSH_CONTROL_PERSIST]))
+    env['ANSIBLE_SSH_CONTROL_PATH_DIR'] = control_path_dir()
+    env['ANSIBLE_PIPELINING'] = 'True'
+    if trace_file:
+        env['ANSIBLE_CALLBACK_PLUGINS'] = os.pathsep.join(filter(None,
+                    [env.get('ANSIBLE_CALLBACK_PLUGINS'),
+                    CALLBACK_PLUGIN_DIR]))
+        #*** Callbacks are enabled by whitelist before Ansible 2.11:
+        for key in ('ANSIBLE_CALLBACKS_ENABLED',
+                                        'ANSIBLE_CALLBACK_WHITELIST'):
+            env[key] = ",".join(filter(None, [env.get(key),
+                                                    TRACE_CALLBACK]))
+        env[TRACE_TASKS_ENV] = trace_file
+    return env
+
+@contextlib.contextmanager
+def task_trace():
+    """
+    Context manager giving a temporary file for the callback plugin
+    to write task timings to, which are added to the run trace
+    """
+    handle, filename = tempfile.mkstemp(prefix='nmeta_tasks')
+    os.close(handle)
+    try:
+        yield filename
+    finally:
+        tracing.TRACER.add_tasks(filename)
+        os.remove(filename)
+
+class Backend(object):
+    """
+    Base class for playbook execution backends. Subclasses
+    implement _execute() to run the playbook and return its exit
+    code. Passing the playbook full path, a dictionary of extra
+    vars and an optional inventory to run() returns a StepResult
+    """
+    def __init__(self):
+        self.steps = []
+        self._lock = threading.Lock()
+
+    def run(self, logger, playbook, extra_vars, inventory=None):
+        """
+        Run a playbook, record and return a timed StepResult
+        """
+        name = os.path.basename(playbook)
+        logger.debug("running playbook=%s extra_vars=%s", name,
+                                                            extra_vars)
+        start = time.time()
+        returncode = self._execute(logger, playbook, extra_vars,
+                                                            inventory)
+        step = StepResult(name, returncode, time.time() - start)
+        tracing.TRACER.add(name, 'playbook', start, step.seconds,
+                                        args={'returncode': returncode})
+        logger.debug("playbook=%s returncode=%s took %.1fs", name,
+                                            returncode, step.seconds)
+        with self._lock:
+            self.steps.append(step)
+        return step
+
+    def _execute(self, logger, playbook, extra_vars, inventory):
+        """
+        Run the playbook and return its exit code
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Release any resources held by the backend
+        """
+        pass
+
+class AnsiblePlaybookBackend(Backend):
+    """
+    Run ansible-playbook as a subprocess with persistent
+    multiplexed SSH connections and pipelining
+    """
+    def argv(self, playbook, extra_vars, inventory=None):
+        """
+        Return the ansible-playbook argument list. Extra vars are
+        passed as JSON so values never need shell quoting
+        """
+        argv = ['ansible-playbook', playbook]
+        if inventory:
+            argv += ['-i', inventory]
+        if extra_vars:
+            argv += ['--extra-vars', json.dumps(extra_vars)]
+        return argv
+
+    def _execute(self, logger, playbook, extra_vars, inventory):
+        with task_trace() as trace_file:
+            return subprocess.call(self.argv(playbook, extra_vars,
+                                inventory), env=ansible_env(trace_file))
+
+    def close(self):
+        """
+        Close the multiplexed SSH master connections of the run
+        """
+        close_connections()
+
+class AnsibleRunnerBackend(Backend):
+    """
+    Run playbooks through the ansible-runner Python interface,
+    sharing the same persistent SSH settings. Requires the
+    ansible-runner package
+    """
+    def __init__(self):
+        super(AnsibleRunnerBackend, self).__init__()
+        if not ansible_runner:
+            raise ImportError("ansible-runner is not installed")
+        self.private_data_dir = tempfile.mkdtemp(prefix='nmeta_runner')
+
+    def _execute(self, logger, playbook, extra_vars, inventory):
+        with task_trace() as trace_file:
+            envvars = ansible_env(trace_file)
+            result = ansible_runner.run(
+                    private_data_dir=self.private_data_dir,
+                    playbook=playbook, extravars=extra_vars,
+                    inventory=inventory,
+                    envvars=dict((key, value) for key, value in
+                        envvars.items() if key.startswith('ANSIBLE_')
+                        or key == TRACE_TASKS_ENV),
+                    quiet=True)
+        return result.rc
+
+    def close(self):
+        """
+        Close the multiplexed SSH master connections of the run
+        """
+        close_connections()
+
+class LocalBackend(Backend):
+    """
+    Offline backend that runs a local command in place of each
+    playbook. Passed a dictionary of playbook name to shell command,
+    playbooks without an entry run default_command. Extra vars are
+    exported to the command as NMETA_<KEY> environment variables
+    """
+    def __init__(self, commands=None, default_command='true'):
+        super(LocalBackend, self).__init__()
+        self.commands = commands or {}
+        self.default_command = default_command
+
+    def _execute(self, logger, playbook, extra_vars, inventory):
+        command = self.commands.get(os.path.basename(playbook),
+                                                self.default_command)
+        env = dict(os.environ)
+        for key, value in extra_vars.items():
+            env['NMETA_' + key.upper()] = str(value)
+        return subprocess.call(command, shell=True, env=env)
+
+class CallableBackend(Backend):
+    """
+    Backend that calls a passed function as
+    func(playbook, extra_vars, inventory) and returns its result
+    as the exit code. Used for fake and replayed testbeds
+    """
+    def __init__(self, func):
+        super(CallableBackend, self).__init__()
+        self.func = func
+
+    def _execute(self, logger, playbook, extra_vars, inventory):
+        return self.func(playbook, extra_vars, inventory)
+
+#*** Backends selectable by name:
+BACKENDS = {'ansible-playbook': AnsiblePlaybookBackend,
+            'ansible-runner': AnsibleRunnerBackend,
+            'local': LocalBackend}
+
+def get_backend(name):
+    """
+    Passed a backend name and return a new instance of it
+    """
+    return BACKENDS[name]()
+
+def write_steps(logger, steps, filename):
+    """
+    Passed a list of StepResults, write them to a CSV file and log
+    the total time spent per playbook
+    """
+    totals = collections.OrderedDict()
+    with open(filename, 'w') as filehandle:
+        filehandle.write("playbook,returncode,seconds\n")
+        for step in steps:
+            filehandle.write("%s,%s,%.3f\n" % step)
+            count, seconds = totals.get(step.name, (0, 0.0))
+            totals[step.name] = (count + 1, seconds + step.seconds)
+    for name, (count, seconds) in totals.items():
+        logger.info("playbook=%s runs=%s total=%.1fs mean=%.1fs", name,
+                                    count, seconds, seconds / count)
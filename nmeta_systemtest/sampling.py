@@ -0,0 +1,179 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Sequential statistical pass/fail verdicts for repeated samples.
+
+A test case is sampled repeatedly (e.g. one iperf run per sample)
+and each measurement is compared to its threshold using a 95%
+confidence interval of the mean (Student's t). Sampling stops as
+soon as every measurement is confidently on the passing side of
+its threshold (PASS) or any is confidently on the failing side
+(FAIL). Clear-cut cases settle after MIN_SAMPLES, while noisy ones
+automatically get more samples, up to a maximum, after which the
+verdict falls back to comparing the means.
+
+The verdict logic is independent of the test network, so it can
+be driven with synthetic sample values.
+"""
+
+import math
+
+#*** Fewest samples before a verdict can be reached:
+MIN_SAMPLES = 2
+
+#*** Two-sided 95% Student's t critical values by degrees of freedom:
+T_95 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306,
+        2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110,
+        2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056,
+        2.052, 2.048, 2.045, 2.042)
+Z_95 = 1.960
+
+PASS = 'pass'
+FAIL = 'fail'
+
+def t_critical(degrees_freedom):
+    """
+    Return the two-sided 95% t critical value
+    """
+    if degrees_freedom <= len(T_95):
+        return T_95[degrees_freedom - 1]
+    return Z_95
+
+def confidence_interval(values):
+    """
+    Passed a list of at least two samples, return (mean, low, high)
+    of the 95% confidence interval of the mean
+    """
+    count = len(values)
+    mean = sum(values) / float(count)
+    variance = sum((value - mean) ** 2 for value in values) / \
+                                                    float(count - 1)
+    half_width = t_critical(count - 1) * math.sqrt(variance / count)
+    return mean, mean - half_width, mean + half_width
+
+class Threshold(object):
+    """
+    A measurement that must be below ('<') or above ('>') a
+    threshold for the test to pass
+    """
+    def __init__(self, name, operator, threshold):
+        if operator not in ('<', '>'):
+            raise ValueError("operator must be '<' or '>'")
+        self.name = name
+        self.operator = operator
+        self.threshold = threshold
+
+    def passes(self, value):
+        """
+        Return True if a single value is on the passing side
+        """
+        if self.operator == '<':
+            return value < self.threshold
+        return value > self.threshold
+
+    def __str__(self):
+        return "%s %s %s" % (self.name, self.operator, self.threshold)
+
+class SequentialVerdict(object):
+    """
+    Accumulates samples of one or more thresholded measurements
+    and decides when enough samples have been taken
+    """
+    def __init__(self, thresholds, max_samples, min_samples=MIN_SAMPLES):
+        self.thresholds = list(thresholds)
+        self.min_samples = min(min_samples, max_samples)
+        self.max_samples = max_samples
+        self.samples = dict((threshold.name, [])
+                                        for threshold in self.thresholds)
+        self.count = 0
+        self.verdict = None
+
+    def add(self, sample):
+        """
+        Passed a dictionary of measurement name to value for one
+        sample, add it and return the verdict (None if unsettled)
+        """
+        for threshold in self.thresholds:
+            self.samples[threshold.name].append(sample[threshold.name])
+        self.count += 1
+        self.verdict = self._decide()
+        return self.verdict
+
+    def settled(self):
+        """
+        Return True once no more samples are needed
+        """
+        return self.verdict is not None
+
+    def passed(self):
+        """
+        Return True if the settled verdict is a pass
+        """
+        return self.verdict == PASS
+
+    def _decide(self):
+        """
+        Return PASS, FAIL or None (take another sample)
+        """
+        if self.count < self.min_samples:
+            return None
+        if self.count == 1:
+            #*** Only one sample allowed, so judge it directly:
+            return self._decide_on_means()
+        undecided = False
+        for threshold in self.thresholds:
+            _, low, high = confidence_interval(
+                                        self.samples[threshold.name])
+            if threshold.operator == '<':
+                confident_pass = high < threshold.threshold
+                confident_fail = low >= threshold.threshold
+            else:
+                confident_pass = low > threshold.threshold
+                confident_fail = high <= threshold.threshold
+            if confident_fail:
+                return FAIL
+            if not confident_pass:
+                undecided = True
+        if not undecided:
+            return PASS
+        if self.count >= self.max_samples:
+            return self._decide_on_means()
+        return None
+
+    def _decide_on_means(self):
+        """
+        Fallback verdict when out of samples: compare the means
+        """
+        for threshold in self.thresholds:
+            values = self.samples[threshold.name]
+            if not threshold.passes(sum(values) / float(len(values))):
+                return FAIL
+        return PASS
+
+    def describe(self):
+        """
+        Return a human readable description of the samples, their
+        confidence intervals and the verdict
+        """
+        parts = []
+        for threshold in self.thresholds:
+            values = self.samples[threshold.name]
+            if len(values) > 1:
+                mean, low, high = confidence_interval(values)
+                parts.append("%s mean=%.0f ci95=[%.0f, %.0f]" % (
+                                            threshold, mean, low, high))
+            elif values:
+                parts.append("%s value=%s" % (threshold, values[0]))
+        return "verdict=%s samples=%s %s" % (self.verdict, self.count,
+                                                        "; ".join(parts))
@@ -0,0 +1,310 @@
+#!/usr/bin/python
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Controller scaling benchmark for nmeta.
+
+Ramps load step by step, each step being a number of concurrent
+clients, a total rate of new flows per second (hping3 probes to an
+incrementing port, each a new flow for nmeta to set up) and a
+number of parallel iperf streams per client. RTT, loss, achieved
+flow setup rate and throughput are measured at each step.
+
+A step is saturated when loss, RTT (relative to the first step) or
+the achieved setup rate go beyond limits. The ramp stops after
+consecutive saturated steps, and the knee point is the highest
+flow rate step that was not saturated, i.e. the maximum
+sustainable flow setup rate.
+
+The ramp and analysis run without the lab in mock mode, where a
+simulated controller of a given capacity writes the result files:
+    scaling.py --capacity 300
+"""
+
+import argparse
+import collections
+import logging
+import os
+import random
+import shutil
+import tempfile
+
+import iperf
+import rtt
+
+#*** Result files of one step, prefixed by the client hostname:
+HPING3_SUFFIX = '-scaling_hping3.txt'
+IPERF_SUFFIX = '-scaling_iperf.txt'
+
+#*** A step is saturated if more than LOSS_LIMIT of probes are lost,
+#***  p99 RTT is more than RTT_FACTOR times that of the first step,
+#***  or less than ACHIEVED_FRACTION of the offered flows were set up:
+LOSS_LIMIT = 0.01
+RTT_FACTOR = 3.0
+ACHIEVED_FRACTION = 0.9
+#*** Stop ramping after this many consecutive saturated steps:
+SATURATED_STEPS = 2
+
+#*** One step of load, with flow_rate the total new flows per second:
+Step = collections.namedtuple('Step', ('clients', 'flow_rate',
+                                                            'streams'))
+
+#*** Measurements of one step:
+Measurement = collections.namedtuple('Measurement', ('step', 'sent',
+                'received', 'flow_rate', 'rtt_p50', 'rtt_p99',
+                'throughput'))
+
+def step_vars(step, duration):
+    """
+    Return the playbook extra vars that run a step for duration
+    seconds, splitting the flow rate evenly across the clients
+    """
+    per_client = float(step.flow_rate) / step.clients
+    return {'clients': str(step.clients), 'streams': str(step.streams),
+            'hping3_interval': str(int(1000000 / per_client)),
+            'hping3_count': str(max(1, int(per_client * duration)))}
+
+def sent_per_client(step, duration):
+    """
+    Return the number of probes each client sends in a step
+    """
+    return max(1, int(float(step.flow_rate) / step.clients * duration))
+
+def read_step(step_dir, step, duration):
+    """
+    Passed the result directory of a step, read the result files of
+    every client and return a Measurement
+    """
+    stats = rtt.RttStats()
+    received = 0
+    throughput = 0.0
+    clients = 0
+    for filename in sorted(os.listdir(step_dir)):
+        full_path = os.path.join(step_dir, filename)
+        if filename.endswith(HPING3_SUFFIX):
+            #*** Loss per client, as each numbers its probes from zero:
+            client_stats = rtt.read_hping3(full_path)
+            received += client_stats.received()
+            stats.merge(client_stats)
+            clients += 1
+        elif filename.endswith(IPERF_SUFFIX):
+            throughput += iperf.read_iperf(full_path).bandwidth() or 0.0
+    sent = sent_per_client(step, duration) * step.clients
+    return Measurement(step, sent, received, received / float(duration),
+                        stats.percentile(50), stats.percentile(99),
+                        throughput)
+
+class Ramp(object):
+    """
+    Steps of a scaling ramp and their measurements
+    """
+    def __init__(self, steps, loss_limit=LOSS_LIMIT, rtt_factor=RTT_FACTOR,
+                    achieved_fraction=ACHIEVED_FRACTION,
+                    saturated_steps=SATURATED_STEPS):
+        self.steps = list(steps)
+        self.loss_limit = loss_limit
+        self.rtt_factor = rtt_factor
+        self.achieved_fraction = achieved_fraction
+        self.saturated_steps = saturated_steps
+        #*** (Measurement, reason or None if not saturated):
+        self.results = []
+
+    def saturation(self, measurement):
+        """
+        Return why a measurement shows saturation, or None
+        """
+        if not measurement.sent:
+            return None
+        loss = 1 - measurement.received / float(measurement.sent)
+        if loss > self.loss_limit:
+            return "loss=%.3f" % loss
+        baseline = self.results[0][0].rtt_p99 if self.results \
+                                                else measurement.rtt_p99
+        if baseline and measurement.rtt_p99 > self.rtt_factor * baseline:
+            return "rtt_p99=%.6f baseline=%.6f" % (measurement.rtt_p99,
+                                                                baseline)
+        if measurement.flow_rate < \
+                        self.achieved_fraction * measurement.step.flow_rate:
+            return "flow_rate=%.1f offered=%s" % (measurement.flow_rate,
+                                                measurement.step.flow_rate)
+        return None
+
+    def add(self, measurement):
+        """
+        Add a step's measurement and return the saturation reason,
+        or None
+        """
+        reason = self.saturation(measurement)
+        self.results.append((measurement, reason))
+        return reason
+
+    def done(self):
+        """
+        Return True when the last saturated_steps steps saturated
+        """
+        recent = self.results[-self.saturated_steps:]
+        return len(recent) == self.saturated_steps and \
+                                    all(reason for _, reason in recent)
+
+    def knee(self):
+        """
+        Return the measurement of the highest flow rate step that
+        was not saturated, or None if all were
+        """
+        sustained = [measurement for measurement, reason in self.results
+                                                        if not reason]
+        if not sustained:
+            return None
+        return max(sustained, key=lambda measurement:
+                                                measurement.step.flow_rate)
+
+    def write_csv(self, filename):
+        """
+        Write the measurement of each step to a CSV file
+        """
+        with open(filename, 'w') as filehandle:
+            filehandle.write("clients,flow_rate,streams,sent,received,"
+                        "achieved_flow_rate,rtt_p50,rtt_p99,throughput,"
+                        "saturated\n")
+            for measurement, reason in self.results:
+                filehandle.write("%s,%s,%s,%s,%s,%.1f,%s,%s,%.0f,%s\n" % (
+                        measurement.step.clients,
+                        measurement.step.flow_rate,
+                        measurement.step.streams, measurement.sent,
+                        measurement.received, measurement.flow_rate,
+                        measurement.rtt_p50, measurement.rtt_p99,
+                        measurement.throughput, reason or ""))
+
+def run_ramp(logger, ramp, run_step):
+    """
+    Run the steps of a ramp in turn with run_step(step), which
+    returns a Measurement, until the ramp saturates. Returns the
+    knee measurement
+    """
+    for step in ramp.steps:
+        measurement = run_step(step)
+        reason = ramp.add(measurement)
+        logger.info("step clients=%s flow_rate=%s streams=%s "
+                    "achieved=%.1f rtt_p50=%s rtt_p99=%s throughput=%.0f "
+                    "saturated=%s", step.clients, step.flow_rate,
+                    step.streams, measurement.flow_rate,
+                    measurement.rtt_p50, measurement.rtt_p99,
+                    measurement.throughput, reason)
+        if ramp.done():
+            logger.info("ramp saturated, stopping")
+            break
+    return ramp.knee()
+
+class MockController(object):
+    """
+    Simulated controller and network for testing the ramp and
+    analysis without the lab. Flow setups queue (M/M/1) at the
+    controller, beyond its capacity the excess probes are lost and
+    throughput on the shared link drops with them
+    """
+    def __init__(self, capacity, base_rtt=0.002, link_bps=100000000,
+                                                                seed=1):
+        self.capacity = float(capacity)
+        self.base_rtt = base_rtt
+        self.link_bps = link_bps
+        self.random = random.Random(seed)
+
+    def write_step(self, step_dir, step, duration):
+        """
+        Write the result files of every client of a step
+        """
+        utilisation = step.flow_rate / self.capacity
+        delivered = min(1.0, 1 / utilisation) if utilisation else 1.0
+        rtt_mean = self.base_rtt / max(0.05, 1 - min(utilisation, 0.95))
+        throughput = self.link_bps * delivered / step.clients
+        for client in range(step.clients):
+            host = "client%s.example.com" % client
+            with open(os.path.join(step_dir, host + HPING3_SUFFIX),
+                                                    'w') as filehandle:
+                for seq in range(sent_per_client(step, duration)):
+                    if self.random.random() > delivered:
+                        continue
+                    filehandle.write("len=46 ip=10.1.0.2 ttl=64 DF id=0 "
+                            "sport=0 flags=RA seq=%s win=0 rtt=%.1f ms\n" %
+                            (seq % rtt.SEQ_MODULO, 1000 * self.random.
+                            expovariate(1 / rtt_mean)))
+            with open(os.path.join(step_dir, host + IPERF_SUFFIX),
+                                                    'w') as filehandle:
+                for second in range(duration):
+                    filehandle.write("20161017101010,10.1.0.1,5001,"
+                            "10.1.0.2,5001,3,%s.0-%s.0,%d,%d\n" % (second,
+                            second + 1, throughput / 8, throughput))
+
+    def responder(self, playbook, extra_vars):
+        """
+        Responder for a scheduler.FakeTestbed that writes the result
+        files when asked to run a scaling step playbook
+        """
+        if 'hping3_count' not in extra_vars:
+            return
+        clients = int(extra_vars['clients'])
+        interval = int(extra_vars['hping3_interval'])
+        step = Step(clients, int(round(clients * 1000000.0 / interval)),
+                                                int(extra_vars['streams']))
+        step_dir = extra_vars['results_dir']
+        if not os.path.isdir(step_dir):
+            os.makedirs(step_dir)
+        self.write_step(step_dir, step, int(extra_vars['duration']))
+
+def default_steps(clients=2, streams=(1, 2, 4),
+                        flow_rates=(10, 20, 50, 100, 200, 500, 1000)):
+    """
+    Return a ramp of steps, raising the flow rate with the number of
+    streams stepping up alongside
+    """
+    return [Step(clients, flow_rate,
+                    streams[min(index * len(streams) // len(flow_rates),
+                                                    len(streams) - 1)])
+                for index, flow_rate in enumerate(flow_rates)]
+
+def main():
+    """
+    Run a scaling ramp against a simulated controller
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--capacity', type=float, default=300,
+                        help="simulated flow setups per second")
+    parser.add_argument('--duration', type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+    mock = MockController(args.capacity)
+    workdir = tempfile.mkdtemp()
+    ramp = Ramp(default_steps())
+
+    def run_step(step):
+        step_dir = tempfile.mkdtemp(dir=workdir)
+        mock.write_step(step_dir, step, args.duration)
+        return read_step(step_dir, step, args.duration)
+
+    try:
+        knee = run_ramp(logger, ramp, run_step)
+    finally:
+        shutil.rmtree(workdir)
+    if knee:
+        logger.info("knee flow_rate=%s rtt_p99=%s throughput=%.0f",
+                        knee.step.flow_rate, knee.rtt_p99, knee.throughput)
+    else:
+        logger.info("no step was sustained")
+
+if __name__ == "__main__":
+    #*** Run the main function
+    main()
@@ -0,0 +1,276 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Spread nmeta system test cases across one or more isolated testbeds.
+
+Each testbed is an Ansible inventory with its own controller,
+switch and hosts. One worker thread is bound to each testbed so
+a testbed only ever runs one case at a time (the playbooks kill
+and restart ryu-manager, so two cases on one testbed would clash).
+
+Cases are taken from a shared list in order, except that a
+testbed prefers the next case using the policy it last ran so
+its controller can be reused, and otherwise the next case whose
+policy no other testbed is running, so that each policy group
+stays on one testbed while there are other groups to run. With a
+single testbed and cases already grouped by policy the run is the
+same as a serial one.
+The first failure stops further cases being started and is
+re-raised once in-flight cases finish, keeping the fail-fast
+behaviour of the serial harness.
+
+Optionally each testbed has an analysis pipeline, so that cases
+can hand the analysis of retrieved results to a background thread
+while the testbed runs the next test. A failed analysis aborts the
+run: testbeds stop at their next playbook.
+"""
+
+import collections
+import sys
+import threading
+import time
+
+import pipeline
+import readiness
+import runner
+
+#*** A single schedulable test case. func is called as
+#***  func(logger, basedir, ready, testbed, case, record), record
+#***  being the manifest.CaseRecord of the run. spec is the test
+#***  matrix entry the case was built from, if any:
+Case = collections.namedtuple('Case', ['suite', 'test', 'policy_name',
+                                        'iteration', 'func', 'spec'])
+Case.__new__.__defaults__ = (None,)
+
+class Aborted(Exception):
+    """
+    Raised instead of running a playbook once the run is aborted
+    """
+    pass
+
+class Testbed(object):
+    """
+    A real testbed, reached through an Ansible inventory. An
+    inventory of None uses the Ansible default inventory. Playbooks
+    are run through the passed execution backend
+    """
+    def __init__(self, name, inventory=None, backend=None):
+        self.name = name
+        self.inventory = inventory
+        if backend is None:
+            backend = runner.AnsiblePlaybookBackend()
+        self.backend = backend
+        #*** Optional controller.ControllerManager to reuse nmeta:
+        self.controller = None
+        #*** logwatch.Position of the nmeta log checked up to:
+        self.log_position = None
+        #*** Set by the Scheduler while running cases:
+        self.pipeline = None
+        self.abort = None
+
+    def run_playbook(self, logger, playbook, extra_vars):
+        """
+        Passed the full path of an Ansible playbook and a dictionary
+        of extra vars, run it against this testbed and exit if it
+        fails. Raises Aborted if the run has been aborted
+        """
+        if self.abort is not None and self.abort.is_set():
+            raise Aborted("testbed=%s run aborted" % self.name)
+        step = self.backend.run(logger, playbook, extra_vars,
+                                                        self.inventory)
+        if step.returncode:
+            logger.critical("testbed=%s playbook=%s failed returncode=%s",
+                                self.name, step.name, step.returncode)
+            sys.exit("Playbook failed. Exiting...")
+        return step
+
+    def analyse(self, label, func, *args):
+        """
+        Run func(*args) to analyse the results of a test, in the
+        background if the testbed has an analysis pipeline so that
+        the testbed can get on with the next test, otherwise now
+        """
+        if self.pipeline is None:
+            func(*args)
+        else:
+            self.pipeline.submit(label, func, *args)
+
+    def settle_probes(self):
+        """
+        Return readiness probes for this testbed settling between
+        tests
+        """
+        return readiness.settle_probes(self.inventory,
+                                    controller_reused=bool(self.controller))
+
+class FakeTestbed(Testbed):
+    """
+    Local stand-in for a testbed that runs no playbooks. Records
+    the playbooks it was asked to run, optionally sleeps to
+    simulate their duration, and calls responder (if passed) with
+    the playbook and extra vars so it can write fake result files
+    """
+    def __init__(self, name, delay=0, responder=None):
+        super(FakeTestbed, self).__init__(name,
+                            backend=runner.CallableBackend(self._fake))
+        self.delay = delay
+        self.responder = responder
+        self.playbooks = []
+        #*** Number of playbooks currently running, to check that
+        #***  the testbed is never used concurrently:
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def _fake(self, playbook, extra_vars, inventory):
+        """
+        Pretend to run a playbook and return a zero exit code
+        """
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.playbooks.append(playbook)
+        try:
+            if self.delay:
+                time.sleep(self.delay)
+            if self.responder:
+                self.responder(playbook, extra_vars)
+        finally:
+            with self._lock:
+                self.active -= 1
+        return 0
+
+    def settle_probes(self):
+        return [readiness.CallableProbe('fake-settled', lambda: True)]
+
+class Scheduler(object):
+    """
+    Worker pool with one worker per testbed. Passed a list of
+    cases and a function run_case(case, testbed) that runs a case.
+    If pipelined, each testbed gets an analysis pipeline
+    """
+    def __init__(self, logger, testbeds, pipelined=False):
+        self.logger = logger
+        self.testbeds = list(testbeds)
+        self.pipelined = pipelined
+        #*** (case, testbed name, seconds) for each completed case:
+        self.completed = []
+        self._failure = None
+        #*** Policy each testbed is running, by testbed name:
+        self._claimed = {}
+        self._abort = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self, cases, run_case):
+        """
+        Run the cases across the testbeds and return the list of
+        completed cases. Re-raises the first failure after any
+        in-flight cases and analysis finish
+        """
+        pending = list(cases)
+        self.logger.info("scheduling %s cases across %s testbed(s)",
+                                        len(cases), len(self.testbeds))
+        workers = []
+        for testbed in self.testbeds:
+            testbed.abort = self._abort
+            if self.pipelined:
+                testbed.pipeline = pipeline.Pipeline(self.logger,
+                                                testbed.name, self._abort)
+            worker = threading.Thread(target=self._worker,
+                                    name="testbed-" + testbed.name,
+                                    args=(pending, testbed, run_case))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            #*** Join with a timeout so Ctrl-C still interrupts:
+            while worker.is_alive():
+                worker.join(1)
+        for testbed in self.testbeds:
+            if testbed.pipeline:
+                testbed.pipeline.close()
+                self.logger.info("testbed=%s analysed %s results in "
+                            "background for %.1fs", testbed.name,
+                            testbed.pipeline.jobs, testbed.pipeline.seconds)
+                if testbed.pipeline.failure and not self._failure:
+                    self._failure = testbed.pipeline.failure
+            testbed.pipeline = None
+            testbed.abort = None
+        if self._failure:
+            raise self._failure
+        return self.completed
+
+    def _next_case(self, pending, testbed_name, policy_name):
+        """
+        Remove and return the next pending case, preferring one that
+        uses the policy the testbed last ran so that its controller
+        does not need restarting, then one whose policy no other
+        testbed is running. Returns None when none are left
+        """
+        with self._lock:
+            if not pending:
+                return None
+            index = self._pick(pending, testbed_name, policy_name)
+            case = pending.pop(index)
+            self._claimed[testbed_name] = case.policy_name
+            return case
+
+    def _pick(self, pending, testbed_name, policy_name):
+        """
+        Return the index in pending of the case to run next
+        """
+        for index, case in enumerate(pending):
+            if case.policy_name == policy_name:
+                return index
+        claimed = set(policy for name, policy in self._claimed.items()
+                                                if name != testbed_name)
+        for index, case in enumerate(pending):
+            if case.policy_name not in claimed:
+                return index
+        return 0
+
+    def _worker(self, pending, testbed, run_case):
+        """
+        Take cases from the pending list and run them on one testbed
+        until none are left or another worker has failed
+        """
+        policy_name = None
+        while not self._abort.is_set():
+            case = self._next_case(pending, testbed.name, policy_name)
+            if case is None:
+                return
+            policy_name = case.policy_name
+            self.logger.info("testbed=%s starting suite=%s test=%s",
+                                    testbed.name, case.suite, case.test)
+            start = time.time()
+            try:
+                run_case(case, testbed)
+            except Aborted:
+                self.logger.warning("testbed=%s stopped suite=%s test=%s, "
+                            "run aborted", testbed.name, case.suite,
+                            case.test)
+                return
+            except BaseException as exception:
+                #*** Includes AssertionError and sys.exit() from cases:
+                self.logger.critical("testbed=%s failed suite=%s "
+                            "test=%s, aborting run", testbed.name,
+                            case.suite, case.test, exc_info=True)
+                with self._lock:
+                    if not self._failure:
+                        self._failure = exception
+                self._abort.set()
+                return
+            with self._lock:
+                self.completed.append((case, testbed.name,
+                                                    time.time() - start))
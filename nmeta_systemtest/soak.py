@@ -0,0 +1,235 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Soak mode for the nmeta system tests.
+
+Runs the selected cases round after round for a set duration, to
+surface controller slowdowns that only appear after hours, such as
+flow table growth, memory leaks and latency creep.
+
+The measurements of each case (throughput, RTT percentiles,
+controller RSS, flow table sizes) are kept per test in rolling
+windows of the latest values, so memory stays constant however
+long the soak runs. After each case, the slope of each window is
+checked against trend rules, as a relative change per hour of the
+window mean, and the soak fails as soon as a trend crosses its
+threshold rather than at the end.
+"""
+
+import collections
+import numbers
+import re
+import threading
+import time
+
+import scheduler
+
+#*** Direction of a trend that violates a rule:
+RISING = 'rising'
+FALLING = 'falling'
+
+#*** Latest values kept per measurement of a test:
+WINDOW = 60
+#*** Fewest values, and shortest time they span (s), for a trend:
+MIN_POINTS = 6
+MIN_SPAN = 600
+
+#*** Duration suffixes of --soak:
+DURATION_RE = re.compile(r"^(\d+(?:\.\d+)?)([smhd]?)$")
+DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+class TrendRule(object):
+    """
+    A named trend of measurements matching a pattern, violated when
+    the window slope in the passed direction exceeds max_change, as
+    a fraction of the window mean per hour
+    """
+    def __init__(self, name, pattern, direction, max_change):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.direction = direction
+        self.max_change = max_change
+
+#*** Default rules:
+RULES = (TrendRule('memory leak', r"^controller_rss_max$", RISING, 0.05),
+         TrendRule('flow table growth', r"^flows:", RISING, 0.1),
+         TrendRule('latency creep', r"rtt_p(50|99)(:|$)", RISING,
+                                                                    0.2),
+         TrendRule('throughput decline', r"^(unconstrained|throughput)$",
+                                                            FALLING, 0.1))
+
+class Window(object):
+    """
+    Rolling window of the latest (time, value) points of a
+    measurement
+    """
+    def __init__(self, size=WINDOW):
+        self.points = collections.deque(maxlen=size)
+        self.count = 0
+
+    def add(self, when, value):
+        """
+        Add a value measured at a time
+        """
+        self.points.append((when, value))
+        self.count += 1
+
+    def mean(self):
+        """
+        Return the mean of the values in the window
+        """
+        return sum(value for _, value in self.points) / \
+                                                float(len(self.points))
+
+    def slope(self):
+        """
+        Return the least squares slope of the window values per
+        second, or None if they do not span enough time
+        """
+        if len(self.points) < MIN_POINTS or \
+                        self.points[-1][0] - self.points[0][0] < MIN_SPAN:
+            return None
+        mean_time = sum(when for when, _ in self.points) / \
+                                                float(len(self.points))
+        mean_value = self.mean()
+        covariance = sum((when - mean_time) * (value - mean_value)
+                                            for when, value in self.points)
+        variance = sum((when - mean_time) ** 2 for when, _ in self.points)
+        return covariance / variance if variance else None
+
+    def change_per_hour(self):
+        """
+        Return the slope of the window as a fraction of its mean per
+        hour, or None if there is no trend yet
+        """
+        slope = self.slope()
+        mean = self.mean()
+        if slope is None or not mean:
+            return None
+        return slope * 3600 / abs(mean)
+
+class SoakMonitor(object):
+    """
+    Rolling windows of the measurements of each test, checked
+    against trend rules as cases finish
+    """
+    def __init__(self, logger, rules=RULES, size=WINDOW):
+        self.logger = logger
+        self.rules = list(rules)
+        self.size = size
+        #*** Window by (suite/test, measurement):
+        self.windows = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, record):
+        """
+        Add the measurements of a finished case, passed its
+        manifest.CaseRecord, and fail if a trend crosses a rule
+        """
+        test = "%s/%s" % (record.case.suite, record.case.test)
+        now = time.time()
+        with self._lock:
+            for name, values in record.measurements.items():
+                for value in values:
+                    if isinstance(value, bool) or \
+                                    not isinstance(value, numbers.Number):
+                        continue
+                    self.windows.setdefault((test, name),
+                                    Window(self.size)).add(now, value)
+            violations = self.violations(test)
+        for rule, name, change in violations:
+            self.logger.critical("soak trend=%s test=%s %s %+.1f%% per "
+                        "hour, allowed %.1f%%", rule.name, test, name,
+                        change * 100, rule.max_change * 100)
+        if violations:
+            raise AssertionError("soak trend %s of %s crossed its "
+                        "threshold" % (violations[0][0].name, test))
+
+    def violations(self, test):
+        """
+        Return a list of (rule, measurement, change per hour) of the
+        windows of a test whose trend crosses a rule
+        """
+        result = []
+        for (window_test, name), window in self.windows.items():
+            if window_test != test:
+                continue
+            for rule in self.rules:
+                if not rule.pattern.search(name):
+                    continue
+                change = window.change_per_hour()
+                if change is None:
+                    break
+                if (rule.direction == RISING and
+                                        change > rule.max_change) or \
+                        (rule.direction == FALLING and
+                                        -change > rule.max_change):
+                    result.append((rule, name, change))
+                break
+        return result
+
+    def log_summary(self):
+        """
+        Log the rolling mean and trend of each measurement that a
+        rule watches
+        """
+        with self._lock:
+            for (test, name), window in self.windows.items():
+                if not any(rule.pattern.search(name)
+                                                for rule in self.rules):
+                    continue
+                change = window.change_per_hour()
+                self.logger.info("soak test=%s %s values=%s mean=%.6g "
+                            "latest=%.6g trend=%s", test, name,
+                            window.count, window.mean(),
+                            window.points[-1][1], "n/a" if change is None
+                            else "%+.1f%%/h" % (change * 100))
+
+def parse_duration(text):
+    """
+    Return the seconds of a duration such as 90m, 8h or 3600
+    """
+    match = DURATION_RE.match(text.strip())
+    if not match:
+        raise ValueError("invalid duration %s, expected e.g. 90m or 8h" %
+                                                                    text)
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+def run_rounds(logger, testbeds, cases, run_case, seconds, monitor,
+                                                            pipelined=False):
+    """
+    Run the cases in rounds across the testbeds until seconds have
+    passed, numbering the iterations of each round on from the last,
+    and return the list of completed cases of the last round, so that
+    memory does not grow with the rounds. Fails as soon as a case or
+    trend does
+    """
+    if not cases:
+        return []
+    stride = max(case.iteration for case in cases) + 1
+    deadline = time.time() + seconds
+    completed = []
+    count = 0
+    round_number = 0
+    while time.time() < deadline:
+        logger.info("soak round=%s %.0fs left", round_number + 1,
+                                                deadline - time.time())
+        completed = scheduler.Scheduler(logger, testbeds, pipelined).run(
+                        [case._replace(iteration=round_number * stride +
+                        case.iteration) for case in cases], run_case)
+        count += len(completed)
+        monitor.log_summary()
+        round_number += 1
+    logger.info("soak finished rounds=%s cases=%s", round_number, count)
+    return completed
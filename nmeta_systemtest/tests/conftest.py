@@ -0,0 +1,24 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+pytest configuration for the nmeta system test harness unit tests.
+Run from the nmeta_systemtest directory with: python -m pytest tests
+"""
+
+import os
+import sys
+
+#*** Harness modules import each other by name, so put them on the path:
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+                                            os.path.abspath(__file__))))
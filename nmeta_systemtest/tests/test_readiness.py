@@ -0,0 +1,138 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+nmeta_systemtest readiness.py Unit Tests
+"""
+
+import logging
+
+import readiness
+
+logger = logging.getLogger(__name__)
+
+class FakeClock(object):
+    """
+    Clock that only moves when slept on, recording each sleep
+    """
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+def ready_after(checks):
+    """
+    Return a probe that is ready on its checks-th check
+    """
+    calls = []
+    def check():
+        calls.append(1)
+        return len(calls) >= checks
+    return readiness.CallableProbe('ready-after-%s' % checks, check)
+
+def make_readiness(fake):
+    return readiness.Readiness(logger, initial=0.5, maximum=5, backoff=2,
+                                clock=fake.clock, sleep=fake.sleep)
+
+def test_ready_at_once():
+    """
+    Check probes that are already ready do not wait at all
+    """
+    fake = FakeClock()
+    ready = make_readiness(fake)
+    assert ready.wait('test', [ready_after(1), ready_after(1)], 30)
+    assert fake.sleeps == []
+    assert ready.waits == [('test', 30, 0.0, True)]
+    assert ready.saved() == 30
+
+def test_backoff():
+    """
+    Check the poll interval doubles up to the maximum
+    """
+    fake = FakeClock()
+    ready = make_readiness(fake)
+    assert ready.wait('test', [ready_after(7)], 60)
+    assert fake.sleeps == [0.5, 1, 2, 4, 5, 5]
+    assert ready.waits[0][2] == 17.5
+
+def test_waits_for_slowest_probe():
+    """
+    Check all probes must pass, and ready probes are not checked
+    again while waiting on the others
+    """
+    fake = FakeClock()
+    ready = make_readiness(fake)
+    checks = []
+    def fast():
+        checks.append('fast')
+        return True
+    probes = [readiness.CallableProbe('fast', fast), ready_after(3)]
+    assert ready.wait('test', probes, 60)
+    assert checks == ['fast']
+    assert fake.sleeps == [0.5, 1]
+
+def test_timeout():
+    """
+    Check a probe that never passes gives up at the fixed wait,
+    with the last sleep cut short, and is recorded as not ready
+    """
+    fake = FakeClock()
+    ready = make_readiness(fake)
+    never = readiness.CallableProbe('never', lambda: False)
+    assert not ready.wait('test', [never], 10)
+    assert fake.sleeps == [0.5, 1, 2, 4, 2.5]
+    assert ready.waits == [('test', 10, 10.0, False)]
+    assert ready.saved() == 0
+
+def test_write_summary(tmpdir):
+    """
+    Check the ledger of waits is written as CSV
+    """
+    fake = FakeClock()
+    ready = make_readiness(fake)
+    ready.wait('quick', [ready_after(1)], 30)
+    ready.wait('slow', [readiness.CallableProbe('never', lambda: False)],
+                                                                    1)
+    filename = str(tmpdir.join('readiness_waits.csv'))
+    ready.write_summary(filename)
+    with open(filename) as filehandle:
+        assert filehandle.read().splitlines() == [
+                        "label,fixed,waited,ready",
+                        "quick,30,0.000,True",
+                        "slow,1,1.000,False"]
+
+def test_settle_probes():
+    """
+    Check the controller is only expected to stop when it is not
+    kept running between tests
+    """
+    names = [probe.name for probe in readiness.settle_probes('inv')]
+    assert names == ['controller-stopped', 'log-quiet']
+    names = [probe.name for probe in readiness.settle_probes('inv',
+                                                controller_reused=True)]
+    assert names == ['log-quiet']
+
+def test_command_probe_argv():
+    """
+    Check a command probe runs an Ansible ad-hoc shell task
+    """
+    probe = readiness.controller_stopped_probe('testbed1.ini')
+    assert probe.argv() == ['ansible', 'controllers', '-m', 'shell',
+                            '-a', '! pgrep -f ryu-manager',
+                            '-i', 'testbed1.ini']
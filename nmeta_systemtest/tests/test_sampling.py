@@ -0,0 +1,125 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+nmeta_systemtest sampling.py Unit Tests
+"""
+
+import pytest
+
+import sampling
+
+CONSTRAINED = sampling.Threshold('constrained', '<', 200000)
+UNCONSTRAINED = sampling.Threshold('unconstrained', '>', 1000000)
+
+def run_verdict(thresholds, max_samples, samples):
+    """
+    Feed samples to a SequentialVerdict until it settles, and return
+    it. Fails the test if it asks for more samples than passed
+    """
+    verdict = sampling.SequentialVerdict(thresholds, max_samples)
+    for sample in samples:
+        verdict.add(sample)
+        if verdict.settled():
+            return verdict
+    pytest.fail("verdict not settled after %s samples" % len(samples))
+
+def test_confidence_interval():
+    """
+    Check the 95% confidence interval of the mean uses Student's t
+    """
+    mean, low, high = sampling.confidence_interval([1, 2, 3])
+    assert mean == 2
+    assert round(high - mean, 4) == round(4.303 / 3 ** 0.5, 4)
+    assert round(mean - low, 4) == round(high - mean, 4)
+
+def test_t_critical():
+    """
+    Check t critical values fall back to the normal distribution
+    beyond the table
+    """
+    assert sampling.t_critical(1) == 12.706
+    assert sampling.t_critical(30) == 2.042
+    assert sampling.t_critical(31) == sampling.Z_95
+
+def test_threshold():
+    """
+    Check single values are judged against a threshold
+    """
+    assert CONSTRAINED.passes(100000)
+    assert not CONSTRAINED.passes(200000)
+    assert UNCONSTRAINED.passes(5000000)
+    with pytest.raises(ValueError):
+        sampling.Threshold('bad', '=', 1)
+
+def test_clear_pass_settles_at_min_samples():
+    """
+    Check clear-cut passing samples settle after MIN_SAMPLES
+    """
+    verdict = run_verdict([CONSTRAINED, UNCONSTRAINED], 5,
+                    [{'constrained': 100000, 'unconstrained': 5000000},
+                     {'constrained': 101000, 'unconstrained': 5010000}])
+    assert verdict.count == sampling.MIN_SAMPLES
+    assert verdict.passed()
+
+def test_clear_fail_settles_at_min_samples():
+    """
+    Check one confidently failing measurement fails the verdict
+    while the others pass
+    """
+    verdict = run_verdict([CONSTRAINED, UNCONSTRAINED], 5,
+                    [{'constrained': 100000, 'unconstrained': 300000},
+                     {'constrained': 101000, 'unconstrained': 301000}])
+    assert verdict.count == sampling.MIN_SAMPLES
+    assert verdict.verdict == sampling.FAIL
+
+def test_noisy_samples_converge():
+    """
+    Check noisy samples close to the threshold take more samples
+    until the confidence interval clears it
+    """
+    values = [150000, 190000, 160000, 165000, 170000]
+    verdict = run_verdict([CONSTRAINED], 5, [{'constrained': value}
+                                                    for value in values])
+    assert verdict.count == 4
+    assert verdict.passed()
+
+def test_fallback_to_means_pass():
+    """
+    Check an unsettled verdict falls back to the mean once out of
+    samples
+    """
+    values = [100000, 290000, 150000]
+    verdict = run_verdict([CONSTRAINED], 3, [{'constrained': value}
+                                                    for value in values])
+    assert verdict.count == 3
+    assert verdict.passed()
+
+def test_fallback_to_means_fail():
+    """
+    Check the fallback fails when the mean is on the failing side
+    """
+    values = [150000, 300000, 220000]
+    verdict = run_verdict([CONSTRAINED], 3, [{'constrained': value}
+                                                    for value in values])
+    assert verdict.count == 3
+    assert verdict.verdict == sampling.FAIL
+
+def test_single_sample():
+    """
+    Check a single allowed sample is judged directly
+    """
+    verdict = run_verdict([CONSTRAINED], 1, [{'constrained': 250000}])
+    assert verdict.count == 1
+    assert verdict.verdict == sampling.FAIL
+    assert "constrained < 200000 value=250000" in verdict.describe()
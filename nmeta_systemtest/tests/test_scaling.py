@@ -0,0 +1,140 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+nmeta_systemtest scaling.py Unit Tests
+"""
+
+import logging
+
+import scaling
+
+logger = logging.getLogger(__name__)
+
+DURATION = 10
+
+def measure(flow_rate, loss=0.0, rtt_p99=0.005, achieved=1.0):
+    """
+    Return a synthetic Measurement of a step of one client
+    """
+    step = scaling.Step(1, flow_rate, 1)
+    sent = flow_rate * DURATION
+    received = int(round(sent * (1 - loss)))
+    return scaling.Measurement(step, sent, received,
+                                flow_rate * achieved, rtt_p99 / 2,
+                                rtt_p99, 1000000.0)
+
+def run_curve(curve):
+    """
+    Run a ramp over a synthetic curve of flow rate to Measurement,
+    returning (ramp, knee, flow rates of the steps run)
+    """
+    ramp = scaling.Ramp([scaling.Step(1, flow_rate, 1)
+                                            for flow_rate in sorted(curve)])
+    run = []
+    def run_step(step):
+        run.append(step.flow_rate)
+        return curve[step.flow_rate]
+    knee = scaling.run_ramp(logger, ramp, run_step)
+    return ramp, knee, run
+
+def test_knee_of_synthetic_curve():
+    """
+    Check the knee is the last sustained step before saturation,
+    and the ramp stops after consecutive saturated steps
+    """
+    curve = {10: measure(10), 20: measure(20), 50: measure(50),
+                100: measure(100, loss=0.05),
+                200: measure(200, loss=0.2), 500: measure(500, loss=0.5)}
+    ramp, knee, run = run_curve(curve)
+    assert knee.step.flow_rate == 50
+    assert run == [10, 20, 50, 100, 200]
+    assert ramp.done()
+
+def test_single_saturated_step_does_not_stop_ramp():
+    """
+    Check a one-off saturated step does not end the ramp, and the
+    knee is the highest sustained step
+    """
+    curve = {10: measure(10), 20: measure(20, loss=0.05), 50: measure(50),
+                100: measure(100, loss=0.05), 200: measure(200, loss=0.2)}
+    ramp, knee, run = run_curve(curve)
+    assert knee.step.flow_rate == 50
+    assert run == [10, 20, 50, 100, 200]
+
+def test_no_sustained_step():
+    """
+    Check there is no knee if every step saturates
+    """
+    curve = {10: measure(10, loss=0.5), 20: measure(20, loss=0.5)}
+    _, knee, _ = run_curve(curve)
+    assert knee is None
+
+def test_saturation_reasons():
+    """
+    Check loss, RTT relative to the first step and achieved flow
+    rate each saturate a step
+    """
+    ramp = scaling.Ramp([])
+    assert ramp.add(measure(10, rtt_p99=0.005)) is None
+    assert ramp.saturation(measure(20, loss=0.02)).startswith("loss=")
+    assert ramp.saturation(measure(20, rtt_p99=0.016)).startswith(
+                                                            "rtt_p99=")
+    assert ramp.saturation(measure(20, rtt_p99=0.014)) is None
+    assert ramp.saturation(measure(20, achieved=0.8)).startswith(
+                                                            "flow_rate=")
+
+def test_step_vars():
+    """
+    Check the flow rate of a step is split across its clients
+    """
+    assert scaling.step_vars(scaling.Step(2, 100, 4), DURATION) == {
+                            'clients': '2', 'streams': '4',
+                            'hping3_interval': '20000', 'hping3_count': '500'}
+    assert scaling.sent_per_client(scaling.Step(2, 100, 4), DURATION) == 500
+
+def test_mock_controller_knee(tmpdir):
+    """
+    Check a ramp against the mock controller finds a knee below its
+    capacity, higher for a more capable controller, and stops before
+    the last steps
+    """
+    knees = []
+    for capacity in (60, 300):
+        mock = scaling.MockController(capacity)
+        steps = scaling.default_steps()
+        ramp = scaling.Ramp(steps)
+        def run_step(step):
+            step_dir = tmpdir.mkdtemp()
+            mock.write_step(str(step_dir), step, 5)
+            return scaling.read_step(str(step_dir), step, 5)
+        knee = scaling.run_ramp(logger, ramp, run_step)
+        assert knee.step.flow_rate < capacity
+        assert len(ramp.results) < len(steps)
+        knees.append(knee.step.flow_rate)
+    assert knees[0] < knees[1]
+
+def test_write_csv(tmpdir):
+    """
+    Check each step is written with its saturation reason
+    """
+    ramp = scaling.Ramp([])
+    ramp.add(measure(10))
+    ramp.add(measure(20, loss=0.5))
+    filename = str(tmpdir.join('scaling_steps.csv'))
+    ramp.write_csv(filename)
+    with open(filename) as filehandle:
+        lines = filehandle.read().splitlines()
+    assert lines[0].endswith(",saturated")
+    assert lines[1].endswith(",")
+    assert lines[2].endswith(",loss=0.500")
@@ -0,0 +1,167 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Timing of where the time of an nmeta system test run goes.
+
+Phases of the harness (run setup, cases, playbooks, controller
+restarts, readiness waits, log checks, background analysis) are
+wrapped in spans, and the tasks of each playbook (including pauses
+and the iperf and hping3 runs) are added from the Ansible callback
+plugin in callback_plugins/. Spans are kept per thread, so each
+testbed worker and analysis thread is its own track, with the tasks
+of each host on a track of their own.
+
+The spans of a run are written in Chrome trace event format, which
+can be opened in chrome://tracing, Perfetto or speedscope as a
+timeline or flame graph, and the phases that took longest are
+logged. A long run such as a soak can keep only its latest spans,
+while the totals by name still cover the whole run.
+"""
+
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+#*** Phases logged as taking the most time in a run:
+SUMMARY_TOP = 15
+
+class Tracer(object):
+    """
+    Spans of a run, added to from any thread. A clock function may
+    be passed in for testing
+    """
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.started = clock()
+        #*** Spans as (name, category, start, seconds, track, args):
+        self.spans = []
+        #*** Count and seconds of every span by (name, category):
+        self._totals = collections.OrderedDict()
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def keep_latest(self, count):
+        """
+        Keep only the latest count spans for the trace from now on
+        """
+        with self._lock:
+            self.spans = collections.deque(self.spans, maxlen=count)
+
+    @contextlib.contextmanager
+    def span(self, name, category='harness', **args):
+        """
+        Context manager that adds the time spent in it as a span
+        on the current thread's track
+        """
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.add(name, category, start, self.clock() - start,
+                                                            args=args)
+
+    def add(self, name, category, start, seconds, track=None, args=None):
+        """
+        Add a span that started at a clock time and lasted seconds,
+        by default on the current thread's track
+        """
+        if track is None:
+            track = threading.current_thread().name
+        with self._lock:
+            self.spans.append((name, category, start, seconds, track,
+                                                            args or {}))
+            count, total = self._totals.get((name, category), (0, 0.0))
+            self._totals[(name, category)] = (count + 1, total + seconds)
+            self.count += 1
+
+    def add_tasks(self, filename):
+        """
+        Passed a full path filename of task timings written by the
+        Ansible callback plugin, add a span per task and host on a
+        track of the host under the current thread
+        """
+        if not os.path.isfile(filename):
+            return
+        thread = threading.current_thread().name
+        with open(filename) as filehandle:
+            for line in filehandle:
+                try:
+                    task = json.loads(line)
+                except ValueError:
+                    #*** Partly written line of a killed playbook:
+                    continue
+                self.add(task['task'], 'task', task['start'],
+                            task['end'] - task['start'],
+                            "%s %s" % (thread, task['host']),
+                            {'status': task['status']})
+
+    def totals(self, category=None):
+        """
+        Return a list of (name, category, count, seconds) of spans
+        by name, longest first, optionally of one category
+        """
+        with self._lock:
+            totals = list(self._totals.items())
+        return sorted(((name, span_category, count, seconds) for
+                        (name, span_category), (count, seconds) in totals
+                        if not category or span_category == category),
+                        key=lambda item: -item[3])
+
+    def write(self, filename):
+        """
+        Write the spans as a Chrome trace event JSON file
+        """
+        with self._lock:
+            spans = list(self.spans)
+            dropped = self.count - len(spans)
+        tracks = collections.OrderedDict()
+        events = []
+        for name, category, start, seconds, track, args in sorted(spans,
+                                                key=lambda span: span[2]):
+            tid = tracks.setdefault(track, len(tracks) + 1)
+            events.append({'name': name, 'cat': category, 'ph': 'X',
+                        'ts': int((start - self.started) * 1000000),
+                        'dur': int(seconds * 1000000), 'pid': 1,
+                        'tid': tid, 'args': args})
+        for track, tid in tracks.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1,
+                        'tid': tid, 'args': {'name': track}})
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'w') as filehandle:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                        'otherData': {'dropped_spans': dropped}},
+                        filehandle)
+        os.rename(temp_filename, filename)
+
+    def log_summary(self, logger, top=SUMMARY_TOP):
+        """
+        Log the spans that took the most time in total
+        """
+        logger.info("trace spans=%s over %.1fs", self.count,
+                                                self.clock() - self.started)
+        for name, category, count, seconds in self.totals()[:top]:
+            logger.info("trace %s=%s count=%s total=%.1fs mean=%.1fs",
+                        category, name, count, seconds, seconds / count)
+
+#*** Tracer of the run:
+TRACER = Tracer()
+
+def span(name, category='harness', **args):
+    """
+    Context manager that adds a span to the run's tracer
+    """
+    return TRACER.span(name, category, **args)